@@ -6,29 +6,73 @@ FastAPI server providing Bash and File tool endpoints
 import asyncio
 import os
 import re
+import json
+import time
 import base64
+import codecs
+import ctypes
+import errno
+import ctypes.util
+import fcntl
+import hashlib
+import io
+import heapq
+import fnmatch
+import gzip
+import mimetypes
 import shutil
+import stat
+import struct
+import sqlite3
 import inspect
+import itertools
+import queue
+import tarfile
+import tempfile
+import zipfile
+import zlib
+import threading
+import multiprocessing
 import aiofiles
 import aiofiles.os
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict
-from dataclasses import dataclass, fields, replace
-from typing import Any, ClassVar, Dict, List, Literal, Optional, get_args
-
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, ClassVar, Dict, Iterator, List, Literal, Optional, Set, Tuple, get_args
+
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from starlette.datastructures import Headers
 import uvicorn
 from pathlib import Path
 
+try:
+    import brotli
+except ImportError:  # Optional: without it, text assets are only precompressed with gzip
+    brotli = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: without it, image resizing is unavailable
+    Image = ImageOps = None
+
+try:
+    import zstandard
+except ImportError:  # Optional: without it, archives default to tar.gz
+    zstandard = None
+
 
 # Command types for file operations
 Command = Literal[
     "read", "write", "append", "delete", "exists", "list", "mkdir", "rmdir", "move", "copy",
-    "view", "create", "replace", "insert", "delete_lines", "undo", "grep"
+    "view", "create", "replace", "insert", "delete_lines", "undo", "redo", "grep", "search",
+    "read_many", "stat_many", "replace_across", "find"
 ]
 
 # Files and directories to exclude from serving/listing
@@ -45,45 +89,10 @@ EXCLUDED_PATTERNS = [
 ]
 
 
-def _is_excluded_path(path: Path) -> bool:
-    """Check if a path should be excluded from serving/listing."""
-    # Get the workspace directory for comparison
-    workspace_dir = WORKSPACE_DIR
-    
-    try:
-        # Resolve the path to handle any symlinks or relative paths
-        resolved_path = path.resolve()
-        workspace_resolved = workspace_dir.resolve()
-        
-        # Check if this is a root-level file/directory
-        # Get the relative path from workspace root
-        try:
-            relative_path = resolved_path.relative_to(workspace_resolved)
-        except ValueError:
-            # Path is not within workspace
-            return False
-            
-        # Get the first part of the path (root-level item)
-        parts = relative_path.parts
-        if not parts:
-            return False
-            
-        root_item = parts[0]
-        
-        # Check if the root item matches any excluded pattern
-        for pattern in EXCLUDED_PATTERNS:
-            if root_item == pattern:
-                return True
-                
-        # Also check for hidden files/directories at root level only
-        if root_item.startswith('.'):
-            return True
-            
-    except Exception:
-        # If there's any error in path resolution, don't exclude
-        return False
-        
-    return False
+def _is_excluded_root_item(name: str) -> bool:
+    """Check if a root-level workspace entry should be excluded from serving/listing."""
+    # Hidden files/directories are excluded at root level only
+    return name in EXCLUDED_PATTERNS or name.startswith('.')
 
 
 def _shorten(text: str, limit: int = 120) -> str:
@@ -100,6 +109,7 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    version: str | None = None  # Content version token of the file viewed or edited
 
     def __bool__(self):
         return any(getattr(self, field.name) for field in fields(self))
@@ -119,6 +129,7 @@ class ToolResult:
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            version=combine_fields(self.version, other.version, False),
         )
 
     def replace(self, **kwargs):
@@ -742,278 +753,5065 @@ class BashTool(BaseAnthropicTool):
         raise ToolError("no command provided.")
 
 
-# File Tool implementation
-class FileTool(BaseAnthropicTool):
-    """
-    A filesystem editor tool that allows the agent to view, create, and edit files.
+# Path matching
+GITIGNORE_FILE = ".gitignore"
+IgnoreChain = List[Tuple[str, "_GitIgnore"]]  # (directory relative to the root, its rules), outermost first
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a gitignore glob, already stripped of its leading and trailing slash, to a regex."""
+    segments = pattern.split("/")
+    out = []
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if segment == "**":
+            out.append(".*" if last else "(?:.*/)?")
+            continue
+        i = 0
+        while i < len(segment):
+            c = segment[i]
+            if c == "*":
+                while i + 1 < len(segment) and segment[i + 1] == "*":
+                    i += 1
+                out.append("[^/]*")
+            elif c == "?":
+                out.append("[^/]")
+            elif c == "\\" and i + 1 < len(segment):
+                i += 1
+                out.append(re.escape(segment[i]))
+            elif c == "[" and (end := segment.find("]", i + 2)) != -1:
+                body = segment[i + 1:end].replace("[", "\\[")
+                if body[0] in "!^":
+                    body = "^" + body[1:]
+                out.append(f"(?!/)[{body}]")
+                i = end
+            else:
+                out.append(re.escape(c))
+            i += 1
+        if not last:
+            out.append("/")
+    return "".join(out)
+
+
+class _GitIgnore:
+    """The rules of one .gitignore file, compiled into one regex for files and one for directories.
+
+    Alternatives are ordered last rule first, so the first one that matches is the rule git applies.
     """
 
-    name: ClassVar[Literal["file"]] = "file"
-    _file_history: Dict[Path, List[str]]  # Undo history for text edits
+    def __init__(self, text: str):
+        rules: List[Tuple[str, bool, bool]] = []  # (regex, negated, directory only)
+        for line in text.splitlines():
+            if not line or line.startswith("#"):
+                continue
+            stripped = line.rstrip(" ")
+            if stripped.endswith("\\") and len(stripped) < len(line):
+                stripped += " "  # "\ " keeps one trailing space
+            line = stripped
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+            regex = _glob_to_regex(line)
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            try:
+                re.compile(regex)
+            except re.error:
+                continue
+            rules.append((regex, negated, dir_only))
+        self._file_regex = self._compile([rule for rule in rules if not rule[2]])
+        self._dir_regex = self._compile(rules)
+
+    @staticmethod
+    def _compile(rules: List[Tuple[str, bool, bool]]) -> re.Pattern | None:
+        if not rules:
+            return None
+        return re.compile("|".join(
+            f"(?P<{'n' if negated else 'i'}{i}>{regex})" for i, (regex, negated, _) in enumerate(reversed(rules))
+        ))
+
+    def match(self, path: str, is_dir: bool) -> bool | None:
+        """True if *path* (relative to this file's directory) is ignored, False if re-included, None if no rule applies."""
+        regex = self._dir_regex if is_dir else self._file_regex
+        m = regex.fullmatch(path) if regex is not None else None
+        return None if m is None else m.lastgroup[0] == "i"
+
+
+class _PathMatcher:
+    """Decides which workspace paths are excluded; shared by listing, search and serving.
+
+    ``served`` applies the server's own root-level exclusions (EXCLUDED_PATTERNS and hidden items).
+    ``git_ignore`` applies nested .gitignore files as git does and always skips .git directories.
+    Compiled .gitignore files are cached until they change on disk.
+    """
 
-    def __init__(self, base_path: Path | None = None):
-        self._file_history = defaultdict(list)
-        self.base_path = base_path or Path.cwd()
-        # Note: We'll check/create the base_path in the first async call
-        super().__init__()
-    
-    async def _ensure_base_path_exists(self):
-        """Ensure base path exists - call this in async methods that need it"""
-        if not await aiofiles.os.path.exists(str(self.base_path)):
-            await asyncio.to_thread(self.base_path.mkdir, parents=True, exist_ok=True)
-    
-    async def _validate_path(self, path: str) -> Path:
+    def __init__(self, root: Path):
+        self.root = root
+        self.resolved_root = root.resolve()
+        self._ignore_files: Dict[str, Tuple[Tuple[int, int], _GitIgnore]] = {}
+
+    def relative(self, path: Path) -> str | None:
+        """Return *path* relative to the root in posix form ("" for the root), or None if it lies outside."""
+        if path.is_absolute():
+            for root in (self.resolved_root, self.root):
+                try:
+                    path = path.relative_to(root)
+                    break
+                except ValueError:
+                    continue
+            else:
+                return None
+        parts = [part for part in path.parts if part != "."]
+        if ".." in parts:
+            return None
+        return "/".join(parts)
+
+    def _rules(self, rel_dir: str) -> _GitIgnore | None:
+        path = os.path.join(self.root, rel_dir, GITIGNORE_FILE)
         try:
-            path_obj = Path(path)
-            full_path = path_obj if path_obj.is_absolute() else (self.base_path / path_obj).resolve()
-            # Allow access to the entire workspace area
-            if not str(full_path).startswith(str(self.base_path)):
-                raise ToolError("Path is outside the allowed base directory")
-            return full_path
-        except Exception as e:
-            raise ToolError(f"Invalid path: {str(e)}")
-        
-    async def __call__(self, command: Command, **kwargs) -> ToolResult:
+            st = os.stat(path)
+        except OSError:
+            self._ignore_files.pop(rel_dir, None)
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        cached = self._ignore_files.get(rel_dir)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
         try:
-            if command not in get_args(Command):
-                raise ToolError(f"Unsupported command: {command}. Supported commands: {', '.join(get_args(Command))}")
-            
-            method_map = {
-                "read": self.read, "write": self.write, "append": self.append, "delete": self.delete,
-                "exists": self.exists, "list": self.list_dir, "mkdir": self.mkdir, "rmdir": self.rmdir,
-                "move": self.move, "copy": self.copy, "view": self.view, "create": self.create,
-                "replace": self.replace, "insert": self.insert, "delete_lines": self.delete_lines,
-                "undo": self.undo, "grep": self.grep
-            }
-            
-            if command not in method_map:
-                raise ToolError(f"Command '{command}' is valid but not implemented")
-                
-            method = method_map[command]
-            
-            # Filter kwargs to only include parameters that the method accepts
-            sig = inspect.signature(method)
-            valid_params = set(sig.parameters.keys())
-            filtered_kwargs = {k: v for k, v in kwargs.items() if k in valid_params}
-            
-            return await method(**filtered_kwargs)
-        except ToolError as e:
-            return ToolResult(error=str(e))
-        except Exception as e:
-            return ToolResult(error=f"Unexpected error: {str(e)}")
+            with open(path, encoding="utf-8", errors="replace") as f:
+                rules = _GitIgnore(f.read())
+        except OSError:
+            return None
+        self._ignore_files[rel_dir] = (signature, rules)
+        return rules
+
+    def scope(self, chain: IgnoreChain, rel_dir: str, has_ignore_file: bool = True) -> IgnoreChain:
+        """Extend *chain* with the .gitignore in *rel_dir*, if there is one."""
+        rules = self._rules(rel_dir) if has_ignore_file else None
+        return chain + [(rel_dir, rules)] if rules is not None else chain
+
+    def chain(self, rel_dir: str) -> IgnoreChain:
+        """Return the .gitignore rules in effect inside *rel_dir*."""
+        chain = self.scope([], "")
+        parts = rel_dir.split("/") if rel_dir else []
+        for i in range(1, len(parts) + 1):
+            chain = self.scope(chain, "/".join(parts[:i]))
+        return chain
+
+    @staticmethod
+    def ignored(chain: IgnoreChain, rel: str, is_dir: bool) -> bool:
+        """Check *rel* against *chain*; the deepest .gitignore with a matching rule decides."""
+        if is_dir and rel.rpartition("/")[2] == ".git":
+            return True
+        for base, rules in reversed(chain):
+            decision = rules.match(rel[len(base) + 1:] if base else rel, is_dir)
+            if decision is not None:
+                return decision
+        return False
 
-    async def read(self, path: str, mode: str = "text", encoding: str = "utf-8", line_numbers: bool = True) -> ToolResult:
-        """Read the content of a file in text or binary mode."""
-        full_path = await self._validate_path(path)
-        if not await aiofiles.os.path.isfile(str(full_path)):
-            raise ToolError("Path is not a file")
-        try:
-            if mode == "text":
-                async with aiofiles.open(str(full_path), 'r', encoding=encoding) as f:
-                    content = await f.read()
-                if line_numbers:
-                    numbered_content = "\n".join(
-                        f"{str(i + 1).rjust(6)}\t{line}" for i, line in enumerate(content.splitlines())
-                    )
-                    return ToolResult(output=numbered_content)
-                return ToolResult(output=content)
-            elif mode == "binary":
-                async with aiofiles.open(str(full_path), 'rb') as f:
-                    binary_content = await f.read()
-                content = base64.b64encode(binary_content).decode()
-                return ToolResult(output=content, system="binary")
-            else:
-                raise ToolError("Invalid mode: choose 'text' or 'binary'")
-        except Exception as e:
-            raise ToolError(f"Failed to read file: {str(e)}")
+    def excludes(self, chain: IgnoreChain, rel: str, is_dir: bool, served: bool, git_ignore: bool) -> bool:
+        """Check one entry whose parent directory is known not to be excluded."""
+        if served and "/" not in rel and _is_excluded_root_item(rel):
+            return True
+        return git_ignore and self.ignored(chain, rel, is_dir)
 
-    async def write(self, path: str, content: str, mode: str = "text", encoding: str = "utf-8") -> ToolResult:
-        """Write content to a file, overwriting if it exists."""
-        full_path = await self._validate_path(path)
-        try:
-            await self._ensure_base_path_exists()
-            await asyncio.to_thread(full_path.parent.mkdir, parents=True, exist_ok=True)
-            if mode == "text":
-                async with aiofiles.open(str(full_path), 'w', encoding=encoding) as f:
-                    await f.write(content)
-            elif mode == "binary":
-                decoded_content = base64.b64decode(content)
-                async with aiofiles.open(str(full_path), 'wb') as f:
-                    await f.write(decoded_content)
-            else:
-                raise ToolError("Invalid mode: choose 'text' or 'binary'")
-            return ToolResult(output=f"File written to {path}")
-        except Exception as e:
-            raise ToolError(f"Failed to write file: {str(e)}")
+    def is_excluded(self, path: Path, is_dir: bool = False, served: bool = True, git_ignore: bool = False) -> bool:
+        """Check a single path, including whether one of its parent directories is excluded."""
+        rel = self.relative(path)
+        if not rel:
+            return False
+        parts = rel.split("/")
+        if served and _is_excluded_root_item(parts[0]):
+            return True
+        if not git_ignore:
+            return False
+        chain: IgnoreChain = []
+        for i in range(len(parts)):
+            chain = self.scope(chain, "/".join(parts[:i]))
+            if self.ignored(chain, "/".join(parts[:i + 1]), is_dir or i < len(parts) - 1):
+                return True
+        return False
 
-    async def append(self, path: str, content: str, mode: str = "text", encoding: str = "utf-8") -> ToolResult:
-        """Append content to an existing file or create it if it doesn't exist."""
-        full_path = await self._validate_path(path)
-        try:
-            await self._ensure_base_path_exists()
-            if mode == "text":
-                async with aiofiles.open(str(full_path), 'a', encoding=encoding) as f:
-                    await f.write(content)
-            elif mode == "binary":
-                decoded_content = base64.b64decode(content)
-                async with aiofiles.open(str(full_path), 'ab') as f:
-                    await f.write(decoded_content)
-            else:
-                raise ToolError("Invalid mode: choose 'text' or 'binary'")
-            return ToolResult(output=f"Appended to file {path}")
-        except Exception as e:
-            raise ToolError(f"Failed to append to file: {str(e)}")
+    def entry_filter(self, directory: Path, served: bool = False, git_ignore: bool = False) -> Callable[[str, bool], bool]:
+        """Return a predicate telling whether the entry (name, is_dir) of *directory* is excluded."""
+        rel_dir = self.relative(directory)
+        if rel_dir is None:
+            return lambda name, is_dir: False
+        chain = self.chain(rel_dir) if git_ignore else []
+        prefix = rel_dir + "/" if rel_dir else ""
+        return lambda name, is_dir: self.excludes(chain, prefix + name, is_dir, served, git_ignore)
+
+    def filter_files(self, paths: List[str], served: bool = False, git_ignore: bool = True) -> List[str]:
+        """Drop excluded files from *paths*, evaluating each directory once."""
+        directories: Dict[str, Tuple[bool, IgnoreChain]] = {"": (False, self.scope([], "") if git_ignore else [])}
+
+        def directory(rel_dir: str) -> Tuple[bool, IgnoreChain]:
+            if rel_dir not in directories:
+                excluded, chain = directory(rel_dir.rpartition("/")[0])
+                excluded = excluded or self.excludes(chain, rel_dir, True, served, git_ignore)
+                if git_ignore and not excluded:
+                    chain = self.scope(chain, rel_dir)
+                directories[rel_dir] = (excluded, chain)
+            return directories[rel_dir]
+
+        kept = []
+        for path in paths:
+            rel = self.relative(Path(path))
+            if rel is None:
+                kept.append(path)
+                continue
+            excluded, chain = directory(rel.rpartition("/")[0])
+            if not excluded and not self.excludes(chain, rel, False, served, git_ignore):
+                kept.append(path)
+        return kept
+
+    def walk(self, start: Path, served: bool = False, git_ignore: bool = True) -> Iterator[str]:
+        """Yield files under *start* depth-first in name order, never descending into excluded directories.
+
+        *start* itself is walked even when excluded, as a path named explicitly.
+        """
+        rel = self.relative(start)
+        if rel is None:
+            yield from _iter_files(start)
+            return
+        chain = self.chain(rel.rpartition("/")[0]) if git_ignore and rel else []
+        yield from self._walk(start, rel, chain, served, git_ignore)
 
-    async def delete(self, path: str, recursive: bool = False) -> ToolResult:
-        """Delete a file or directory, optionally recursively."""
-        full_path = await self._validate_path(path)
+    def _walk(self, directory: Path, rel_dir: str, chain: IgnoreChain, served: bool, git_ignore: bool) -> Iterator[str]:
         try:
-            if await aiofiles.os.path.isfile(str(full_path)):
-                await aiofiles.os.remove(str(full_path))
-            elif await aiofiles.os.path.isdir(str(full_path)):
-                if recursive:
-                    await asyncio.to_thread(shutil.rmtree, str(full_path))
-                else:
-                    await aiofiles.os.rmdir(str(full_path))
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            return
+        if git_ignore:
+            chain = self.scope(chain, rel_dir, any(entry.name == GITIGNORE_FILE for entry in entries))
+        prefix = rel_dir + "/" if rel_dir else ""
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            rel = prefix + entry.name
+            if self.excludes(chain, rel, is_dir, served, git_ignore):
+                continue
+            if is_dir:
+                yield from self._walk(Path(entry.path), rel, chain, served, git_ignore)
             else:
-                raise ToolError("Path does not exist")
-            self._file_history.pop(full_path, None)  # Clear undo history
-            return ToolResult(output=f"Deleted {path}")
-        except Exception as e:
-            raise ToolError(f"Failed to delete: {str(e)}")
+                yield entry.path
 
-    async def exists(self, path: str) -> ToolResult:
-        """Check if a path exists."""
-        try:
-            full_path = await self._validate_path(path)
-            exists = await aiofiles.os.path.exists(str(full_path))
-            return ToolResult(output=str(exists))
-        except Exception as e:
-            return ToolResult(error=f"Failed to check existence: {str(e)}")
 
-    async def list_dir(self, path: str) -> ToolResult:
-        """List the contents of a directory."""
-        full_path = await self._validate_path(path)
-        if not await aiofiles.os.path.isdir(str(full_path)):
-            raise ToolError("Path is not a directory")
-        try:
-            contents = []
-            items = await asyncio.to_thread(list, full_path.iterdir())
-            for p in sorted(items):
-                if await aiofiles.os.path.isdir(str(p)):
-                    contents.append(f"{p.name}/")
-                else:
-                    contents.append(p.name)
-            return ToolResult(output="\n".join(contents))
-        except Exception as e:
-            raise ToolError(f"Failed to list directory: {str(e)}")
+# Grep engine
+GREP_CHUNK_SIZE = 1024 * 1024  # Bytes read per block when scanning a file
+GREP_BATCH_SIZE = 64  # Files handed to a worker process at a time
+GREP_MAX_WORKERS = os.cpu_count() or 1
 
-    async def mkdir(self, path: str) -> ToolResult:
-        """Create a directory, including parent directories if needed."""
-        full_path = await self._validate_path(path)
-        try:
-            await self._ensure_base_path_exists()
-            await asyncio.to_thread(full_path.mkdir, parents=True, exist_ok=True)
-            return ToolResult(output=f"Directory created: {path}")
-        except Exception as e:
-            raise ToolError(f"Failed to create directory: {str(e)}")
+_grep_pool: ProcessPoolExecutor | None = None
 
-    async def rmdir(self, path: str) -> ToolResult:
-        """Remove an empty directory."""
-        full_path = await self._validate_path(path)
-        try:
-            await self._ensure_base_path_exists()
-            await aiofiles.os.rmdir(str(full_path))
-            return ToolResult(output=f"Directory removed: {path}")
-        except Exception as e:
-            raise ToolError(f"Failed to remove directory: {str(e)}")
+GrepRecord = Tuple[int, str, bool]  # (1-based line number, stripped line, is_match) within one file
+GrepLine = Tuple[str, int, str, bool]  # (file path, line number, stripped line, is_match)
 
-    async def move(self, src: str, dst: str) -> ToolResult:
-        """Move or rename a file or directory."""
-        src_path = await self._validate_path(src)
-        dst_path = await self._validate_path(dst)
-        try:
-            await self._ensure_base_path_exists()
-            await asyncio.to_thread(dst_path.parent.mkdir, parents=True, exist_ok=True)
-            await asyncio.to_thread(src_path.rename, dst_path)
-            if src_path in self._file_history:
-                self._file_history[dst_path] = self._file_history.pop(src_path)
-            return ToolResult(output=f"Moved {src} to {dst}")
-        except Exception as e:
-            raise ToolError(f"Failed to move: {str(e)}")
 
-    async def copy(self, src: str, dst: str) -> ToolResult:
-        """Copy a file or directory."""
-        src_path = await self._validate_path(src)
-        dst_path = await self._validate_path(dst)
-        try:
-            await self._ensure_base_path_exists()
-            await asyncio.to_thread(dst_path.parent.mkdir, parents=True, exist_ok=True)
-            if await aiofiles.os.path.isfile(str(src_path)):
-                await asyncio.to_thread(shutil.copy2, str(src_path), str(dst_path))
-            elif await aiofiles.os.path.isdir(str(src_path)):
-                await asyncio.to_thread(shutil.copytree, str(src_path), str(dst_path))
-            else:
-                raise ToolError("Source path does not exist")
-            return ToolResult(output=f"Copied {src} to {dst}")
-        except Exception as e:
-            raise ToolError(f"Failed to copy: {str(e)}")
+class _BinaryFile(Exception):
+    """Raised while reading a file that turns out to contain NUL bytes."""
 
-    async def view(
-        self,
-        path: str,
-        view_range: Optional[List[int]] = None,
-        line_numbers: bool = True,
-    ) -> ToolResult:
-        full_path = await self._validate_path(path)
-        if await aiofiles.os.path.isdir(str(full_path)):
-            if view_range:
-                raise ToolError("view_range not applicable for directories")
-            # List directory contents using pathlib
-            contents = []
-            try:
-                items = await asyncio.to_thread(list, full_path.iterdir())
-                for item in sorted(items):
-                    if await aiofiles.os.path.isdir(str(item)):
-                        contents.append(f"  {item.name}/")
-                    else:
-                        contents.append(f"  {item.name}")
-                output = f"Directory contents of {path}:\n" + "\n".join(contents)
-                return ToolResult(output=output)
-            except Exception as e:
-                raise ToolError(f"Failed to list directory: {str(e)}")
-        
+
+def _get_grep_pool() -> ProcessPoolExecutor:
+    """Return the shared worker pool used for multi-file searches, creating it on first use."""
+    global _grep_pool
+    if _grep_pool is None:
+        # "spawn" keeps the children independent of the server's event loop and threads
+        _grep_pool = ProcessPoolExecutor(
+            max_workers=GREP_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _grep_pool
+
+
+def _compile_grep_pattern(pattern: str, flags: int) -> Tuple[re.Pattern, re.Pattern | None]:
+    """Compile *pattern* once, plus a MULTILINE variant used to locate candidate lines in whole blocks."""
+    regex = re.compile(pattern, flags)
+    # \A and \Z anchor to each line when matching line-by-line, which block scanning can't emulate
+    if r"\A" in pattern or r"\Z" in pattern:
+        return regex, None
+    return regex, re.compile(pattern, flags | re.MULTILINE)
+
+
+def _iter_text_blocks(f):
+    """Yield the file as UTF-8 text blocks that always end on a line boundary."""
+    carry = b""
+    while True:
+        chunk = f.read(GREP_CHUNK_SIZE)
+        if b"\0" in chunk:
+            raise _BinaryFile()
+        if not chunk:
+            if carry:
+                yield carry.decode("utf-8")
+            return
+        data = carry + chunk
+        cut = data.rfind(b"\n")
+        if cut == -1:
+            carry = data
+            continue
+        carry = data[cut + 1:]
+        yield data[:cut + 1].decode("utf-8")
+
+
+def _split_lines(text: str):
+    """Split on "\n" only (keeping it), so numbering agrees with ripgrep."""
+    pieces = text.split("\n")
+    last = pieces.pop()
+    for piece in pieces:
+        yield piece + "\n"
+    if last:
+        yield last
+
+
+def _scan_block(
+    text: str, regex: re.Pattern, prefilter: re.Pattern | None, first_line: int, out: List[GrepRecord], limit: int
+) -> None:
+    """Append matching lines of *text* to *out* until it holds *limit* records (0 = unlimited)."""
+    if prefilter is None:
+        for i, line in enumerate(_split_lines(text)):
+            if regex.search(line.replace("\r\n", "\n")):
+                out.append((first_line + i, line.strip(), True))
+                if limit and len(out) >= limit:
+                    return
+        return
+
+    pos = 0
+    counted = 0
+    line_no = first_line
+    length = len(text)
+    while pos < length:
+        m = prefilter.search(text, pos)
+        if not m:
+            break
+        start = text.rfind("\n", 0, m.start()) + 1
+        end = text.find("\n", m.start())
+        end = length if end == -1 else end + 1
+        line_no += text.count("\n", counted, start)
+        counted = start
+        line = text[start:end]
+        # Verify against the original pattern; the block match may have spanned lines
+        if regex.search(line.replace("\r\n", "\n")):
+            out.append((line_no, line.strip(), True))
+            if limit and len(out) >= limit:
+                return
+        pos = end
+
+
+def _grep_file(
+    path: str,
+    regex: re.Pattern,
+    prefilter: re.Pattern | None,
+    max_count: int = 0,
+    before: int = 0,
+    after: int = 0,
+) -> List[GrepRecord]:
+    """Search one file in large blocks, skipping binary (NUL-containing) and non-UTF-8 files.
+
+    At most *max_count* matches are reported (0 = unlimited), each with up to *before*/*after*
+    lines of surrounding context.
+    """
+    records: List[GrepRecord] = []
+    try:
+        with open(path, "rb") as f:
+            line_no = 1
+            if not (before or after):
+                for text in _iter_text_blocks(f):
+                    _scan_block(text, regex, prefilter, line_no, records, max_count)
+                    if max_count and len(records) >= max_count:
+                        break
+                    line_no += text.count("\n")
+                return records
+
+            history: deque = deque(maxlen=before or None)
+            after_left = 0
+            matched = 0
+            for text in _iter_text_blocks(f):
+                for line in _split_lines(text):
+                    if (not max_count or matched < max_count) and regex.search(line.replace("\r\n", "\n")):
+                        if before:
+                            records.extend((n, prior, False) for n, prior in history)
+                            history.clear()
+                        records.append((line_no, line.strip(), True))
+                        matched += 1
+                        after_left = after
+                    elif after_left:
+                        records.append((line_no, line.strip(), False))
+                        after_left -= 1
+                    elif max_count and matched >= max_count:
+                        return records
+                    elif before:
+                        history.append((line_no, line.strip()))
+                    line_no += 1
+    except (_BinaryFile, UnicodeDecodeError, OSError):
+        return []
+    return records if any(is_match for _, _, is_match in records) else []
+
+
+def _grep_batch(
+    paths: List[str], pattern: str, flags: int, max_count: int = 0, before: int = 0, after: int = 0
+) -> List[Tuple[str, List[GrepRecord]]]:
+    """Worker entry point: search a batch of files, returning only those with matches."""
+    regex, prefilter = _compile_grep_pattern(pattern, flags)
+    results = []
+    for path in paths:
+        records = _grep_file(path, regex, prefilter, max_count, before, after)
+        if records:
+            results.append((path, records))
+    return results
+
+
+def _iter_files(root: Path, skip_dirs: Set[str] | frozenset = frozenset()):
+    """Yield regular files under *root* depth-first in name order, without following directory symlinks."""
+    try:
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
         try:
-            async with aiofiles.open(str(full_path), 'r', encoding='utf-8', errors='replace') as f:
-                content = await f.read()
-            if view_range:
-                lines = content.splitlines()
-                start, end = view_range
-                # Allow negative offsets: -1 refers to the last line, -2 the line before, etc.
-                if start < 0:
-                    start = len(lines) + start + 1  # convert to 1-indexed positive
-                if end < 0:
-                    end = len(lines) + end + 1
-                if start < 1 or start > len(lines) or end < start or end > len(lines):
-                    raise ToolError(f"Invalid view_range: {view_range}. File has {len(lines)} lines, but requested range is [{start}, {end}]")
-                content = "\n".join(lines[start - 1 : end])
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in skip_dirs:
+                    yield from _iter_files(Path(entry.path), skip_dirs)
+            elif entry.is_file():
+                yield entry.path
+        except OSError:
+            continue
 
-            if line_numbers:
-                start_num = view_range[0] if view_range else 1
-                numbered_content = "\n".join(
-                    f"{str(start_num + i).rjust(6)}\t{line}" for i, line in enumerate(content.splitlines())
-                )
-                return ToolResult(output=numbered_content)
 
-            return ToolResult(output=content)
-        except Exception as e:
-            raise ToolError(f"Failed to view file: {str(e)}")
+async def _grep_paths(
+    paths: List[str], pattern: str, flags: int, max_count: int = 0, before: int = 0, after: int = 0
+) -> AsyncIterator[GrepLine]:
+    """Search the given files in order, keeping a bounded number of batches in flight in the worker pool.
 
-    async def create(self, path: str, content: str, mode: str = "text", encoding: str = "utf-8") -> ToolResult:
-        """Create a new file with the given content, failing if it already exists."""
-        full_path = await self._validate_path(path)
-        if await aiofiles.os.path.exists(str(full_path)):
-            raise ToolError("File already exists")
+    Closing the iterator early cancels the batches that have not started yet.
+    """
+    batches = [paths[i:i + GREP_BATCH_SIZE] for i in range(0, len(paths), GREP_BATCH_SIZE)]
+    if len(batches) <= 1:
+        found = await asyncio.to_thread(_grep_batch, paths, pattern, flags, max_count, before, after)
+        for file_path, records in found:
+            for line_no, line, is_match in records:
+                yield file_path, line_no, line, is_match
+        return
+
+    loop = asyncio.get_running_loop()
+    pool = _get_grep_pool()
+    remaining = iter(batches)
+    pending: deque = deque()
+
+    def submit() -> None:
+        batch = next(remaining, None)
+        if batch is not None:
+            pending.append(loop.run_in_executor(pool, _grep_batch, batch, pattern, flags, max_count, before, after))
+
+    try:
+        for _ in range(GREP_MAX_WORKERS * 2):
+            submit()
+        while pending:
+            found = await pending.popleft()
+            submit()
+            for file_path, records in found:
+                for line_no, line, is_match in records:
+                    yield file_path, line_no, line, is_match
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def _grep_stream(
+    pattern: str,
+    target: Path,
+    case_sensitive: bool,
+    max_count: int = 0,
+    before: int = 0,
+    after: int = 0,
+    matcher: _PathMatcher | None = None,
+) -> AsyncIterator[GrepLine]:
+    """Search a file or directory tree in path order, preferring ``rg --json`` for directories.
+
+    With a *matcher*, gitignored files are skipped and ignored directories are never entered.
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    if target.is_file():
+        async for item in _grep_paths([str(target)], pattern, flags, max_count, before, after):
+            yield item
+        return
+
+    rg = shutil.which("rg")
+    if rg:
+        cmd = [rg, "--json", "--hidden", "--no-config", "--sort", "path"]
+        if matcher is None:
+            cmd.append("--no-ignore")
+        else:
+            # Only .gitignore files inside the workspace count, as for _PathMatcher
+            cmd += [
+                "--no-ignore-dot", "--no-ignore-exclude", "--no-ignore-global", "--no-ignore-parent",
+                "--no-require-git", "--glob", "!.git",
+            ]
+        if not case_sensitive:
+            cmd.append("--ignore-case")
+        if max_count:
+            cmd += ["--max-count", str(max_count)]
+        if before:
+            cmd += ["--before-context", str(before)]
+        if after:
+            cmd += ["--after-context", str(after)]
+        cmd += ["-e", pattern, "--", str(target)]
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=16 * 1024 * 1024,
+        )
+        completed = False
+        try:
+            assert proc.stdout
+            async for raw in proc.stdout:
+                message = json.loads(raw)
+                kind = message["type"]
+                if kind == "summary":
+                    completed = True
+                elif kind in ("match", "context"):
+                    data = message["data"]
+                    path = data["path"].get("text") or os.fsdecode(base64.b64decode(data["path"]["bytes"]))
+                    text = data["lines"].get("text")
+                    if text is None:
+                        text = base64.b64decode(data["lines"]["bytes"]).decode(errors="replace")
+                    yield path, data["line_number"], text.strip(), kind == "match"
+            await proc.wait()
+        finally:
+            # Early termination by the consumer stops the search instead of letting rg run to completion
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        # Exit code 2 without a summary means rg could not run the search (e.g. unsupported regex syntax)
+        if completed or proc.returncode != 2:
+            return
+
+    walk = _iter_files(target) if matcher is None else matcher.walk(target)
+    paths = await asyncio.to_thread(list, walk)
+    async for item in _grep_paths(paths, pattern, flags, max_count, before, after):
+        yield item
+
+
+class _GrepPager:
+    """Apply offset/cursor/limit pagination to an ordered stream of grep lines.
+
+    Pagination counts matches only; context lines travel with the match they belong to.
+    A cursor is an opaque token naming the last match returned, so the next page resumes after it.
+    """
+
+    def __init__(
+        self,
+        base_path: Path,
+        max_results: int | None = None,
+        offset: int = 0,
+        cursor: str | None = None,
+        before: int = 0,
+        after: int = 0,
+    ):
+        if max_results is not None and max_results < 1:
+            raise ToolError("max_results must be at least 1")
+        if offset < 0:
+            raise ToolError("offset must not be negative")
+        self.base_path = base_path
+        self.max_results = max_results
+        self.offset = offset
+        self.before = before
+        self.after = after
+        self.matches = 0
+        self.next_cursor: str | None = None
+        self._resume_after = None
+        if cursor:
+            try:
+                rel, line_no = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+                self._resume_after = (Path(rel).parts, int(line_no))
+            except (ValueError, TypeError):
+                raise ToolError("Invalid cursor")
+
+    def _key(self, path: str, line_no: int):
+        return Path(path).relative_to(self.base_path).parts, line_no
+
+    def _cursor(self, path: str, line_no: int) -> str:
+        rel = Path(path).relative_to(self.base_path).as_posix()
+        return base64.urlsafe_b64encode(json.dumps([rel, line_no]).encode()).decode()
+
+    async def __call__(self, stream: AsyncIterator[GrepLine]) -> AsyncIterator[GrepLine]:
+        skipped = 0
+        pending: List[GrepLine] = []  # Context lines seen since the last match
+        last: GrepLine | None = None
+        try:
+            async for item in stream:
+                path, line_no, _, is_match = item
+                if not is_match:
+                    if last is not None and path == last[0] and line_no <= last[1] + self.after:
+                        yield item
+                    elif self.before:
+                        pending.append(item)
+                        del pending[:-self.before]
+                    continue
+
+                if self._resume_after is not None and self._key(path, line_no) <= self._resume_after:
+                    pending.clear()
+                    continue
+                if skipped < self.offset:
+                    skipped += 1
+                    pending.clear()
+                    continue
+                if self.max_results is not None and self.matches >= self.max_results:
+                    self.next_cursor = self._cursor(last[0], last[1])
+                    return
+                for context in pending:
+                    if context[0] == path and context[1] >= line_no - self.before:
+                        yield context
+                pending.clear()
+                yield item
+                self.matches += 1
+                last = item
+        finally:
+            # Closing the source stops any scans still in flight
+            await stream.aclose()
+
+
+# Filesystem watching
+FsListener = Callable[[str, Path, Optional[Path]], None]  # (kind, path, dest) with kind in create/modify/delete/move/rescan
+
+
+class _InotifyWatcher:
+    """Recursive inotify watch over a directory tree that dispatches change events to listeners.
+
+    New directories are watched from a worker thread, so a large tree appearing at once (npm
+    install) doesn't stall the event loop. Once the kernel's watch limit is reached the watch is
+    ``exhausted``: parts of the tree go unwatched, and callers should re-check them as if
+    inotify were unavailable.
+    """
+
+    _IN_MODIFY = 0x00000002
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_IGNORED = 0x00008000
+    _IN_ONLYDIR = 0x01000000
+    _IN_ISDIR = 0x40000000
+    _WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, root: Path, skip_dirs: Set[str] | frozenset = frozenset()):
+        self.root = root
+        self._skip_dirs = skip_dirs
+        self._fd: int | None = None
+        self._libc = None
+        self._wds: Dict[int, Path] = {}
+        self._wds_lock = threading.Lock()  # Directories are added to it from worker threads
+        self._listeners: List[FsListener] = []
+        self._start_lock: asyncio.Lock | None = None
+        self._exhausted = False
+
+    @property
+    def running(self) -> bool:
+        return self._fd is not None
+
+    @property
+    def exhausted(self) -> bool:
+        return self._exhausted
+
+    def add_listener(self, callback: FsListener) -> None:
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: FsListener) -> None:
+        self._listeners.remove(callback)
+
+    async def start(self) -> bool:
+        """Start watching; returns False when inotify is unavailable on this platform."""
+        if self._fd is not None:
+            return True
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._fd is not None:
+                return True
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            except (OSError, AttributeError):
+                return False
+            if fd < 0:
+                return False
+            self._libc = libc
+            await asyncio.to_thread(self._watch_tree, fd, self.root)
+            self._fd = fd
+            asyncio.get_running_loop().add_reader(fd, self._on_readable)
+        return True
+
+    def _watch_tree(self, fd: int, *tops: Path) -> None:
+        """Add a watch for each of *tops* and every directory beneath them."""
+        stack = list(tops)
+        while stack and not self._exhausted:
+            directory = stack.pop()
+            wd = self._libc.inotify_add_watch(fd, os.fsencode(directory), self._WATCH_MASK)
+            if wd < 0:
+                # ENOSPC means fs.inotify.max_user_watches is exhausted; keep what we have
+                if ctypes.get_errno() == 28:
+                    self._exhausted = True
+                continue
+            with self._wds_lock:
+                self._wds[wd] = directory
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.name not in self._skip_dirs and entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+            except OSError:
+                continue
+
+    def _rename_watches(self, src: Path, dst: Path) -> None:
+        for wd, watched in list(self._wds.items()):
+            if watched == src or src in watched.parents:
+                self._wds[wd] = dst / watched.relative_to(src)
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return
+
+        events: List[List[Any]] = []
+        pending_moves: Dict[int, List[Any]] = {}
+        new_dirs: List[Path] = []
+        with self._wds_lock:
+            self._parse_events(data, events, pending_moves, new_dirs)
+
+        # A move whose destination is outside the watched tree is a delete from our point of view
+        for event in pending_moves.values():
+            event[0] = "delete"
+
+        if new_dirs:
+            asyncio.get_running_loop().run_in_executor(None, self._watch_tree, self._fd, *new_dirs)
+        for kind, path, dest in events:
+            self._dispatch(kind, path, dest)
+
+    def _parse_events(
+        self, data: bytes, events: List[List[Any]], pending_moves: Dict[int, List[Any]], new_dirs: List[Path]
+    ) -> None:
+        """Decode a read of inotify events into [kind, path, dest] *events*, noting directories that need watches."""
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & self._IN_Q_OVERFLOW:
+                events.append(["rescan", self.root, None])
+                continue
+            if mask & self._IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            parent = self._wds.get(wd)
+            if parent is None or not name:
+                continue
+            path = parent / os.fsdecode(name)
+            is_dir = bool(mask & self._IN_ISDIR)
+            if is_dir and path.name in self._skip_dirs:
+                continue
+
+            if mask & self._IN_MOVED_FROM:
+                event = ["move", path, None]
+                pending_moves[cookie] = event
+                events.append(event)
+            elif mask & self._IN_MOVED_TO:
+                event = pending_moves.pop(cookie, None)
+                if event is not None:
+                    event[2] = path
+                    if is_dir:
+                        self._rename_watches(event[1], path)
+                else:
+                    events.append(["create", path, None])
+                    if is_dir:
+                        new_dirs.append(path)
+            elif mask & self._IN_CREATE:
+                events.append(["create", path, None])
+                if is_dir:
+                    new_dirs.append(path)
+            elif mask & self._IN_DELETE:
+                events.append(["delete", path, None])
+            elif mask & (self._IN_MODIFY | self._IN_CLOSE_WRITE):
+                if not events or events[-1] != ["modify", path, None]:
+                    events.append(["modify", path, None])
+
+    def _dispatch(self, kind: str, path: Path, dest: Path | None) -> None:
+        for callback in self._listeners:
+            try:
+                callback(kind, path, dest)
+            except Exception:
+                pass
+
+
+# Trigram content index
+CACHE_DIR = Path(os.environ.get("BASH_SERVER_CACHE_DIR", str(Path.home() / ".cache" / "bash_server")))
+INDEX_MAX_FILE_SIZE = 1024 * 1024  # Larger files are kept as always-candidates instead of being indexed
+INDEX_SKIP_DIRS = frozenset({".git", ".gitscout", "node_modules", "__pycache__"})
+INDEX_FLUSH_DELAY = 0.5  # Seconds to coalesce change events before re-indexing
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+
+def _file_trigrams(path: str) -> Tuple[int, int, List[int] | None]:
+    """Return (mtime_ns, size, trigrams) for *path*; trigrams is None when the file is too large to index."""
+    st = os.stat(path)
+    if st.st_size > INDEX_MAX_FILE_SIZE:
+        return st.st_mtime_ns, st.st_size, None
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\0" in data:
+        # Binary files are never grep matches, so they need no postings
+        return st.st_mtime_ns, st.st_size, []
+    data = data.lower()
+    grams = {data[i:i + 3] for i in range(len(data) - 2)}
+    return st.st_mtime_ns, st.st_size, [int.from_bytes(g, "big") for g in grams]
+
+
+def _index_batch(paths: List[str]) -> List[Tuple[str, int, int, List[int] | None]]:
+    """Worker entry point: compute trigrams for a batch of files, skipping ones that vanished."""
+    results = []
+    for path in paths:
+        try:
+            results.append((path, *_file_trigrams(path)))
+        except OSError:
+            continue
+    return results
+
+
+def _literal_runs(items) -> List[str]:
+    """Collect runs of consecutive literals that every match of the parsed pattern *items* must contain."""
+    runs: List[str] = []
+    current: List[str] = []
+
+    def flush():
+        if current:
+            runs.append("".join(current))
+            current.clear()
+
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            current.append(chr(av))
+            continue
+        flush()
+        if op is _sre_parse.SUBPATTERN:
+            runs.extend(_literal_runs(av[-1]))
+        elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT) and av[0] >= 1:
+            runs.extend(_literal_runs(av[2]))
+    flush()
+    return runs
+
+
+def _query_trigrams(pattern: str, flags: int, literal: bool) -> List[Set[int]] | None:
+    """Translate a query into alternatives of required trigram sets; None when it can't be narrowed."""
+    if literal:
+        alternatives = [[pattern]]
+    else:
+        try:
+            parsed = list(_sre_parse.parse(pattern, flags))
+        except re.error:
+            return None
+        if len(parsed) == 1 and parsed[0][0] is _sre_parse.BRANCH:
+            alternatives = [_literal_runs(branch) for branch in parsed[0][1][1]]
+        else:
+            alternatives = [_literal_runs(parsed)]
+
+    result = []
+    for runs in alternatives:
+        grams: Set[int] = set()
+        for run in runs:
+            data = run.encode("utf-8").lower()
+            for i in range(len(data) - 2):
+                gram = data[i:i + 3]
+                # The index only folds ASCII case, so non-ASCII trigrams can't be trusted case-insensitively
+                if flags & re.IGNORECASE and max(gram) >= 0x80:
+                    continue
+                grams.add(int.from_bytes(gram, "big"))
+        if not grams:
+            return None
+        result.append(grams)
+    return result
+
+
+class _TrigramIndex:
+    """On-disk trigram index of workspace text files used to narrow content searches to candidate files."""
+
+    def __init__(self, root: Path, db_path: Path, watcher: _InotifyWatcher | None = None):
+        self.root = root
+        self.db_path = db_path
+        self._watcher = watcher
+        self._ready = False
+        self._lock: asyncio.Lock | None = None
+        self._write_lock = threading.Lock()
+        self._dirty: Set[Path] = set()
+        self._removed: Set[Path] = set()
+        self._rescan = False
+        self._flush_handle: asyncio.TimerHandle | None = None
+        if watcher is not None:
+            watcher.add_listener(self.on_change)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.db_path), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _init_db(self) -> None:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    indexed INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    trigram INTEGER NOT NULL,
+                    file_id INTEGER NOT NULL,
+                    PRIMARY KEY (trigram, file_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+            """)
+
+    def _relative(self, path: Path) -> str | None:
+        try:
+            rel = path.relative_to(self.root)
+        except ValueError:
+            return None
+        if any(part in INDEX_SKIP_DIRS for part in rel.parts):
+            return None
+        return rel.as_posix()
+
+    def _store(self, results: List[Tuple[str, int, int, List[int] | None]]) -> None:
+        with self._write_lock, self._connect() as db:
+            for path, mtime_ns, size, grams in results:
+                rel = self._relative(Path(path))
+                if rel is None:
+                    continue
+                file_id = db.execute(
+                    "INSERT INTO files (path, mtime_ns, size, indexed) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, "
+                    "indexed = excluded.indexed RETURNING id",
+                    (rel, mtime_ns, size, int(grams is not None)),
+                ).fetchone()[0]
+                db.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+                if grams:
+                    db.executemany(
+                        "INSERT INTO postings (trigram, file_id) VALUES (?, ?)", ((g, file_id) for g in grams)
+                    )
+
+    def _remove(self, rels: List[str]) -> None:
+        with self._write_lock, self._connect() as db:
+            for rel in rels:
+                ids = [row[0] for row in db.execute(
+                    "SELECT id FROM files WHERE path = ? OR substr(path, 1, ?) = ?", (rel, len(rel) + 1, rel + "/")
+                )]
+                for file_id in ids:
+                    db.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+                    db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def _stale_files(self) -> Tuple[List[str], List[str]]:
+        """Compare the workspace against the stored signatures; return (changed paths, removed rel paths)."""
+        with self._connect() as db:
+            stored = {path: (mtime_ns, size) for path, mtime_ns, size in db.execute(
+                "SELECT path, mtime_ns, size FROM files"
+            )}
+        changed = []
+        for path in _iter_files(self.root, INDEX_SKIP_DIRS):
+            rel = Path(path).relative_to(self.root).as_posix()
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stored.pop(rel, None) != (st.st_mtime_ns, st.st_size):
+                changed.append(path)
+        return changed, list(stored)
+
+    async def _refresh(self) -> None:
+        """Bring the index up to date with the workspace, re-reading only files whose signature changed."""
+        await asyncio.to_thread(self._init_db)
+        lock_file = await asyncio.to_thread(open, str(self.db_path) + ".lock", "w")
+        try:
+            # Serialise refreshes across uvicorn workers sharing the same database
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+            changed, removed = await asyncio.to_thread(self._stale_files)
+            if removed:
+                await asyncio.to_thread(self._remove, removed)
+            batches = [changed[i:i + GREP_BATCH_SIZE] for i in range(0, len(changed), GREP_BATCH_SIZE)]
+            if len(batches) == 1:
+                await asyncio.to_thread(lambda: self._store(_index_batch(batches[0])))
+            elif batches:
+                loop = asyncio.get_running_loop()
+                pool = _get_grep_pool()
+                futures = [loop.run_in_executor(pool, _index_batch, batch) for batch in batches]
+                for future in asyncio.as_completed(futures):
+                    await asyncio.to_thread(self._store, await future)
+        finally:
+            await asyncio.to_thread(lock_file.close)
+
+    async def ensure_ready(self) -> None:
+        """Build or refresh the index on first use and start following workspace changes."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            watched = self._watcher is not None and self._watcher.running and not self._watcher.exhausted
+            if self._ready and watched and not self._rescan:
+                return
+            # Without inotify, changes made outside FileTool are only caught by re-checking signatures
+            if self._watcher is not None:
+                await self._watcher.start()
+            self._rescan = False
+            await self._refresh()
+            self._ready = True
+
+    def on_change(self, kind: str, path: Path, dest: Path | None = None) -> None:
+        """Record a workspace change; affected files are re-indexed after a short debounce."""
+        if kind == "rescan":
+            self._rescan = True
+            return
+        if kind in ("delete", "move"):
+            self._removed.add(path)
+        if kind in ("create", "modify"):
+            self._dirty.add(path)
+        if kind == "move" and dest is not None:
+            self._dirty.add(dest)
+        if self._ready and self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._flush_handle = loop.call_later(INDEX_FLUSH_DELAY, lambda: asyncio.ensure_future(self._flush()))
+
+    async def _flush(self) -> None:
+        self._flush_handle = None
+        removed = [rel for rel in map(self._relative, self._removed) if rel is not None]
+        dirty = list(self._dirty)
+        self._removed.clear()
+        self._dirty.clear()
+
+        def expand() -> List[str]:
+            paths = []
+            for path in dirty:
+                if self._relative(path) is None:
+                    continue
+                if path.is_dir():
+                    paths.extend(_iter_files(path, INDEX_SKIP_DIRS))
+                elif path.is_file():
+                    paths.append(str(path))
+            return paths
+
+        try:
+            if removed:
+                await asyncio.to_thread(self._remove, removed)
+            paths = await asyncio.to_thread(expand)
+            if paths:
+                await asyncio.to_thread(lambda: self._store(_index_batch(paths)))
+        except (OSError, sqlite3.Error):
+            # Fall back to a signature check on the next query
+            self._rescan = True
+
+    async def candidates(self, pattern: str, flags: int, literal: bool, scope: Path) -> List[str]:
+        """Return absolute paths under *scope* that may contain a match, in path order."""
+        await self.ensure_ready()
+        query = _query_trigrams(pattern, flags, literal)
+        scope_rel = "" if scope == self.root else scope.relative_to(self.root).as_posix()
+
+        def lookup() -> List[str]:
+            with self._connect() as db:
+                if query is None:
+                    file_ids = None
+                else:
+                    file_ids: Set[int] = set()
+                    for grams in query:
+                        ids: Set[int] | None = None
+                        for gram in grams:
+                            rows = {row[0] for row in db.execute(
+                                "SELECT file_id FROM postings WHERE trigram = ?", (gram,)
+                            )}
+                            ids = rows if ids is None else ids & rows
+                            if not ids:
+                                break
+                        file_ids |= ids or set()
+                if file_ids is None:
+                    paths = [row[0] for row in db.execute("SELECT path FROM files")]
+                else:
+                    # Oversized files were never indexed, so they stay candidates for every query
+                    paths = [row[0] for row in db.execute("SELECT path FROM files WHERE indexed = 0")]
+                    ids = list(file_ids)
+                    for i in range(0, len(ids), 500):
+                        chunk = ids[i:i + 500]
+                        paths.extend(row[0] for row in db.execute(
+                            f"SELECT path FROM files WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                        ))
+            if scope_rel:
+                paths = [p for p in paths if p == scope_rel or p.startswith(scope_rel + "/")]
+            return [str(self.root / path) for path in sorted(paths)]
+
+        return await asyncio.to_thread(lookup)
+
+
+# Directory listing
+LIST_SORT_KEYS = ("name", "size", "mtime", "type")
+
+
+@dataclass(frozen=True)
+class _DirEntry:
+    """One directory entry as returned by a single scandir pass."""
+    name: str
+    is_dir: bool
+    size: int | None = None
+    mtime: float | None = None
+
+
+def _scan_dir(
+    path: Path,
+    pattern: str | None = None,
+    with_stat: bool = False,
+    exclude: Callable[[str, bool], bool] | None = None,
+) -> List[_DirEntry]:
+    """List *path* in one scandir pass, using d_type for the entry type and stat()ing only when asked.
+
+    *exclude* is called as (name, is_dir) to drop entries before they are stat()ed.
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if pattern and not fnmatch.fnmatchcase(entry.name, pattern):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if exclude is not None and exclude(entry.name, is_dir):
+                continue
+            size = mtime = None
+            if with_stat:
+                try:
+                    st = entry.stat()
+                    size, mtime = st.st_size, st.st_mtime
+                except OSError:
+                    pass
+            entries.append(_DirEntry(entry.name, is_dir, size, mtime))
+    return entries
+
+
+def _entry_sort_key(sort: str) -> Callable[[_DirEntry], tuple]:
+    if sort == "size":
+        return lambda e: (e.size or 0, e.name)
+    if sort == "mtime":
+        return lambda e: (e.mtime or 0.0, e.name)
+    if sort == "type":
+        return lambda e: (not e.is_dir, e.name)
+    return lambda e: (e.name,)
+
+
+def _page_entries(
+    entries: List[_DirEntry], sort: str, reverse: bool, limit: int | None, cursor: str | None
+) -> Tuple[List[_DirEntry], str | None]:
+    """Order *entries* and cut one page; only the page itself is sorted when a limit is given."""
+    key = _entry_sort_key(sort)
+    if cursor:
+        try:
+            after = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+            entries = [e for e in entries if (key(e) < after if reverse else key(e) > after)]
+        except (ValueError, TypeError):
+            raise ToolError("Invalid cursor")  # Malformed, or made for another sort order
+    if limit is None or len(entries) <= limit:
+        return sorted(entries, key=key, reverse=reverse), None
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    page = select(limit, entries, key=key)
+    next_cursor = base64.urlsafe_b64encode(json.dumps(list(key(page[-1]))).encode()).decode()
+    return page, next_cursor
+
+
+def _format_entry(entry: _DirEntry, details: bool) -> str:
+    name = f"{entry.name}/" if entry.is_dir else entry.name
+    if not details:
+        return name
+    mtime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.mtime)) if entry.mtime is not None else "-"
+    size = entry.size if entry.size is not None else "-"
+    return f"{size:>12}  {mtime}  {name}"
+
+
+# Workspace tree cache
+TREE_APPLY_DELAY = 0.05  # Seconds to batch change events before applying them to the tree
+TREE_POLL_TTL = 2.0  # Seconds a tree is reused when inotify is unavailable
+
+
+class _Unwalked(dict):
+    """A gitignored directory the workspace tree has not read; it stays empty until a listing needs it."""
+
+
+class _WorkspaceTree:
+    """In-memory tree of workspace files, built once and kept current from change events.
+
+    Directories are dicts of name -> child, files are None. Root-level excluded items are never
+    walked. Until a listing that includes gitignored files is asked for, gitignored directories
+    such as node_modules are not descended into either, and changes inside them are ignored.
+    ``generation`` increases whenever the set of files, or a .gitignore, changes.
+    """
+
+    def __init__(self, root: Path, watcher: _InotifyWatcher | None = None, matcher: _PathMatcher | None = None):
+        self.root = root
+        self.generation = 0
+        self._watcher = watcher
+        self._matcher = matcher or _PathMatcher(root)
+        self._tree: Dict[str, Any] | None = None
+        self._built_at = 0.0
+        self._building = False
+        self._lock = threading.Lock()
+        self._build_lock: asyncio.Lock | None = None
+        self._pending: List[Tuple[str, Path, Path | None]] = []
+        self._apply_handle: asyncio.TimerHandle | None = None
+        self._listings: Dict[bool, Tuple[int, bytes, str]] = {}
+        self._prune = True  # Leave gitignored directories unwalked; off once an unfiltered listing is needed
+        if watcher is not None:
+            watcher.add_listener(self.on_change)
+
+    def _walk(self, directory: Path, rel_dir: str, chain: IgnoreChain | None = None) -> Dict[str, Any]:
+        """Read *directory* recursively; given the ignore *chain* above it, gitignored directories are left unwalked."""
+        node: Dict[str, Any] = {}
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return node
+        if chain is not None:
+            chain = self._matcher.scope(chain, rel_dir, not rel_dir or any(e.name == GITIGNORE_FILE for e in entries))
+        prefix = rel_dir + "/" if rel_dir else ""
+        for entry in entries:
+            if not rel_dir and _is_excluded_root_item(entry.name):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    rel = prefix + entry.name
+                    if chain is not None and self._matcher.ignored(chain, rel, True):
+                        node[entry.name] = _Unwalked()
+                    else:
+                        node[entry.name] = self._walk(Path(entry.path), rel, chain)
+                elif entry.is_file():
+                    node[entry.name] = None
+            except OSError:
+                continue
+        return node
+
+    def _parts(self, path: Path) -> Tuple[str, ...] | None:
+        try:
+            parts = path.relative_to(self.root).parts
+        except ValueError:
+            return None
+        if not parts or _is_excluded_root_item(parts[0]):
+            return None
+        return parts
+
+    def _remove(self, path: Path) -> bool:
+        parts = self._parts(path)
+        if parts is None:
+            return False
+        node = self._tree
+        for name in parts[:-1]:
+            node = node.get(name)
+            if not isinstance(node, dict):
+                return False
+        return node.pop(parts[-1], False) is not False
+
+    def _add(self, path: Path) -> bool:
+        parts = self._parts(path)
+        if parts is None:
+            return False
+        node = self._tree
+        for name in parts[:-1]:
+            child = node.get(name)
+            if isinstance(child, _Unwalked):
+                return False  # Read along with the rest of it, if it ever is
+            if not isinstance(child, dict):
+                child = node[name] = {}
+            node = child
+        name = parts[-1]
+        if path.is_dir() and not path.is_symlink():
+            rel = "/".join(parts)
+            chain = self._matcher.chain("/".join(parts[:-1])) if self._prune else None
+            if chain is not None and self._matcher.ignored(chain, rel, True):
+                node[name] = _Unwalked()
+            else:
+                node[name] = self._walk(path, rel, chain)
+            return True
+        if path.is_file():
+            changed = name not in node
+            node[name] = None
+            return changed
+        return node.pop(name, False) is not False
+
+    def _apply(self, events: List[Tuple[str, Path, Path | None]]) -> None:
+        with self._lock:
+            if self._tree is None:
+                return
+            changed = False
+            for kind, path, dest in events:
+                if kind == "rescan":
+                    self._tree = None
+                    return
+                # Listings filtered by .gitignore depend on its contents, not just on the set of files
+                if GITIGNORE_FILE in (path.name, dest.name if dest is not None else None):
+                    if self._prune:
+                        self._tree = None  # Which directories were left unwalked may have changed
+                        return
+                    changed = True
+                if kind in ("delete", "move"):
+                    changed |= self._remove(path)
+                if kind in ("create", "modify"):
+                    changed |= self._add(path)
+                if kind == "move" and dest is not None:
+                    changed |= self._add(dest)
+            if changed:
+                self.generation += 1
+
+    def on_change(self, kind: str, path: Path, dest: Path | None = None) -> None:
+        """Queue a change; it is applied shortly, or immediately before the next listing."""
+        if self._tree is None and not self._building:
+            return  # The next build sees the current state anyway
+        self._pending.append((kind, path, dest))
+        if self._tree is not None and self._apply_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._apply_handle = loop.call_later(TREE_APPLY_DELAY, lambda: asyncio.ensure_future(self._apply_pending()))
+
+    async def _apply_pending(self) -> None:
+        if self._apply_handle is not None:
+            self._apply_handle.cancel()
+            self._apply_handle = None
+        events, self._pending = self._pending, []
+        if events:
+            await asyncio.to_thread(self._apply, events)
+
+    def _read_unwalked(self) -> None:
+        """Walk every directory left unwalked, and stop leaving any."""
+        with self._lock:
+            self._prune = False
+            stack: List[Tuple[str, Dict[str, Any]]] = [("", self._tree or {})]
+            while stack:
+                rel_dir, node = stack.pop()
+                prefix = rel_dir + "/" if rel_dir else ""
+                for name, child in node.items():
+                    if isinstance(child, _Unwalked):
+                        node[name] = self._walk(self.root / (prefix + name), prefix + name)
+                    elif child is not None:
+                        stack.append((prefix + name, child))
+            self.generation += 1
+
+    async def ensure_built(self, git_ignore: bool = False) -> None:
+        """Build the tree on first use, or rebuild it after an overflow or when it can't be watched.
+
+        Unless *git_ignore*, the gitignored directories left unwalked so far are read as well.
+        """
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            watched = self._watcher is not None and await self._watcher.start() and not self._watcher.exhausted
+            fresh = watched or time.monotonic() - self._built_at < TREE_POLL_TTL
+            if self._tree is not None and fresh:
+                await self._apply_pending()
+                if self._tree is not None:
+                    if self._prune and not git_ignore:
+                        await asyncio.to_thread(self._read_unwalked)
+                    return
+            self._prune = self._prune and git_ignore
+            self._building = True
+            try:
+                tree = await asyncio.to_thread(self._walk, self.root, "", [] if self._prune else None)
+            finally:
+                self._building = False
+            with self._lock:
+                self._tree = tree
+                self._built_at = time.monotonic()
+                self.generation += 1
+            await self._apply_pending()
+
+    def files(self, git_ignore: bool = False) -> List[str]:
+        """Return the relative paths of all files, unsorted, pruning gitignored directories when asked."""
+        paths: List[str] = []
+        with self._lock:
+            stack: List[Tuple[str, Dict[str, Any], IgnoreChain]] = [("", self._tree or {}, [])]
+            while stack:
+                rel_dir, node, chain = stack.pop()
+                if git_ignore:
+                    # Root-level hidden files aren't in the tree, so the root's .gitignore is always looked up
+                    chain = self._matcher.scope(chain, rel_dir, not rel_dir or GITIGNORE_FILE in node)
+                prefix = rel_dir + "/" if rel_dir else ""
+                for name, child in node.items():
+                    rel = prefix + name
+                    if git_ignore and self._matcher.ignored(chain, rel, child is not None):
+                        continue
+                    if child is None:
+                        paths.append(rel)
+                    else:
+                        stack.append((rel, child, chain))
+        return paths
+
+    def entries(self, rel_dir: str, max_depth: int | None = None, git_ignore: bool = False) -> List[Tuple[str, bool]] | None:
+        """Return (relative path, is_dir) for everything below *rel_dir*, or None if it isn't in the tree.
+
+        Directories deeper than *max_depth*, and gitignored ones when asked, are not descended into.
+        """
+        with self._lock:
+            node = self._tree
+            for name in rel_dir.split("/") if rel_dir else []:
+                node = node.get(name) if node is not None else None
+                if isinstance(node, _Unwalked):
+                    return None
+            if not isinstance(node, dict):
+                return None
+            found: List[Tuple[str, bool]] = []
+            chain = self._matcher.chain(rel_dir.rpartition("/")[0]) if git_ignore and rel_dir else []
+            stack: List[Tuple[str, Dict[str, Any], IgnoreChain, int]] = [(rel_dir, node, chain, 1)]
+            while stack:
+                current, node, chain, depth = stack.pop()
+                if git_ignore:
+                    chain = self._matcher.scope(chain, current, not current or GITIGNORE_FILE in node)
+                prefix = current + "/" if current else ""
+                for name, child in node.items():
+                    rel = prefix + name
+                    if git_ignore and self._matcher.ignored(chain, rel, child is not None):
+                        continue
+                    found.append((rel, child is not None))
+                    if child is not None and (max_depth is None or depth < max_depth):
+                        stack.append((rel, child, chain, depth + 1))
+        return found
+
+    async def listing(self, git_ignore: bool = False) -> Tuple[bytes, str]:
+        """Return the serialised /list-files payload and its ETag, re-rendering only after changes."""
+        await self.ensure_built(git_ignore)
+        generation = self.generation
+        cached = self._listings.get(git_ignore)
+        if cached and cached[0] == generation:
+            return cached[1], cached[2]
+
+        def render() -> bytes:
+            paths = sorted(self.files(git_ignore))
+            items = [
+                {"name": p.rpartition("/")[2], "path": str(self.root / p), "relative_path": p, "type": "file"}
+                for p in paths
+            ]
+            return json.dumps({"workspace_path": str(self.root), "total_items": len(items), "items": items}).encode()
+
+        body = await asyncio.to_thread(render)
+        # A content hash keeps ETags identical across uvicorn workers serving the same tree
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self._listings[git_ignore] = (generation, body, etag)
+        return body, etag
+
+
+# Fuzzy path index
+FUZZY_DEFAULT_LIMIT = 20
+FUZZY_MAX_LIMIT = 500
+FUZZY_MAX_SCORED = 1000  # Matches scored per query; the scan stops once it has this many of the shortest paths
+FUZZY_CACHED_QUERIES = 32  # Recent complete queries whose matches a longer query can search instead of every path
+FUZZY_CACHE_BYTES = 64 * 1024 * 1024
+# fzf-style scoring: every matched character scores, boundaries and runs earn bonuses, gaps cost
+FUZZY_SCORE_MATCH = 16
+FUZZY_GAP_START = -3
+FUZZY_GAP_EXTENSION = -1
+FUZZY_BONUS_SEPARATOR = 9  # After a "/"
+FUZZY_BONUS_BOUNDARY = 8  # At the start, or after _ - . or a space
+FUZZY_BONUS_CAMEL = 7  # An upper-case letter after a lower-case one, or a digit after a letter
+FUZZY_BONUS_CONSECUTIVE = -(FUZZY_GAP_START + FUZZY_GAP_EXTENSION)
+FUZZY_BONUS_FIRST_CHAR = 2  # Multiplier for the bonus of a term's first character
+
+
+def _fuzzy_bonus(text: str, pos: int) -> int:
+    if pos == 0:
+        return FUZZY_BONUS_BOUNDARY
+    prev, char = text[pos - 1], text[pos]
+    if prev == "/":
+        return FUZZY_BONUS_SEPARATOR
+    if prev in "_-. ":
+        return FUZZY_BONUS_BOUNDARY
+    if (prev.islower() and char.isupper()) or (prev.isalpha() and char.isdigit()):
+        return FUZZY_BONUS_CAMEL
+    return 0
+
+
+def _fuzzy_term(text: str, haystack: str, term: str) -> Tuple[int, List[int]] | None:
+    """Score one query term against *text* the way fzf's v1 algorithm does.
+
+    The first match found going forward fixes where the match ends; scanning back from there finds
+    the latest place it can start, which gives the tightest window. *haystack* is *text* folded to
+    the case the term is matched in.
+    """
+    pos = -1
+    for char in term:
+        pos = haystack.find(char, pos + 1)
+        if pos < 0:
+            return None
+    for char in reversed(term[:-1]):
+        pos = haystack.rfind(char, 0, pos)
+    positions = []
+    for char in term:
+        pos = haystack.find(char, pos)
+        positions.append(pos)
+        pos += 1
+
+    score, previous, first_bonus = 0, -2, 0
+    for i, pos in enumerate(positions):
+        bonus = _fuzzy_bonus(text, pos)
+        if pos == previous + 1:
+            # A run keeps the bonus of the boundary it started at
+            if bonus >= FUZZY_BONUS_BOUNDARY and bonus > first_bonus:
+                first_bonus = bonus
+            bonus = max(bonus, first_bonus, FUZZY_BONUS_CONSECUTIVE)
+        else:
+            if i > 0:
+                score += FUZZY_GAP_START + FUZZY_GAP_EXTENSION * (pos - previous - 2)
+            first_bonus = bonus
+        score += FUZZY_SCORE_MATCH + (bonus * FUZZY_BONUS_FIRST_CHAR if i == 0 else bonus)
+        previous = pos
+    return score, positions
+
+
+def _fuzzy_fold(text: str) -> str:
+    """Lower-case *text* keeping its length, so offsets found in the result apply to *text* too.
+
+    Characters whose lower case is longer (such as "İ") are kept as they are.
+    """
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(low if len(low := char.lower()) == 1 else char for char in text)
+
+
+def _fuzzy_pattern(term: str) -> re.Pattern:
+    """Compile a regex finding *term* as a subsequence of one line, then running on to the line's end.
+
+    It is unanchored so re can skip straight to each occurrence of the first character, and the
+    possessive quantifiers that stop at the next wanted character keep each attempt linear.
+    """
+    head, rest = term[0], term[1:]
+    return re.compile(re.escape(head) + "".join(f"[^\\n{re.escape(c)}]*+{re.escape(c)}" for c in rest) + "[^\\n]*")
+
+
+class _FuzzyIndex:
+    """Quick-open index of workspace file paths, rebuilt from the workspace tree when it changes.
+
+    Paths are kept as one newline-separated string (plus a lower-cased copy), shortest first, so
+    filtering them is a regex scan in C rather than a Python loop over half a million strings, and
+    a broad query can stop scanning as soon as it has enough of the shortest matches to score.
+    """
+
+    def __init__(self, tree: _WorkspaceTree):
+        self._tree = tree
+        self._snapshots: Dict[bool, Tuple[int, str, str]] = {}  # git_ignore -> (generation, paths, lower-cased)
+        self._recent: "OrderedDict[Tuple[bool, int, bool, str], Tuple[str, str]]" = OrderedDict()
+        self._recent_size = 0
+        self._recent_lock = threading.Lock()
+        self._lock: asyncio.Lock | None = None
+
+    async def _snapshot(self, git_ignore: bool) -> Tuple[int, str, str]:
+        await self._tree.ensure_built(git_ignore)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            generation = self._tree.generation
+            cached = self._snapshots.get(git_ignore)
+            if cached is not None and cached[0] == generation:
+                return cached
+
+            def build() -> Tuple[int, str, str]:
+                paths = [path for path in self._tree.files(git_ignore) if "\n" not in path]
+                text = "\n".join(sorted(paths, key=lambda path: (len(path), path)))
+                return generation, text, _fuzzy_fold(text)
+
+            self._snapshots[git_ignore] = await asyncio.to_thread(build)
+            return self._snapshots[git_ignore]
+
+    def _candidates(self, key: Tuple[bool, int, bool, str], text: str, lower: str) -> Tuple[str, str, bool]:
+        """Return the first FUZZY_MAX_SCORED lines of (text, lower) matching the query in *key*, and whether that is all of them.
+
+        A complete result is remembered, and a longer query starting with it searches only its lines.
+        """
+        git_ignore, generation, case_sensitive, query = key
+        with self._recent_lock:
+            for (g, gen, cs, cached_query), lines in reversed(self._recent.items()):
+                if (g, gen, cs) == (git_ignore, generation, case_sensitive) and query.startswith(cached_query):
+                    text, lower = lines
+                    break
+        first, *others = [_fuzzy_pattern(term) for term in query.split()]
+        haystack = text if case_sensitive else lower
+        spans: List[Tuple[int, int]] = []
+        complete = True
+        # Each match runs to the end of its line, so the scan resumes on the next one
+        for m in first.finditer(haystack):
+            start, end = haystack.rfind("\n", 0, m.start()) + 1, m.end()
+            if all(pattern.search(haystack, start, end) for pattern in others):
+                if len(spans) == FUZZY_MAX_SCORED:
+                    complete = False
+                    break
+                spans.append((start, end))
+        lines = ("\n".join(text[a:b] for a, b in spans), "\n".join(lower[a:b] for a, b in spans))
+        if complete:
+            with self._recent_lock:
+                if key not in self._recent:
+                    self._recent[key] = lines
+                    self._recent_size += len(lines[0])
+                self._recent.move_to_end(key)
+                while self._recent and (len(self._recent) > FUZZY_CACHED_QUERIES or self._recent_size > FUZZY_CACHE_BYTES):
+                    _, dropped = self._recent.popitem(last=False)
+                    self._recent_size -= len(dropped[0])
+        return (*lines, complete)
+
+    async def search(
+        self, query: str, limit: int = FUZZY_DEFAULT_LIMIT, git_ignore: bool = False
+    ) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Return the best *limit* matches for *query*, best first, how many paths were scored and whether that was every match.
+
+        Space-separated terms must all match. Matching ignores case unless the query has upper-case
+        letters. When more than FUZZY_MAX_SCORED paths match, only the shortest of them are scored.
+        """
+        generation, text, lower = await self._snapshot(git_ignore)
+        query = " ".join(query.split())
+        if not query:
+            return [], 0, True
+        return await asyncio.to_thread(self._rank, (git_ignore, generation, query != query.lower(), query), text, lower, limit)
+
+    def _rank(self, key: Tuple[bool, int, bool, str], text: str, lower: str, limit: int) -> Tuple[List[Dict[str, Any]], int, bool]:
+        case_sensitive, query = key[2], key[3]
+        matched, matched_lower, complete = self._candidates(key, text, lower)
+        if not matched:
+            return [], 0, complete
+        paths = matched.split("\n")
+        folded = matched_lower.split("\n") if not case_sensitive else paths
+        terms = query.split()
+        scored = []
+        for i, (path, haystack) in enumerate(zip(paths, folded)):
+            total, positions = 0, []
+            for term in terms:
+                score, term_positions = _fuzzy_term(path, haystack, term)
+                total += score
+                positions += term_positions
+            # Ties go to the shorter path, as in fzf, then to the first in name order
+            scored.append((total, -len(path), -i, positions))
+        best = heapq.nlargest(limit, scored)
+        items = [{"path": paths[-i], "score": score, "positions": sorted(set(positions))} for score, _, i, positions in best]
+        return items, len(paths), complete
+
+
+# Disk usage
+DU_DEFAULT_TOP = 20
+DU_MAX_TOP = 1000
+DU_UNWATCHED_TTL = 30.0  # Seconds before a directory the watcher skips (such as .git) is walked again
+
+
+@dataclass(eq=False)
+class _DuNode:
+    """A directory in the disk-usage tree, with totals covering everything below it."""
+    dirs: Dict[str, "_DuNode"] = field(default_factory=dict)
+    files: Dict[str, Tuple[int, int]] = field(default_factory=dict)  # name -> (apparent size, allocated bytes)
+    size: int = 0
+    disk: int = 0
+    count: int = 0  # Files, including those in subdirectories
+    walked: float = 0.0
+
+    def add(self, size: int, disk: int, count: int) -> None:
+        self.size += size
+        self.disk += disk
+        self.count += count
+
+
+def _du_totals(entry: "_DuNode | Tuple[int, int] | None") -> Tuple[int, int, int]:
+    if entry is None:
+        return 0, 0, 0
+    if isinstance(entry, _DuNode):
+        return entry.size, entry.disk, entry.count
+    return entry[0], entry[1], 1
+
+
+class _DiskUsage:
+    """Per-directory sizes and file counts of the workspace, walked once and kept current from change events.
+
+    Every change re-stats just the path it names and adds the difference to each directory above
+    it, so totals are never recomputed from scratch. Unlike listings it counts everything on disk,
+    hidden and excluded items included. Directories the watcher skips are walked again when their
+    totals are more than DU_UNWATCHED_TTL seconds old.
+    """
+
+    def __init__(self, root: Path, watcher: _InotifyWatcher | None = None, unwatched: Set[str] | frozenset = frozenset()):
+        self.root = root
+        self._watcher = watcher
+        self._unwatched = unwatched
+        self._unwatched_paths: Set[Tuple[str, ...]] = set()
+        self._tree: _DuNode | None = None
+        self._built_at = 0.0
+        self._building = False
+        self._lock = threading.Lock()
+        self._build_lock: asyncio.Lock | None = None
+        self._pending: List[Tuple[str, Path, Path | None]] = []
+        self._apply_handle: asyncio.TimerHandle | None = None
+        if watcher is not None:
+            watcher.add_listener(self.on_change)
+
+    def _walk(self, directory: str, parts: Tuple[str, ...], unwatched: Set[Tuple[str, ...]]) -> _DuNode:
+        """Total up *directory*, adding the parts of any unwatched directories found to *unwatched*."""
+        node = _DuNode(walked=time.monotonic())
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return node
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in self._unwatched:
+                        unwatched.add((*parts, entry.name))
+                    child = node.dirs[entry.name] = self._walk(entry.path, (*parts, entry.name), unwatched)
+                    node.add(child.size, child.disk, child.count)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    node.files[entry.name] = (st.st_size, st.st_blocks * 512)
+                    node.add(st.st_size, st.st_blocks * 512, 1)
+            except OSError:
+                continue
+        return node
+
+    def _refresh(self, parts: Tuple[str, ...]) -> None:
+        """Re-stat the entry at *parts* (walking it if it's a directory) and carry the difference up the tree."""
+        chain = [self._tree]
+        for i, name in enumerate(parts[:-1]):
+            child = chain[-1].dirs.get(name)
+            if child is None:
+                # A directory the tree hasn't seen yet: walking it takes in this entry as well
+                return self._refresh(parts[:i + 1])
+            chain.append(child)
+        path = os.path.join(self.root, *parts)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            new = None
+        else:
+            new = self._walk(path, parts, self._unwatched_paths) if stat.S_ISDIR(st.st_mode) else (st.st_size, st.st_blocks * 512)
+        parent, name = chain[-1], parts[-1]
+        old = parent.dirs.pop(name, None) or parent.files.pop(name, None)
+        if isinstance(new, _DuNode):
+            parent.dirs[name] = new
+        elif new is not None:
+            parent.files[name] = new
+        else:
+            self._unwatched_paths = {p for p in self._unwatched_paths if p[:len(parts)] != parts}
+        delta = [n - o for n, o in zip(_du_totals(new), _du_totals(old))]
+        for node in chain:
+            node.add(*delta)
+
+    def _parts(self, path: Path) -> Tuple[str, ...] | None:
+        try:
+            return path.relative_to(self.root).parts
+        except ValueError:
+            return None
+
+    def _apply(self, events: List[Tuple[str, Path, Path | None]]) -> None:
+        with self._lock:
+            if self._tree is None:
+                return
+            paths: Dict[Tuple[str, ...], None] = {}
+            for kind, path, dest in events:
+                if kind == "rescan":
+                    self._tree = None
+                    return
+                for changed in (path, dest):
+                    parts = self._parts(changed) if changed is not None else None
+                    if parts == ():
+                        self._tree = None
+                        return
+                    if parts is not None:
+                        paths[parts] = None
+            for parts in paths:
+                self._refresh(parts)
+
+    def on_change(self, kind: str, path: Path, dest: Path | None = None) -> None:
+        """Queue a change; it is applied shortly, or immediately before the next query."""
+        if self._tree is None and not self._building:
+            return
+        self._pending.append((kind, path, dest))
+        if self._tree is not None and self._apply_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._apply_handle = loop.call_later(TREE_APPLY_DELAY, lambda: asyncio.ensure_future(self._apply_pending()))
+
+    async def _apply_pending(self) -> None:
+        if self._apply_handle is not None:
+            self._apply_handle.cancel()
+            self._apply_handle = None
+        events, self._pending = self._pending, []
+        if events:
+            await asyncio.to_thread(self._apply, events)
+
+    async def ensure_built(self) -> None:
+        """Walk the workspace on first use, or again after an overflow or when it can't be watched."""
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            watched = self._watcher is not None and await self._watcher.start() and not self._watcher.exhausted
+            fresh = watched or time.monotonic() - self._built_at < TREE_POLL_TTL
+            if self._tree is not None and fresh:
+                await self._apply_pending()
+                if self._tree is not None:
+                    return
+            self._building = True
+            unwatched: Set[Tuple[str, ...]] = set()
+            try:
+                tree = await asyncio.to_thread(self._walk, str(self.root), (), unwatched)
+            finally:
+                self._building = False
+            with self._lock:
+                self._tree = tree
+                self._unwatched_paths = unwatched
+                self._built_at = time.monotonic()
+            await self._apply_pending()
+
+    def _summary(self, rel_dir: str, depth: int, top: int, apparent: bool) -> Dict[str, Any] | None:
+        with self._lock:
+            parts = tuple(rel_dir.split("/")) if rel_dir else ()
+            now = time.monotonic()
+            for stale in [p for p in self._unwatched_paths if p[:len(parts)] == parts]:
+                node = self._tree
+                for name in stale:
+                    node = node.dirs.get(name) if node is not None else None
+                if node is None or now - node.walked > DU_UNWATCHED_TTL:
+                    self._refresh(stale)
+
+            node = self._tree
+            for name in parts:
+                node = node.dirs.get(name)
+                if node is None:
+                    return None
+            key = 0 if apparent else 1
+            directories: List[Tuple[str, _DuNode]] = []
+            files: List[Tuple[str, Tuple[int, int]]] = []
+            stack = [(rel_dir, node, 0)]
+            while stack:
+                current, directory, level = stack.pop()
+                prefix = current + "/" if current else ""
+                files.extend((prefix + name, usage) for name, usage in directory.files.items())
+                for name, child in directory.dirs.items():
+                    if level < depth:
+                        directories.append((prefix + name, child))
+                    stack.append((prefix + name, child, level + 1))
+            largest_dirs = heapq.nlargest(top, directories, key=lambda item: _du_totals(item[1])[key])
+            largest_files = heapq.nlargest(top, files, key=lambda item: item[1][key])
+            return {
+                "path": rel_dir,
+                "size": node.size,
+                "disk_size": node.disk,
+                "files": node.count,
+                "directories": [
+                    {"path": rel, "size": child.size, "disk_size": child.disk, "files": child.count}
+                    for rel, child in largest_dirs
+                ],
+                "largest_files": [{"path": rel, "size": size, "disk_size": disk} for rel, (size, disk) in largest_files],
+            }
+
+    async def usage(
+        self, rel_dir: str = "", depth: int = 1, top: int = DU_DEFAULT_TOP, apparent: bool = False
+    ) -> Dict[str, Any] | None:
+        """Return the totals of *rel_dir* with its *top* largest subdirectories down to *depth* levels and largest files.
+
+        Sizes are allocated bytes, as du reports them, unless *apparent* is set; both are returned.
+        Returns None if *rel_dir* is not a directory.
+        """
+        await self.ensure_built()
+        return await asyncio.to_thread(self._summary, rel_dir, depth, top, apparent)
+
+
+# Git status
+GIT_DIR_NAME = ".gitscout"
+GIT_STATUS_MAX_PATHSPECS = 256  # With more changed paths than this, a full status is cheaper
+GIT_DIFF_MAX_BYTES = 4 * 1024 * 1024
+GIT_DIFF_CACHED = 64  # Diffs kept, least recently used dropped first
+
+
+def _parse_git_status(data: bytes) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """Parse ``git status --porcelain=v2 -z`` output into branch headers and entries by path.
+
+    Entries carry the XY codes as git prints them ("." for unmodified, "?" for untracked).
+    """
+    branch: Dict[str, Any] = {}
+    entries: Dict[str, Dict[str, Any]] = {}
+    records = data.split(b"\0")
+    i = 0
+    while i < len(records):
+        record = os.fsdecode(records[i])
+        i += 1
+        if not record:
+            continue
+        kind = record[0]
+        if kind == "#":
+            key, _, value = record[2:].partition(" ")
+            if key == "branch.oid":
+                branch["oid"] = None if value == "(initial)" else value
+            elif key == "branch.head":
+                branch["head"] = None if value == "(detached)" else value
+            elif key == "branch.upstream":
+                branch["upstream"] = value
+            elif key == "branch.ab":
+                ahead, behind = value.split()
+                branch["ahead"], branch["behind"] = int(ahead), -int(behind)
+        elif kind in "12u":
+            fields = record.split(" ", {"1": 8, "2": 9, "u": 10}[kind])
+            xy, path = fields[1], fields[-1]
+            entry: Dict[str, Any] = {"path": path, "index": xy[0], "worktree": xy[1]}
+            if kind == "2":
+                entry["orig_path"] = os.fsdecode(records[i])  # A rename's source is a record of its own
+                i += 1
+            elif kind == "u":
+                entry["conflict"] = True
+            entries[path] = entry
+        elif kind == "?":
+            entries[record[2:]] = {"path": record[2:], "index": "?", "worktree": "?"}
+    return branch, entries
+
+
+def _covers(paths: Set[str], rel: str) -> bool:
+    """Whether *rel* is one of *paths* or lies below one of them."""
+    while True:
+        if rel in paths:
+            return True
+        rel, sep, _ = rel.rpartition("/")
+        if not sep:
+            return False
+
+
+class _GitStatus:
+    """git status of the workspace against the .gitscout repository, kept in memory.
+
+    A full status runs on first use, and again when HEAD, the ref it points at or the index
+    changes; .gitscout isn't watched, so those are checked by stat on every call. Otherwise change
+    events mark paths dirty, and the next call asks git about just those paths. Diffs are cached
+    until a change touches them. Status runs with --no-optional-locks, so it never rewrites the
+    index and so never triggers a full refresh of its own.
+    """
+
+    def __init__(self, root: Path, git_dir: Path, watcher: _InotifyWatcher | None = None):
+        self.root = root
+        self.git_dir = git_dir
+        self._watcher = watcher
+        self._branch: Dict[str, Any] = {}
+        self._entries: Dict[str, Dict[str, Any]] | None = None
+        self._signature: Tuple[Any, ...] | None = None
+        self._refreshed_at = 0.0
+        self._dirty: Set[str] = set()
+        self._full = False  # Set by changes only a full status can account for
+        self._epoch = 0  # Bumped by every full status
+        self._events = 0
+        self._touched: Dict[str, int] = {}  # Path -> number of the last change event naming it
+        self._diffs: "OrderedDict[Tuple[str, bool], Tuple[int, int, str, bool]]" = OrderedDict()
+        self._lock: asyncio.Lock | None = None
+        if watcher is not None:
+            watcher.add_listener(self.on_change)
+
+    def on_change(self, kind: str, path: Path, dest: Path | None = None) -> None:
+        if self._entries is None:
+            return  # The first status sees the current state anyway
+        if kind == "rescan":
+            self._full = True
+            return
+        for changed in (path, dest):
+            if changed is None:
+                continue
+            try:
+                rel = changed.relative_to(self.root).as_posix()
+            except ValueError:
+                continue
+            if rel.split("/", 1)[0] in (GIT_DIR_NAME, ".git"):
+                continue
+            # A .gitignore change can flip any number of untracked files
+            if rel == "." or changed.name == GITIGNORE_FILE:
+                self._full = True
+            self._events += 1
+            self._dirty.add(rel)
+            self._touched[rel] = self._events
+
+    def _repository_signature(self) -> Tuple[Any, ...]:
+        def signature(path: Path) -> Tuple[int, int, int] | None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            return st.st_ino, st.st_size, st.st_mtime_ns
+
+        head = self.git_dir / "HEAD"
+        try:
+            ref = head.read_text().strip()
+        except OSError:
+            ref = ""
+        target = signature(self.git_dir / ref[5:]) if ref.startswith("ref: ") else None
+        return ref, target, signature(self.git_dir / "index"), signature(self.git_dir / "packed-refs")
+
+    async def _git(self, *args: str) -> bytes:
+        proc = await asyncio.create_subprocess_exec(
+            "git", f"--git-dir={self.git_dir}", f"--work-tree={self.root}", "--no-optional-locks", "--literal-pathspecs",
+            *args,
+            cwd=str(self.root),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate()
+        if proc.returncode != 0:
+            raise ToolError(f"git {args[0]} failed: {err.decode(errors='replace').strip()}")
+        return out
+
+    async def _refresh(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            signature = await asyncio.to_thread(self._repository_signature)
+            watched = self._watcher is not None and await self._watcher.start() and not self._watcher.exhausted
+            stale = not watched and time.monotonic() - self._refreshed_at > TREE_POLL_TTL
+            full = self._entries is None or self._full or stale or signature != self._signature
+            if not full and not self._dirty:
+                return
+            # Changes arriving while git runs stay queued for the next call
+            paths, self._dirty, self._full = sorted(self._dirty), set(), False
+            try:
+                if full or len(paths) > GIT_STATUS_MAX_PATHSPECS:
+                    data = await self._git("status", "--porcelain=v2", "-z", "--branch", "--untracked-files=all")
+                    self._branch, self._entries = _parse_git_status(data)
+                    self._signature = signature
+                    self._refreshed_at = time.monotonic()
+                    self._epoch += 1
+                    self._touched.clear()
+                    self._diffs.clear()
+                else:
+                    data = await self._git("status", "--porcelain=v2", "-z", "--untracked-files=all", "--", *paths)
+                    _, entries = _parse_git_status(data)
+                    covered = set(paths)
+                    for rel in [rel for rel in self._entries if _covers(covered, rel)]:
+                        del self._entries[rel]
+                    self._entries.update(entries)
+            except BaseException:
+                self._full = True
+                raise
+
+    async def status(self) -> Dict[str, Any] | None:
+        """Return the branch and the changed files, as git status would; None if there is no repository."""
+        if not await aiofiles.os.path.isfile(str(self.git_dir / "HEAD")):
+            return None
+        await self._refresh()
+        files = sorted(self._entries.values(), key=lambda entry: entry["path"])
+        return {"branch": self._branch, "clean": not files, "files": files}
+
+    def _stamp(self, rel: str) -> int:
+        """Number of the last change event affecting *rel*, a file or directory ("" for everything)."""
+        if not rel:
+            return self._events
+        return max(
+            (n for path, n in self._touched.items() if path == rel or path.startswith(rel + "/") or rel.startswith(path + "/")),
+            default=0,
+        )
+
+    async def diff(self, rel: str = "", staged: bool = False) -> Tuple[str, bool] | None:
+        """Return git diff of *rel* (everything when empty) against the index, or of the index against HEAD when *staged*.
+
+        The text is capped at GIT_DIFF_MAX_BYTES; the flag says whether it was cut short. Returns
+        None if there is no repository.
+        """
+        if not await aiofiles.os.path.isfile(str(self.git_dir / "HEAD")):
+            return None
+        await self._refresh()
+        key, stamp = (rel, staged), (self._epoch, self._stamp(rel))
+        cached = self._diffs.get(key)
+        if cached is not None and cached[:2] == stamp:
+            self._diffs.move_to_end(key)
+            return cached[2], cached[3]
+        args = ["diff", "--no-color", "--no-ext-diff"] + (["--cached"] if staged else []) + ["--"] + ([rel] if rel else [])
+        data = await self._git(*args)
+        text, truncated = data[:GIT_DIFF_MAX_BYTES].decode(errors="replace"), len(data) > GIT_DIFF_MAX_BYTES
+        self._diffs[key] = (*stamp, text, truncated)
+        while len(self._diffs) > GIT_DIFF_CACHED:
+            self._diffs.popitem(last=False)
+        return text, truncated
+
+
+# Filesystem change events
+FS_EVENT_DEBOUNCE = 0.1  # Seconds to coalesce events for the same path
+FS_EVENT_HISTORY = 10000  # Flushed events kept for resuming clients
+FS_EVENT_QUEUE_SIZE = 1000  # Undelivered events per client before it is told to resync
+
+
+class _FsSubscription:
+    """One client's view of the event stream: the path prefixes it follows and its outgoing queue."""
+
+    def __init__(self):
+        self.prefixes: List[str] = []
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=FS_EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def set_prefixes(self, prefixes: List[str]) -> None:
+        # "" (or ".") follows the whole workspace
+        self.prefixes = ["" if p.strip("/") == "." else p.strip("/") for p in prefixes]
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        for path in (event["path"], event.get("dest")):
+            if path is None:
+                continue
+            for prefix in self.prefixes:
+                if not prefix or path == prefix or path.startswith(prefix + "/"):
+                    return True
+        return False
+
+
+class _FsEventHub:
+    """Coalesces filesystem changes per path and fans them out to subscribers.
+
+    Every delivered event carries a generation number. Clients reconnecting to the same server
+    process can pass the last generation they saw and receive what they missed; otherwise they
+    are told to resync from /list-files.
+    """
+
+    def __init__(self, root: Path, watcher: _InotifyWatcher | None = None):
+        self.root = root
+        self.server_id = os.urandom(8).hex()
+        self.generation = 0
+        self._watcher = watcher
+        self._history: deque = deque(maxlen=FS_EVENT_HISTORY)
+        self._pending: Dict[str, Tuple[str, str | None]] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._subscribers: Set[_FsSubscription] = set()
+        if watcher is not None:
+            watcher.add_listener(self.on_change)
+
+    async def start(self) -> bool:
+        return self._watcher is not None and await self._watcher.start()
+
+    def _relative(self, path: Path | None) -> str | None:
+        if path is None:
+            return None
+        try:
+            parts = path.relative_to(self.root).parts
+        except ValueError:
+            return None
+        if not parts or _is_excluded_root_item(parts[0]):
+            return None
+        return "/".join(parts)
+
+    def on_change(self, kind: str, path: Path, dest: Path | None = None) -> None:
+        """Record a change, merging it with any pending change for the same path."""
+        if kind == "rescan":
+            self._pending["."] = ("rescan", None)
+        else:
+            rel = self._relative(path)
+            if kind == "move":
+                dest_rel = self._relative(dest)
+                if rel is None and dest_rel is None:
+                    return
+                if rel is None:
+                    kind, rel = "create", dest_rel
+                elif dest_rel is None:
+                    kind = "delete"
+                else:
+                    self._pending.pop(rel, None)
+                    self._pending[rel] = ("move", dest_rel)
+                    kind = None
+            if rel is None:
+                return
+            if kind is not None:
+                previous = self._pending.get(rel, (None, None))[0]
+                if previous == "create" and kind == "modify":
+                    pass  # Still a create as far as clients are concerned
+                elif previous == "create" and kind == "delete":
+                    del self._pending[rel]  # Never observable by clients
+                elif previous == "delete" and kind == "create":
+                    self._pending[rel] = ("modify", None)
+                else:
+                    self._pending[rel] = (kind, None)
+
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._flush_handle = loop.call_later(FS_EVENT_DEBOUNCE, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        for path, (kind, dest) in pending.items():
+            self.generation += 1
+            event = {"type": "event", "generation": self.generation, "kind": kind, "path": path, "dest": dest}
+            self._history.append(event)
+            for subscription in self._subscribers:
+                if kind == "rescan" or subscription.matches(event):
+                    try:
+                        subscription.queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        subscription.overflowed = True
+
+    def subscribe(self, subscription: _FsSubscription) -> None:
+        self._subscribers.add(subscription)
+
+    def unsubscribe(self, subscription: _FsSubscription) -> None:
+        self._subscribers.discard(subscription)
+
+    def replay(self, subscription: _FsSubscription, since: int, server_id: str | None) -> List[Dict[str, Any]] | None:
+        """Events after *since* for *subscription*, or None when the gap can't be bridged."""
+        if server_id != self.server_id or since > self.generation:
+            return None
+        if since < self.generation and (not self._history or self._history[0]["generation"] > since + 1):
+            return None
+        return [e for e in self._history if e["generation"] > since and subscription.matches(e)]
+
+
+# Precompressed variants
+COMPRESSIBLE_EXTENSIONS = {".js", ".mjs", ".cjs", ".css", ".json", ".map", ".svg", ".html", ".htm", ".txt", ".xml"}
+COMPRESS_MIN_SIZE = 1024  # Smaller files aren't worth a Content-Encoding round trip
+COMPRESS_MAX_SIZE = 32 * 1024 * 1024
+COMPRESS_CACHE_DIR = CACHE_DIR / "compressed"
+COMPRESS_CACHE_MAX_BYTES = 512 * 1024 * 1024
+BROTLI_QUALITY = 9
+FILE_CHUNK_SIZE = 1024 * 1024  # Per-send chunk when the server can't send files itself
+
+
+class _WorkspaceFileResponse(FileResponse):
+    """FileResponse streaming in larger chunks to cut per-chunk overhead on big assets.
+
+    Servers offering the ASGI pathsend extension still get the path handed over directly.
+    """
+    chunk_size = FILE_CHUNK_SIZE
+
+
+def _preferred_encoding(accept_encoding: str) -> str | None:
+    """Pick "br" or "gzip" from an Accept-Encoding header, honouring q-values."""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        key, _, value = params.strip().partition("=")
+        if key.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(candidates, key=lambda encoding: accepted.get(encoding, 0.0))
+    return best if accepted.get(best, 0.0) > 0 else None
+
+
+def _trim_directory(directory: Path, max_bytes: int) -> None:
+    """Delete least recently used files (by mtime, refreshed on use) until *directory* fits in *max_bytes*."""
+    entries = []
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            continue
+
+
+def _compressed_variant(src: str, st: os.stat_result, variant: Path, encoding: str) -> os.stat_result | None:
+    """Return the stat of *variant*, generating it from *src* first if needed.
+
+    Returns None when *src* changed since *st* was taken, so the caller serves it uncompressed.
+    """
+    try:
+        variant_st = os.stat(variant)
+        os.utime(variant)
+        return variant_st
+    except FileNotFoundError:
+        pass
+    with open(src, "rb") as f:
+        data = f.read()
+        current = os.fstat(f.fileno())
+    if (current.st_ino, current.st_size, current.st_mtime_ns) != (st.st_ino, st.st_size, st.st_mtime_ns):
+        return None
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    variant.parent.mkdir(parents=True, exist_ok=True)
+    tmp = variant.with_name(f"{variant.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp, variant)
+    _trim_directory(variant.parent, COMPRESS_CACHE_MAX_BYTES)
+    return os.stat(variant)
+
+
+# Conditional GET support
+FILE_CACHE_CONTROL = "no-cache"  # Always revalidate; content-hash ETags make that a cheap 304
+ETAG_HASH_LIMIT = 256 * 1024 * 1024  # Larger files get a weak, stat-based ETag instead of a content hash
+HASH_CACHE_ENTRIES = 8192
+
+
+class _ContentHashCache:
+    """Strong ETags from file content hashes, memoised by (device, inode, size, mtime_ns)."""
+
+    def __init__(self, max_entries: int = HASH_CACHE_ENTRIES):
+        self._entries: "OrderedDict[Tuple[int, int, int, int], str]" = OrderedDict()
+        self._max_entries = max_entries
+
+    @staticmethod
+    def _key(st: os.stat_result) -> Tuple[int, int, int, int]:
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _hash(self, path: str, key: Tuple[int, int, int, int]) -> Tuple[str, bool]:
+        """Hash *path*, also reporting whether it still matches *key* afterwards."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest(), self._key(os.stat(path)) == key
+
+    async def etag(self, path: str, st: os.stat_result) -> str:
+        if st.st_size > ETAG_HASH_LIMIT:
+            return f'W/"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+        key = self._key(st)
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            return cached
+        digest, unchanged = await asyncio.to_thread(self._hash, path, key)
+        etag = f'"{digest}"'
+        # A file rewritten while hashing must not be cached under its old signature
+        if unchanged:
+            self._entries[key] = etag
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+
+def _is_not_modified(request_headers: Headers, etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no If-None-Match is present."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _conditional_file_response(
+    request_headers: Headers, path: str, st: os.stat_result, filename: str | None = None
+) -> Response:
+    """Serve *path* with a content-hash ETag, answering 304 when the client's copy is current.
+
+    Compressible text assets are served from a gzip/brotli variant cached under COMPRESS_CACHE_DIR.
+    Variants are keyed by content hash, so an edited file simply maps to a new variant.
+    """
+    etag = await content_hashes.etag(path, st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": FILE_CACHE_CONTROL,
+    }
+    compressible = Path(path).suffix.lower() in COMPRESSIBLE_EXTENSIONS and COMPRESS_MIN_SIZE <= st.st_size <= COMPRESS_MAX_SIZE
+    # Ranges address bytes of the identity representation, so they are always served uncompressed
+    encoding = None
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+        if "range" not in request_headers:
+            encoding = _preferred_encoding(request_headers.get("accept-encoding", ""))
+    if encoding is not None and not etag.startswith("W/"):
+        digest = etag.strip('"')
+        headers["ETag"] = f'"{digest}-{encoding}"'
+        if _is_not_modified(request_headers, headers["ETag"], st.st_mtime):
+            return Response(status_code=304, headers=headers)
+        variant = COMPRESS_CACHE_DIR / f"{digest}.{encoding}"
+        try:
+            variant_st = await asyncio.to_thread(_compressed_variant, path, st, variant, encoding)
+        except OSError:
+            variant_st = None
+        if variant_st is not None:
+            headers["Content-Encoding"] = encoding
+            return _WorkspaceFileResponse(
+                path=variant,
+                headers=headers,
+                media_type=mimetypes.guess_type(path)[0] or "text/plain",
+                filename=filename,
+                stat_result=variant_st,
+            )
+        headers["ETag"] = etag
+    if _is_not_modified(request_headers, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return _WorkspaceFileResponse(path=path, headers=headers, filename=filename, stat_result=st)
+
+
+class _CachingStaticFiles(StaticFiles):
+    """StaticFiles using the shared content-hash ETags and Cache-Control headers.
+
+    Paths excluded by *matcher* (bash_server.py, hidden files, ...) are refused as in /file.
+    """
+
+    def __init__(self, *args, matcher: _PathMatcher | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._matcher = matcher
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        # Conditional handling happens in get_response, where the ETag can be computed asynchronously
+        return _WorkspaceFileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if isinstance(response, FileResponse) and self._matcher and self._matcher.is_excluded(Path(response.path)):
+            raise HTTPException(status_code=403, detail="Access denied: File is excluded from serving")
+        if isinstance(response, FileResponse) and response.status_code == 200 and response.stat_result:
+            return await _conditional_file_response(Headers(scope=scope), str(response.path), response.stat_result)
+        return response
+
+
+# Resized image variants
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+IMAGE_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp"), "png": ("PNG", "image/png")}
+IMAGE_MAX_DIMENSION = 4096
+IMAGE_QUALITY = 80
+IMAGE_CACHE_DIR = CACHE_DIR / "images"
+IMAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+IMAGE_MAX_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+
+_image_pool: ProcessPoolExecutor | None = None
+_image_jobs: Dict[Path, asyncio.Future] = {}
+
+
+def _get_image_pool() -> ProcessPoolExecutor:
+    """Return the worker pool used for resizing images, creating it on first use."""
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _image_pool
+
+
+def _resize_image(src: str, dest: str, width: int | None, height: int | None, fmt: str) -> None:
+    """Fit *src* into width x height (keeping its aspect ratio) and write it to *dest* as *fmt*.
+
+    Runs in a worker process.
+    """
+    with Image.open(src) as im:
+        im.draft("RGB", (width or IMAGE_MAX_DIMENSION, height or IMAGE_MAX_DIMENSION))  # Cheap JPEG downscale on decode
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((width or IMAGE_MAX_DIMENSION, height or IMAGE_MAX_DIMENSION), Image.Resampling.LANCZOS)
+        pil_format = IMAGE_FORMATS[fmt][0]
+        if pil_format == "JPEG" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        elif im.mode not in ("RGB", "RGBA", "L", "LA"):
+            im = im.convert("RGBA")
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        options = {"optimize": True} if pil_format == "PNG" else {"quality": IMAGE_QUALITY}
+        im.save(tmp, pil_format, **options)
+    os.replace(tmp, dest)
+
+
+def _parse_image_options(width: int | None, height: int | None, fmt: str | None, path: Path) -> Tuple[int | None, int | None, str]:
+    """Validate resize query parameters, defaulting the output format to the source's."""
+    if Image is None:
+        raise HTTPException(status_code=501, detail="Image resizing requires Pillow")
+    if path.suffix.lower() not in IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Resizing is only supported for image files")
+    for value in (width, height):
+        if value is not None and not 0 < value <= IMAGE_MAX_DIMENSION:
+            raise HTTPException(status_code=400, detail=f"Image dimensions must be between 1 and {IMAGE_MAX_DIMENSION}")
+    if fmt is None:
+        fmt = {".png": "png", ".webp": "webp"}.get(path.suffix.lower(), "jpeg")
+    fmt = fmt.lower().replace("jpg", "jpeg")
+    if fmt not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported image format: {fmt}")
+    return width, height, fmt
+
+
+async def _image_variant_response(
+    request_headers: Headers, path: str, st: os.stat_result, width: int | None, height: int | None, fmt: str
+) -> Response:
+    """Serve *path* resized to fit width x height as *fmt*, generating and caching the variant on first use.
+
+    Variants are keyed by the source's content hash, so editing the image yields a fresh one.
+    """
+    digest = hashlib.sha1((await content_hashes.etag(path, st)).encode()).hexdigest()[:32]
+    name = f"{digest}-w{width or 0}-h{height or 0}.{fmt}"
+    headers = {
+        "ETag": f'"{name}"',
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": FILE_CACHE_CONTROL,
+    }
+    if _is_not_modified(request_headers, headers["ETag"], st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    variant = IMAGE_CACHE_DIR / name
+    try:
+        variant_st = await aiofiles.os.stat(str(variant))
+        await asyncio.to_thread(os.utime, variant)
+    except FileNotFoundError:
+        # Concurrent requests for the same variant share one resize
+        job = _image_jobs.get(variant)
+        if job is None:
+            await asyncio.to_thread(IMAGE_CACHE_DIR.mkdir, parents=True, exist_ok=True)
+            loop = asyncio.get_running_loop()
+            job = _image_jobs[variant] = asyncio.ensure_future(
+                loop.run_in_executor(_get_image_pool(), _resize_image, path, str(variant), width, height, fmt)
+            )
+            job.add_done_callback(lambda _: _image_jobs.pop(variant, None))
+            job.add_done_callback(
+                lambda _: loop.run_in_executor(None, _trim_directory, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+            )
+        try:
+            await asyncio.shield(job)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise HTTPException(status_code=415, detail=f"Cannot resize image: {str(e)}")
+        variant_st = await aiofiles.os.stat(str(variant))
+    return _WorkspaceFileResponse(path=variant, headers=headers, media_type=IMAGE_FORMATS[fmt][1], stat_result=variant_st)
+
+
+# Copy engine
+FICLONE = 0x40049409  # ioctl(dst_fd, FICLONE, src_fd): share extents on btrfs/XFS/overlayfs
+COPY_CHUNK_SIZE = 64 * 1024 * 1024  # Bytes per copy_file_range/sendfile call
+COPY_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)  # Copies are syscall-bound, so threads suffice
+
+_copy_pool: ThreadPoolExecutor | None = None
+_copy_unsupported: Set[Tuple[str, int, int]] = set()  # (method, src device, dst device) pairs that failed
+
+
+def _get_copy_pool() -> ThreadPoolExecutor:
+    """Return the shared thread pool used for tree copies, creating it on first use."""
+    global _copy_pool
+    if _copy_pool is None:
+        _copy_pool = ThreadPoolExecutor(max_workers=COPY_MAX_WORKERS, thread_name_prefix="copy")
+    return _copy_pool
+
+
+@dataclass
+class _CopyProgress:
+    """Progress of one copy or move, updated from the worker threads."""
+    operation: str
+    src: str
+    dst: str
+    files_total: int = 0
+    files_done: int = 0
+    bytes_total: int = 0
+    bytes_done: int = 0
+    started: float = field(default_factory=time.monotonic)
+    methods: Dict[str, int] = field(default_factory=dict)  # Files copied per method
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def advance(self, nbytes: int = 0, method: str | None = None) -> None:
+        with self._lock:
+            self.bytes_done += nbytes
+            if method is not None:
+                self.files_done += 1
+                self.methods[method] = self.methods.get(method, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "operation": self.operation,
+            "src": self.src,
+            "dst": self.dst,
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "bytes_total": self.bytes_total,
+            "bytes_done": self.bytes_done,
+            "elapsed": round(time.monotonic() - self.started, 3),
+        }
+
+
+def _copy_range(method: str, src_fd: int, dst_fd: int, size: int, progress: _CopyProgress | None) -> None:
+    """Copy *size* bytes in the kernel with copy_file_range or sendfile, from the current offsets."""
+    copied = 0
+    while copied < size:
+        count = min(COPY_CHUNK_SIZE, size - copied)
+        if method == "copy_file_range":
+            n = os.copy_file_range(src_fd, dst_fd, count)
+        else:
+            n = os.sendfile(dst_fd, src_fd, None, count)
+        if n == 0:
+            # Some filesystems (FUSE, overlay, network) report 0 rather than failing; only a source
+            # that really ends here has shrunk while copying, otherwise _copy_file tries the next method
+            if copied and os.fstat(src_fd).st_size <= os.lseek(src_fd, 0, os.SEEK_CUR):
+                break
+            raise OSError(errno.EOPNOTSUPP, f"{method} copied nothing")
+        copied += n
+        if progress is not None:
+            progress.advance(n)
+
+
+def _copy_file(src: str, dst: str, st: os.stat_result, progress: _CopyProgress | None = None) -> str:
+    """Copy one regular file with its permissions and times, returning the method that worked.
+
+    Tries a FICLONE reflink, then copy_file_range, then sendfile, then a plain read/write loop.
+    Methods that fail for a pair of devices are not tried again for that pair.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        devices = (st.st_dev, os.fstat(dst_fd).st_dev)
+        method = "copy"
+        for candidate in ("reflink", "copy_file_range", "sendfile"):
+            if (candidate, *devices) in _copy_unsupported:
+                continue
+            try:
+                if candidate == "reflink":
+                    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                    if progress is not None:
+                        progress.advance(st.st_size)
+                else:
+                    _copy_range(candidate, src_fd, dst_fd, st.st_size, progress)
+                method = candidate
+                break
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM):
+                    raise
+                _copy_unsupported.add((candidate, *devices))
+                # A kernel copy may have failed part-way; start over from the beginning
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+        else:
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+            if progress is not None:
+                progress.advance(st.st_size)
+    shutil.copystat(src, dst)
+    if progress is not None:
+        progress.advance(method=method)
+    return method
+
+
+def _plan_tree_copy(src: Path, dst: Path, progress: _CopyProgress) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, os.stat_result]]]:
+    """Create the directory skeleton and symlinks of *src* under *dst*; return (directories, files) still to copy."""
+    directories: List[Tuple[str, str]] = []
+    files: List[Tuple[str, str, os.stat_result]] = []
+    stack = [(str(src), str(dst))]
+    while stack:
+        src_dir, dst_dir = stack.pop()
+        os.mkdir(dst_dir)
+        directories.append((src_dir, dst_dir))
+        with os.scandir(src_dir) as it:
+            for entry in it:
+                target = os.path.join(dst_dir, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir():
+                    stack.append((entry.path, target))
+                elif entry.is_file():
+                    st = entry.stat()
+                    files.append((entry.path, target, st))
+                    progress.bytes_total += st.st_size
+    progress.files_total = len(files)
+    return directories, files
+
+
+async def _copy_tree(src: Path, dst: Path, progress: _CopyProgress) -> None:
+    """Copy a directory tree like shutil.copytree, copying files in parallel on the copy pool."""
+    directories, files = await asyncio.to_thread(_plan_tree_copy, src, dst, progress)
+    loop = asyncio.get_running_loop()
+    pool = _get_copy_pool()
+    # Large files first, so a big one found late doesn't leave the pool idle but for one thread
+    files.sort(key=lambda item: item[2].st_size, reverse=True)
+    await asyncio.gather(*(
+        loop.run_in_executor(pool, _copy_file, src_file, dst_file, st, progress) for src_file, dst_file, st in files
+    ))
+
+    def copy_directory_stats():
+        # Deepest first: filling a directory updates its mtime
+        for src_dir, dst_dir in reversed(directories):
+            shutil.copystat(src_dir, dst_dir)
+
+    await asyncio.to_thread(copy_directory_stats)
+
+
+async def _copy_path(src: Path, dst: Path, progress: _CopyProgress) -> None:
+    """Copy a file or a directory tree from *src* to *dst*, like copy2/copytree.
+
+    Symlinks inside a tree are recreated rather than followed, as ``cp -a`` does.
+    """
+    src_st = await aiofiles.os.stat(str(src))
+    if stat.S_ISDIR(src_st.st_mode):
+        await _copy_tree(src, dst, progress)
+    else:
+        progress.files_total, progress.bytes_total = 1, src_st.st_size
+        await asyncio.to_thread(_copy_file, str(src), str(dst), src_st, progress)
+
+
+def _format_copy_summary(progress: _CopyProgress) -> str:
+    methods = ", ".join(f"{count} via {method}" for method, count in sorted(progress.methods.items()))
+    elapsed = time.monotonic() - progress.started
+    return f"{progress.files_done} files, {progress.bytes_done} bytes in {elapsed:.2f}s ({methods or 'no files'})"
+
+
+# Archives
+ARCHIVE_FORMATS = {
+    "tar": "application/x-tar",
+    "tar.gz": "application/gzip",
+    "tar.zst": "application/zstd",
+    "zip": "application/zip",
+}
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+ARCHIVE_QUEUE_CHUNKS = 8  # Chunks buffered between the archiving thread and the connection
+ARCHIVE_ZSTD_LEVEL = 3
+ARCHIVE_SPOOL_SIZE = 64 * 1024 * 1024  # Zip uploads need seeking, so larger ones are spooled to disk
+ARCHIVE_STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".webp", ".gif", ".mp4", ".webm", ".mov", ".woff", ".woff2",
+    ".zip", ".gz", ".tgz", ".zst", ".br", ".xz", ".bz2", ".7z",
+}
+_ARCHIVE_END = object()  # Queue sentinel for the end of a stream
+_ARCHIVE_ABORT = object()  # Queue sentinel for an upload the client broke off
+_ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+class _ArchiveCancelled(Exception):
+    """Raised inside the archiving thread once the client has gone away."""
+
+
+def _archive_format(fmt: str | None) -> str:
+    if fmt is None:
+        return "tar.zst" if zstandard is not None else "tar.gz"
+    fmt = fmt.lower().lstrip(".")
+    if fmt not in ARCHIVE_FORMATS:
+        raise ToolError(f"Invalid archive format: choose one of {', '.join(ARCHIVE_FORMATS)}")
+    if fmt == "tar.zst" and zstandard is None:
+        raise ToolError("tar.zst archives require the zstandard package")
+    return fmt
+
+
+class _QueueWriter(io.RawIOBase):
+    """Write-only, unseekable file object handing large chunks to a consumer through a bounded queue."""
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue(maxsize=ARCHIVE_QUEUE_CHUNKS)
+        self.cancelled = threading.Event()
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= ARCHIVE_CHUNK_SIZE:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def put(self, item: Any) -> None:
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise _ArchiveCancelled()
+
+    def get(self) -> Any:
+        """Return the next chunk, _ARCHIVE_END, or the exception that stopped archiving (called by the consumer)."""
+        while not self.cancelled.is_set():
+            try:
+                return self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _ARCHIVE_END
+
+    def finish(self) -> None:
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        self.put(_ARCHIVE_END)
+
+
+class _QueueReader(io.RawIOBase):
+    """Read-only file object over chunks that an async producer pushes into an asyncio queue."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ARCHIVE_QUEUE_CHUNKS)
+        self._loop = loop
+        self._chunk = memoryview(b"")
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._chunk and not self._eof:
+            item = asyncio.run_coroutine_threadsafe(self.queue.get(), self._loop).result()
+            if item is _ARCHIVE_ABORT:
+                raise ToolError("Upload was interrupted")
+            if item is _ARCHIVE_END:
+                self._eof = True
+            else:
+                self._chunk = memoryview(item)
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+
+def _write_archive(fileobj: io.RawIOBase, fmt: str, root: Path, files: Iterator[str]) -> None:
+    """Write *files* (paths under *root*) to *fileobj* as a *fmt* archive, in a single forward pass."""
+    if fmt == "zip":
+        # An unseekable target makes zipfile write data descriptors instead of seeking back
+        with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for path in files:
+                stored = os.path.splitext(path)[1].lower() in ARCHIVE_STORED_EXTENSIONS
+                try:
+                    zf.write(path, os.path.relpath(path, root), zipfile.ZIP_STORED if stored else None)
+                except FileNotFoundError:
+                    continue  # Deleted since the walk saw it
+        return
+
+    compressor = None
+    if fmt == "tar.zst":
+        compressor = zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL, threads=-1).stream_writer(fileobj, closefd=False)
+    mode = "w|gz" if fmt == "tar.gz" else "w|"
+    with tarfile.open(fileobj=compressor or fileobj, mode=mode, format=tarfile.PAX_FORMAT) as tar:
+        for path in files:
+            try:
+                tar.add(path, os.path.relpath(path, root), recursive=False)
+            except FileNotFoundError:
+                continue
+    if compressor is not None:
+        compressor.close()
+
+
+def _extract_archive(
+    fileobj: io.RawIOBase, fmt: str, dest: Path, is_excluded: Callable[[Path], bool]
+) -> Tuple[List[str], List[str]]:
+    """Extract an archive read sequentially from *fileobj* into *dest*; return (extracted, skipped) member names.
+
+    Tar members go through tarfile's "data" filter first: leading slashes are stripped, and members
+    landing outside *dest*, links pointing outside it and device files are skipped rather than
+    failing the whole extraction. Zip member names are sanitised by zipfile. Excluded paths, and
+    links to them, are skipped.
+    """
+    extracted: List[str] = []
+    skipped: List[str] = []
+    if fmt == "zip":
+        with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as spool:
+            shutil.copyfileobj(fileobj, spool, ARCHIVE_CHUNK_SIZE)
+            spool.seek(0)
+            with zipfile.ZipFile(spool) as zf:
+                for info in zf.infolist():
+                    # zipfile drops "..", "." and empty components rather than rejecting the member
+                    parts = [p for p in info.filename.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+                    if not parts or is_excluded(dest.joinpath(*parts)):
+                        skipped.append(info.filename)
+                        continue
+                    zf.extract(info, dest)
+                    extracted.append(info.filename)
+        return extracted, skipped
+
+    source = fileobj
+    if fmt == "tar.zst":
+        source = zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    mode = "r|gz" if fmt == "tar.gz" else "r|"
+    with tarfile.open(fileobj=source, mode=mode) as tar:
+        for original in tar:
+            try:
+                member = tarfile.data_filter(original, str(dest))
+            except tarfile.FilterError:
+                skipped.append(original.name)
+                continue
+            # Check the filtered member: it is the one written, with any leading "/" already stripped.
+            # Symlinks extracted earlier are resolved, so "a -> ." then "a/x" is checked as "x"
+            parent, name = os.path.split(os.path.normpath(dest / member.name))
+            target = Path(os.path.realpath(parent)) / name
+            if member.issym():
+                link_target = Path(os.path.realpath(target.parent / member.linkname))
+            elif member.islnk():
+                link_target = Path(os.path.realpath(dest / member.linkname))
+            else:
+                link_target = None
+            # A link to an excluded file would let a later member write through it
+            if is_excluded(target) or (link_target is not None and is_excluded(link_target)):
+                skipped.append(original.name)
+                continue
+            tar.extract(member, dest, filter="data")
+            extracted.append(original.name)
+    return extracted, skipped
+
+
+# Snapshots
+SNAPSHOT_DIR = CACHE_DIR / "snapshots"
+SNAPSHOT_MAX_COUNT = 50  # Beyond this the oldest are dropped, with the contents no other snapshot uses
+SNAPSHOT_SKIP_DIRS = {".git", ".gitscout"}  # Version control keeps its own history
+
+
+def _fingerprint(st: os.stat_result) -> str:
+    """Identify one state of a file without reading it: same inode, size, mtime and ctime means same contents."""
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{st.st_ctime_ns}"
+
+
+class _SnapshotStore:
+    """Content-addressed snapshots of the workspace, for checkpoints and rollback.
+
+    File contents are stored once under objects/ by digest, however many snapshots share them, and
+    a snapshot is a compressed manifest of path -> (digest, mode, size, mtime). A file whose
+    fingerprint matches the one recorded for its path by the last snapshot or restore is not read
+    at all. Contents are copied in and out with _copy_file, so reflinks are used where the
+    filesystem has them; never hard links, which would let an in-place write to the workspace
+    change a stored copy. A lock file serialises operations across workers.
+    """
+
+    def __init__(self, root: Path, directory: Path, skip: List[Path] | None = None):
+        self.root = root
+        self.directory = directory
+        self.objects = directory / "objects"
+        self._skip = {str(path) for path in skip or []}
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            self.objects.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.directory / "snapshots.db"), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if not self._ready:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY,
+                    label TEXT,
+                    created REAL NOT NULL,
+                    files INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    manifest BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    path TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    digest TEXT NOT NULL
+                ) WITHOUT ROWID;
+            """)
+            self._ready = True
+        return db
+
+    def _exclusive(self, operation: Callable[..., Any], *args: Any) -> Any:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / "lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            return operation(*args)
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def _scan(self) -> Tuple[Dict[str, os.stat_result], Dict[str, str], List[str]]:
+        """Return the workspace's files with their stats, its symlinks with their targets, and its directories."""
+        files: Dict[str, os.stat_result] = {}
+        links: Dict[str, str] = {}
+        dirs: List[str] = []
+        stack = [("", str(self.root))]
+        while stack:
+            rel_dir, directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            prefix = rel_dir + "/" if rel_dir else ""
+            for entry in entries:
+                if entry.name in SNAPSHOT_SKIP_DIRS or entry.path in self._skip:
+                    continue
+                if not rel_dir and entry.name in EXCLUDED_PATTERNS:
+                    continue
+                rel = prefix + entry.name
+                try:
+                    if entry.is_symlink():
+                        links[rel] = os.readlink(entry.path)
+                    elif entry.is_dir():
+                        dirs.append(rel)
+                        stack.append((rel, entry.path))
+                    elif entry.is_file():
+                        files[rel] = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+        return files, links, dirs
+
+    def _fingerprints(self) -> Dict[str, Tuple[str, str]]:
+        with self._connect() as db:
+            return {path: (fingerprint, digest) for path, fingerprint, digest in db.execute("SELECT path, fingerprint, digest FROM fingerprints")}
+
+    def _store(self, rel: str, st: os.stat_result) -> Tuple[str, int, bool] | None:
+        """Copy one file into the store; returns its digest, the bytes newly stored and whether it held still meanwhile.
+
+        The copy is hashed rather than the original, so an object always matches its name even if
+        the file is written to while being stored. Returns None if the file has gone.
+        """
+        src = os.path.join(self.root, rel)
+        tmp = self.objects / f"tmp-{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+        try:
+            _copy_file(src, str(tmp), st)
+            steady = _fingerprint(os.lstat(src)) == _fingerprint(st)
+            digest = _file_version(str(tmp))
+            target = self._object_path(digest)
+            if target.exists():
+                return digest, 0, steady
+            target.parent.mkdir(exist_ok=True)
+            os.replace(tmp, target)
+            return digest, st.st_size, steady
+        except FileNotFoundError:
+            return None
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _create(self, label: str | None) -> Dict[str, Any]:
+        started = time.monotonic()
+        files, links, dirs = self._scan()
+        known = self._fingerprints()
+        entries: Dict[str, List[Any]] = {}
+        changed: List[Tuple[str, os.stat_result, str]] = []
+        for rel, st in files.items():
+            fingerprint = _fingerprint(st)
+            cached = known.get(rel)
+            if cached is not None and cached[0] == fingerprint:
+                entries[rel] = [cached[1], stat.S_IMODE(st.st_mode), st.st_size, st.st_mtime_ns]
+            else:
+                changed.append((rel, st, fingerprint))
+
+        def store(item: Tuple[str, os.stat_result, str]) -> Tuple[str, int, bool] | None | OSError:
+            try:
+                return self._store(item[0], item[1])
+            except OSError as e:
+                return e
+
+        stored = stored_bytes = 0
+        updates: List[Tuple[str, str, str]] = []
+        failed: List[Dict[str, str]] = []
+        for (rel, st, fingerprint), result in zip(changed, _get_copy_pool().map(store, changed)):
+            if result is None:
+                continue
+            if isinstance(result, OSError):
+                failed.append({"path": rel, "error": str(result)})
+                continue
+            digest, new_bytes, steady = result
+            entries[rel] = [digest, stat.S_IMODE(st.st_mode), st.st_size, st.st_mtime_ns]
+            stored += bool(new_bytes)
+            stored_bytes += new_bytes
+            if steady:
+                updates.append((rel, fingerprint, digest))
+
+        # Files that couldn't be read are listed so a restore leaves them alone rather than deleting them
+        unreadable = [entry["path"] for entry in failed]
+        manifest = zlib.compress(json.dumps({"files": entries, "links": links, "dirs": dirs, "unreadable": unreadable}).encode())
+        total = sum(entry[2] for entry in entries.values())
+        with self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO fingerprints (path, fingerprint, digest) VALUES (?, ?, ?)", updates)
+            db.executemany("DELETE FROM fingerprints WHERE path = ?", ((rel,) for rel in known.keys() - files.keys()))
+            created = time.time()
+            snapshot_id = db.execute(
+                "INSERT INTO snapshots (label, created, files, bytes, manifest) VALUES (?, ?, ?, ?, ?) RETURNING id",
+                (label, created, len(entries), total, manifest),
+            ).fetchone()[0]
+            expired = [row[0] for row in db.execute(
+                "SELECT id FROM snapshots ORDER BY id DESC LIMIT -1 OFFSET ?", (SNAPSHOT_MAX_COUNT,)
+            )]
+        if expired:
+            self._delete(expired)
+        return {
+            "id": snapshot_id,
+            "label": label,
+            "created": created,
+            "files": len(entries),
+            "bytes": total,
+            "hashed": len(changed),
+            "stored": stored,
+            "stored_bytes": stored_bytes,
+            "failed": failed,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+
+    def _restore_file(self, rel: str, digest: str, mode: int, mtime_ns: int) -> str:
+        """Write one file from the store through a temporary file renamed over it; returns its new fingerprint."""
+        path = os.path.join(self.root, rel)
+        obj = self._object_path(digest)
+        tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.restore.tmp")
+        try:
+            _copy_file(str(obj), tmp, os.stat(obj))
+            os.chmod(tmp, mode)
+            os.utime(tmp, ns=(mtime_ns, mtime_ns))
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return _fingerprint(os.lstat(path))
+
+    def _restore(self, snapshot_id: int) -> Dict[str, Any] | None:
+        started = time.monotonic()
+        with self._connect() as db:
+            row = db.execute("SELECT manifest FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        if row is None:
+            return None
+        manifest = json.loads(zlib.decompress(row[0]))
+        wanted_files: Dict[str, List[Any]] = manifest["files"]
+        wanted_links: Dict[str, str] = manifest["links"]
+        wanted_dirs = set(manifest["dirs"])
+        files, links, dirs = self._scan()
+        known = self._fingerprints()
+        deleted, failed = 0, []
+
+        def remove(rel: str) -> None:
+            path = os.path.join(self.root, rel)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+
+        unreadable = set(manifest.get("unreadable", []))
+        for rel in sorted(((files.keys() - wanted_files.keys()) | (links.keys() - wanted_links.keys())) - unreadable):
+            try:
+                remove(rel)
+                deleted += 1
+            except OSError as e:
+                failed.append({"path": rel, "error": str(e)})
+        for rel in sorted(wanted_dirs):
+            path = os.path.join(self.root, rel)
+            if not os.path.isdir(path) or os.path.islink(path):
+                try:
+                    if os.path.lexists(path):
+                        os.remove(path)
+                    os.mkdir(path)
+                except OSError as e:
+                    failed.append({"path": rel, "error": str(e)})
+
+        restored = 0
+        for rel, target in wanted_links.items():
+            if links.get(rel) != target:
+                try:
+                    remove(rel)
+                    os.symlink(target, os.path.join(self.root, rel))
+                    restored += 1
+                except OSError as e:
+                    failed.append({"path": rel, "error": str(e)})
+
+        to_write: List[Tuple[str, str, int, int]] = []
+        updates = []
+        for rel, (digest, mode, _, mtime_ns) in wanted_files.items():
+            st = files.get(rel)
+            if st is not None and known.get(rel) == (_fingerprint(st), digest):
+                if stat.S_IMODE(st.st_mode) != mode:
+                    path = os.path.join(self.root, rel)
+                    os.chmod(path, mode)
+                    updates.append((rel, _fingerprint(os.lstat(path)), digest))  # chmod changed its ctime
+                continue
+            to_write.append((rel, digest, mode, mtime_ns))
+
+        def restore_file(item: Tuple[str, str, int, int]) -> str | Exception:
+            try:
+                return self._restore_file(*item)
+            except Exception as e:
+                return e
+
+        for (rel, digest, _, _), result in zip(to_write, _get_copy_pool().map(restore_file, to_write)):
+            if isinstance(result, Exception):
+                failed.append({"path": rel, "error": str(result)})
+            else:
+                restored += 1
+                updates.append((rel, result, digest))
+        # Directories the snapshot doesn't have, deepest first; ones still holding skipped items stay
+        for rel in sorted(set(dirs) - wanted_dirs, reverse=True):
+            try:
+                os.rmdir(os.path.join(self.root, rel))
+            except OSError:
+                continue
+
+        with self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO fingerprints (path, fingerprint, digest) VALUES (?, ?, ?)", updates)
+            db.executemany("DELETE FROM fingerprints WHERE path = ?", ((rel,) for rel in files.keys() - wanted_files.keys()))
+        return {
+            "id": snapshot_id,
+            "restored": restored,
+            "deleted": deleted,
+            "unchanged": len(wanted_files) - len(to_write),
+            "failed": failed,
+            "elapsed": round(time.monotonic() - started, 3),
+        }
+
+    def _delete(self, snapshot_ids: List[int]) -> int:
+        """Drop snapshots and every stored object no remaining snapshot refers to; returns how many snapshots went."""
+        with self._connect() as db:
+            deleted = db.executemany("DELETE FROM snapshots WHERE id = ?", ((i,) for i in snapshot_ids)).rowcount
+            referenced: Set[str] = set()
+            for (manifest,) in db.execute("SELECT manifest FROM snapshots"):
+                referenced.update(entry[0] for entry in json.loads(zlib.decompress(manifest))["files"].values())
+        removed = []
+        for prefix in os.scandir(self.objects):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                digest = prefix.name + entry.name
+                if digest not in referenced:
+                    os.remove(entry.path)
+                    removed.append((digest,))
+        # Files fingerprinted with a removed object have to be read again by the next snapshot
+        with self._connect() as db:
+            db.executemany("DELETE FROM fingerprints WHERE digest = ?", removed)
+        return deleted
+
+    def _list(self) -> List[Dict[str, Any]]:
+        with self._connect() as db:
+            rows = db.execute("SELECT id, label, created, files, bytes FROM snapshots ORDER BY id").fetchall()
+        return [{"id": i, "label": label, "created": created, "files": files, "bytes": size} for i, label, created, files, size in rows]
+
+    async def create(self, label: str | None = None) -> Dict[str, Any]:
+        """Snapshot the workspace, reading only files whose fingerprint changed since the last snapshot or restore."""
+        return await asyncio.to_thread(self._exclusive, self._create, label)
+
+    async def restore(self, snapshot_id: int) -> Dict[str, Any] | None:
+        """Put the workspace back as it was in a snapshot, rewriting only files that differ; None if there is no such snapshot."""
+        return await asyncio.to_thread(self._exclusive, self._restore, snapshot_id)
+
+    async def delete(self, snapshot_id: int) -> bool:
+        return bool(await asyncio.to_thread(self._exclusive, self._delete, [snapshot_id]))
+
+    async def list(self) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._list)
+
+
+# Streaming line edits
+EDIT_BLOCK_SIZE = 1024 * 1024
+UNDO_DIR = CACHE_DIR / "undo"
+UNDO_MAX_BYTES = 4 * 1024 * 1024 * 1024  # Backups kept across all files; evicted only by the edit journal that refers to them
+
+
+def _scan_lines(fd: int, wanted: List[int]) -> Tuple[Dict[int, Tuple[int, int]], bytes, int | None]:
+    """Find the byte span [start, end) of each line in sorted, distinct *wanted*; end includes the line ending.
+
+    Returns the spans, the file's line ending (taken from its first line) and, if the scan reached the
+    end of the file, its number of lines. Reading stops once every wanted line is found, and blocks
+    holding none of them are only counted.
+    """
+    spans: Dict[int, Tuple[int, int]] = {}
+    eol = None
+    line, line_start, pos, idx = 1, 0, 0, 0
+    previous = b""
+    while idx < len(wanted):
+        block = os.pread(fd, EDIT_BLOCK_SIZE, pos)
+        if not block:
+            if pos > line_start and wanted[idx] == line:
+                spans[line] = (line_start, pos)  # Last line, without a line ending
+            return spans, eol or b"\n", line if pos > line_start else line - 1
+        if eol is None and (nl := block.find(b"\n")) != -1:
+            eol = b"\r\n" if (block[nl - 1:nl] if nl else previous) == b"\r" else b"\n"
+        newlines = block.count(b"\n")
+        if wanted[idx] < line + newlines:
+            search = 0
+            while idx < len(wanted) and (nl := block.find(b"\n", search)) != -1:
+                end = pos + nl + 1
+                if wanted[idx] == line:
+                    spans[line] = (line_start, end)
+                    idx += 1
+                line, line_start, search = line + 1, end, nl + 1
+        elif newlines:
+            line += newlines
+            line_start = pos + block.rindex(b"\n") + 1
+        previous = block[-1:]
+        pos += len(block)
+    return spans, eol or b"\n", None
+
+
+def _copy_region(src_fd: int, dst_fd: int, offset: int, count: int) -> None:
+    """Append *count* bytes of *src_fd* from *offset* to *dst_fd*, in the kernel where possible."""
+    while count > 0:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, min(count, COPY_CHUNK_SIZE), offset)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            n = os.write(dst_fd, os.pread(src_fd, min(count, EDIT_BLOCK_SIZE), offset))
+        if n == 0:
+            raise ToolError("File shrank while editing")
+        offset += n
+        count -= n
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _temp_beside(path: str, st: os.stat_result) -> Tuple[int, str]:
+    """Create a uniquely named temporary file next to *path*, with the mode and, where permitted, the owner in *st*.
+
+    Returns its open descriptor and name; renaming it over *path* replaces the file without changing either.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        os.fchmod(fd, stat.S_IMODE(st.st_mode))
+        try:
+            os.fchown(fd, st.st_uid, st.st_gid)
+        except PermissionError:
+            pass  # Only root can hand the file to another owner; it stays ours
+    except BaseException:
+        os.close(fd)
+        os.remove(tmp)
+        raise
+    return fd, tmp
+
+
+def _backup_for_undo(path: str, st: os.stat_result) -> Path:
+    """Keep the current contents of *path* for undo: hard-link its inode, or copy it across filesystems."""
+    UNDO_DIR.mkdir(parents=True, exist_ok=True)
+    backup = UNDO_DIR / f"{os.getpid()}-{time.monotonic_ns()}-{os.path.basename(path)}"
+    try:
+        os.link(path, backup)
+    except OSError:
+        _copy_file(path, str(backup), st)
+    return backup
+
+
+def _restore_backup(backup: Path, path: Path) -> None:
+    try:
+        os.replace(backup, path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        backup_st = os.stat(backup)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = backup_st
+        fd, tmp = _temp_beside(str(path), st)
+        os.close(fd)
+        try:
+            _copy_file(str(backup), tmp, backup_st)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.remove(backup)
+
+
+def _rewrite_file(path: str, src_fd: int, st: os.stat_result, edits: List[Tuple[int, int, bytes]]) -> Path:
+    """Replace the byte ranges (start, end) of *path* with new bytes, copying everything else unchanged.
+
+    *edits* must be sorted and must not overlap. The result goes to a temporary file beside *path*
+    that is renamed over it; the original is kept for undo and its backup returned.
+    """
+    dst_fd, tmp = _temp_beside(path, st)
+    try:
+        pos = 0
+        for start, end, data in edits:
+            _copy_region(src_fd, dst_fd, pos, start - pos)
+            _write_all(dst_fd, data)
+            pos = end
+        _copy_region(src_fd, dst_fd, pos, st.st_size - pos)
+        current = os.stat(path)
+        if (current.st_ino, current.st_size, current.st_mtime_ns) != (st.st_ino, st.st_size, st.st_mtime_ns):
+            raise ToolError("File changed while editing; nothing was written")
+        backup = _backup_for_undo(path, st)
+        os.replace(tmp, path)
+        return backup
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        os.close(dst_fd)
+
+
+def _stream_insert(path: str, line: int, text: str) -> Path:
+    """Insert *text* as line *line* of *path* in the file's own line ending; returns the undo backup."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        spans, eol, total = _scan_lines(fd, [line] if line >= 1 else [])
+        data = text.replace("\r\n", "\n").replace("\n", eol.decode()).encode("utf-8")
+        if line in spans:
+            offset = spans[line][0]
+            data += eol
+        elif total is not None and line == total + 1:
+            offset = st.st_size
+            if st.st_size and os.pread(fd, 1, st.st_size - 1) != b"\n":
+                data = eol + data  # Keep the file ending without a newline
+            elif st.st_size:
+                data += eol
+        else:
+            raise ToolError(f"Line number {line} is out of range")
+        return _rewrite_file(path, fd, st, [(offset, offset, data)])
+    finally:
+        os.close(fd)
+
+
+def _stream_delete_lines(path: str, lines: List[int]) -> Path | None:
+    """Delete the given line numbers of *path*, ignoring ones out of range; returns the undo backup, if anything changed."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        spans, _, _ = _scan_lines(fd, sorted({n for n in lines if n >= 1}))
+        ranges: List[List[int]] = []
+        for n in sorted(spans):
+            start, end = spans[n]
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        if not ranges:
+            return None
+        last = ranges[-1]
+        # Deleting the final line of a file without a trailing newline also drops the line ending before it
+        if last[1] == st.st_size and last[0] > 0 and os.pread(fd, 1, st.st_size - 1) != b"\n":
+            last[0] -= 2 if last[0] >= 2 and os.pread(fd, 2, last[0] - 2) == b"\r\n" else 1
+        return _rewrite_file(path, fd, st, [(start, end, b"") for start, end in ranges])
+    finally:
+        os.close(fd)
+
+
+# Batch reads
+BATCH_MAX_PATHS = 1000
+BATCH_CONCURRENCY = 16  # Files read or stat()ed at once by read_many/stat_many
+
+
+def _resolve_view_range(view_range: List[int], line_count: int) -> Tuple[int, int]:
+    """Turn a [start, end] view_range into 1-indexed inclusive bounds; negative values count from the end."""
+    start, end = view_range
+    # Allow negative offsets: -1 refers to the last line, -2 the line before, etc.
+    if start < 0:
+        start = line_count + start + 1  # convert to 1-indexed positive
+    if end < 0:
+        end = line_count + end + 1
+    if start < 1 or start > line_count or end < start or end > line_count:
+        raise ToolError(f"Invalid view_range: {view_range}. File has {line_count} lines, but requested range is [{start}, {end}]")
+    return start, end
+
+
+def _read_entry(full_path: Path, mode: str, encoding: str, line_numbers: bool, view_range: List[int] | None) -> Dict[str, Any]:
+    """Read one file for read_many with a single open and read."""
+    try:
+        with open(full_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        raise ToolError("File not found")
+    except IsADirectoryError:
+        raise ToolError("Path is not a file")
+    if mode == "binary":
+        if view_range:
+            raise ToolError("view_range not applicable in binary mode")
+        return {"content": base64.b64encode(data).decode(), "encoding": "base64"}
+    if mode != "text":
+        raise ToolError("Invalid mode: choose 'text' or 'binary'")
+    content = data.decode(encoding)
+    start = 1
+    if view_range:
+        lines = content.splitlines()
+        start, end = _resolve_view_range(view_range, len(lines))
+        content = "\n".join(lines[start - 1:end])
+    if line_numbers:
+        content = "\n".join(f"{str(start + i).rjust(6)}\t{line}" for i, line in enumerate(content.splitlines()))
+    return {"content": content}
+
+
+def _stat_entry(full_path: Path) -> Dict[str, Any]:
+    try:
+        st = os.stat(full_path)
+    except FileNotFoundError:
+        return {"exists": False}
+    if stat.S_ISREG(st.st_mode):
+        kind = "file"
+    elif stat.S_ISDIR(st.st_mode):
+        kind = "directory"
+    else:
+        kind = "other"
+    return {"exists": True, "type": kind, "size": st.st_size, "mtime": st.st_mtime, "mode": oct(stat.S_IMODE(st.st_mode))}
+
+
+# Multi-file replace
+REPLACE_MAX_FILE_SIZE = 16 * 1024 * 1024  # Larger files are left alone by replace_across
+REPLACE_PREVIEW_HUNKS = 20  # Hunks shown per file in a dry run
+
+
+def _replacement_hunks(content: str, edits: List[Tuple[int, int, str]], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Group *edits* (start, end, replacement) into at most *limit* hunks of whole lines.
+
+    Returns the hunks, showing the text before and after, and how many edits they cover.
+    """
+    hunks: List[Dict[str, Any]] = []
+    line, counted = 1, 0
+    i = 0
+    while i < len(edits) and len(hunks) < limit:
+        line_start = content.rfind("\n", 0, edits[i][0]) + 1
+        line += content.count("\n", counted, line_start)
+        counted = line_start
+        pieces, pos, line_end = [], line_start, line_start
+        while i < len(edits) and (not pieces or edits[i][0] < line_end):
+            start, end, text = edits[i]
+            pieces += [content[pos:start], text]
+            pos = end
+            line_end = content.find("\n", end)
+            line_end = len(content) if line_end == -1 else line_end
+            i += 1
+        pieces.append(content[pos:line_end])
+        hunks.append({"line": line, "before": content[line_start:line_end], "after": "".join(pieces)})
+    return hunks, i
+
+
+def _replace_file(
+    path: str, regex: re.Pattern, replacement: str, literal: bool, apply: bool
+) -> Dict[str, Any] | None:
+    """Replace every match of *regex* in one file; returns None when there is nothing to do.
+
+    The file is rewritten through a temporary file and os.replace, and only if it did not change
+    while being processed. Symbolic links are left alone: replacing one would turn it into a copy.
+    The original text is returned for the undo history.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode) or st.st_size > REPLACE_MAX_FILE_SIZE:
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\0" in data:
+        return None
+    try:
+        content = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None  # Re-encoding would corrupt it
+    edits = [(m.start(), m.end(), replacement if literal else m.expand(replacement)) for m in regex.finditer(content)]
+    if not edits:
+        return None
+    result: Dict[str, Any] = {"path": path, "count": len(edits)}
+    if not apply:
+        result["hunks"], shown = _replacement_hunks(content, edits, REPLACE_PREVIEW_HUNKS)
+        result["truncated"] = shown < len(edits)
+        return result
+
+    pieces, pos = [], 0
+    for start, end, text in edits:
+        pieces += [content[pos:start], text]
+        pos = end
+    pieces.append(content[pos:])
+    fd, tmp = _temp_beside(path, st)
+    try:
+        with open(fd, "wb") as f:
+            f.write("".join(pieces).encode("utf-8"))
+        current = os.lstat(path)
+        if (current.st_ino, current.st_mtime_ns, current.st_size) != (st.st_ino, st.st_mtime_ns, st.st_size):
+            os.remove(tmp)
+            return {"path": path, "error": "File changed while replacing; left untouched"}
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    result["original"] = content
+    return result
+
+
+def _replace_batch(
+    paths: List[str], pattern: str, flags: int, replacement: str, literal: bool, apply: bool
+) -> List[Dict[str, Any]]:
+    """Run _replace_file over a batch of paths in a worker process, reporting per-file errors."""
+    regex = re.compile(pattern, flags)
+    results = []
+    for path in paths:
+        try:
+            result = _replace_file(path, regex, replacement, literal, apply)
+        except re.error:
+            raise  # A bad replacement template fails the same way for every file
+        except (OSError, ValueError) as e:
+            result = {"path": path, "error": str(e)}
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def _format_hunk(rel: str, hunk: Dict[str, Any]) -> str:
+    before = "\n".join(f"- {line}" for line in hunk["before"].split("\n"))
+    after = "\n".join(f"+ {line}" for line in hunk["after"].split("\n"))
+    return f"{rel}:{hunk['line']}\n{before}\n{after}"
+
+
+# Long line windows
+# The breaks str.splitlines() finds in decoded UTF-8, matched in the undecoded bytes
+_LINE_BREAKS = re.compile(rb"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]")
+_UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+
+
+def _split_utf8_lines(data: bytes) -> List[bytes]:
+    """Split UTF-8 *data* where str.splitlines() would split the decoded text, without decoding it."""
+    lines, pos = [], 0
+    for m in _LINE_BREAKS.finditer(data):
+        lines.append(data[pos:m.start()])
+        pos = m.end()
+    if pos < len(data):
+        lines.append(data[pos:])
+    return lines
+
+
+def _check_window(column_range: List[int] | None, max_line_chars: int | None) -> None:
+    if column_range is not None:
+        if len(column_range) != 2 or 0 in column_range or 0 < column_range[1] < column_range[0]:
+            raise ToolError(f"Invalid column_range: {column_range}. Use [start, end] with 1-indexed columns; negative values count from the end")
+    if max_line_chars is not None and max_line_chars < 1:
+        raise ToolError("max_line_chars must be at least 1")
+
+
+def _column_window(total: int, column_range: List[int] | None, max_line_chars: int | None) -> Tuple[int, int]:
+    """Resolve the 1-indexed, inclusive columns to show of a line *total* characters long."""
+    start, end = column_range or (1, total)
+    if start < 0:
+        start = total + start + 1
+    if end < 0:
+        end = total + end + 1
+    start, end = max(start, 1), min(end, total)
+    if max_line_chars is not None:
+        end = min(end, start + max_line_chars - 1)
+    return start, end
+
+
+def _mark_window(text: str, start: int, end: int, total: int) -> str:
+    if start > 1:
+        text = f"[{min(start - 1, total)} chars]..." + text
+    if end < total:
+        text += f"...[{total - max(end, start - 1)} more chars]"
+    return text
+
+
+def _window_text(line: str, column_range: List[int] | None, max_line_chars: int | None) -> str:
+    """Cut *line* down to its column window, marking how much was left out on either side."""
+    if column_range is None and (max_line_chars is None or len(line) <= max_line_chars):
+        return line
+    start, end = _column_window(len(line), column_range, max_line_chars)
+    return _mark_window(line[start - 1:end], start, end, len(line))
+
+
+def _window_utf8(line: bytes, column_range: List[int] | None, max_line_chars: int | None) -> str:
+    """Like _window_text for an undecoded UTF-8 line, decoding no more of it than the window needs.
+
+    Characters are counted without decoding, as the bytes that aren't continuation bytes.
+    """
+    if column_range is None and (max_line_chars is None or len(line) <= max_line_chars):
+        return line.decode("utf-8", errors="replace")
+    is_ascii = line.isascii()
+    total = len(line) if is_ascii else len(line.translate(None, _UTF8_CONTINUATION))
+    start, end = _column_window(total, column_range, max_line_chars)
+    if start > end:
+        text = ""
+    elif is_ascii:
+        text = line[start - 1:end].decode("ascii")
+    else:
+        # The first *end* characters fit in 4 * end bytes; a character cut in half there is held back
+        text = codecs.getincrementaldecoder("utf-8")("replace").decode(line[:4 * end])[start - 1:end]
+    return _mark_window(text, start, end, total)
+
+
+# Versions and deltas
+VERSION_MAX_FILE_SIZE = 8 * 1024 * 1024  # Larger files get a version token but are never diffed
+VERSION_CACHE_BYTES = 64 * 1024 * 1024  # Text of recently seen versions, kept to diff against
+DIFF_MAX_EDITS = 2000  # Beyond this many inserted plus deleted lines, a delta isn't worth computing
+DELTA_EDIT_HUNKS = 20  # Hunks shown after an edit; a delta view always shows all of them
+
+
+def _content_version(data: bytes) -> str:
+    """Version token for file contents: the same digest as the file's content-hash ETag."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _file_version(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(EDIT_BLOCK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _VersionStore:
+    """The lines of recently seen file versions by token, least recently used dropped first.
+
+    Lines keep their endings, so a change of line ending alone still shows up in a delta.
+    """
+
+    def __init__(self, max_bytes: int = VERSION_CACHE_BYTES):
+        self._entries: "OrderedDict[str, Tuple[List[str], int]]" = OrderedDict()
+        self._size = 0
+        self._max_bytes = max_bytes
+
+    def add(self, token: str, lines: List[str], size: int) -> None:
+        if token in self._entries:
+            self._entries.move_to_end(token)
+            return
+        self._entries[token] = (lines, size)
+        self._size += size
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            _, (_, dropped) = self._entries.popitem(last=False)
+            self._size -= dropped
+
+    def get(self, token: str) -> List[str] | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        self._entries.move_to_end(token)
+        return entry[0]
+
+
+def _myers_diff(old: List[str], new: List[str], max_edits: int = DIFF_MAX_EDITS) -> List[Tuple[int, int, int, int]] | None:
+    """Diff two line lists with Myers' algorithm over line ids; None if it takes more than *max_edits* edits.
+
+    Returns the changed regions as 0-indexed, half-open (old start, old end, new start, new end).
+    """
+    ids: Dict[str, int] = {}
+    a = [ids.setdefault(line, len(ids)) for line in old]
+    b = [ids.setdefault(line, len(ids)) for line in new]
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    a, b = a[prefix:len(a) - suffix], b[prefix:len(b) - suffix]
+    n, m = len(a), len(b)
+    if not n or not m:
+        return [(prefix, prefix + n, prefix, prefix + m)] if n or m else []
+
+    # Forward pass: v[k] is the furthest x reached on diagonal k = x - y; each round's v is kept to backtrack
+    v = {1: 0}
+    trace = []
+    found = False
+    for d in range(min(n + m, max_edits) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            x = v[k + 1] if k == -d or (k != d and v[k - 1] < v[k + 1]) else v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x, y = x + 1, y + 1
+            v[k] = x
+            if x >= n and y >= m:
+                found = True
+                break
+        if found:
+            break
+    if not found:
+        return None
+
+    # Backtrack through the rounds, collecting the matched line pairs
+    matches: List[Tuple[int, int]] = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        prev_k = k + 1 if k == -d or (k != d and v[k - 1] < v[k + 1]) else k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x, y = x - 1, y - 1
+            matches.append((x, y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+
+    regions = []
+    i = j = 0
+    for mi, mj in matches + [(n, m)]:
+        if mi > i or mj > j:
+            regions.append((prefix + i, prefix + mi, prefix + j, prefix + mj))
+        i, j = mi + 1, mj + 1
+    return regions
+
+
+def _format_delta(
+    old: List[str],
+    new: List[str],
+    regions: List[Tuple[int, int, int, int]],
+    limit: int | None = None,
+    render: Callable[[str], str] = lambda line: line,
+) -> str:
+    """Render changed regions as unified diff hunks without context lines, passing each line through *render*."""
+    out = []
+    for a_start, a_end, b_start, b_end in regions[:limit]:
+        # As in diff -U0, an empty side names the line before it
+        out.append(
+            f"@@ -{a_start + (a_end > a_start)},{a_end - a_start} +{b_start + (b_end > b_start)},{b_end - b_start} @@"
+        )
+        out.extend("-" + render(line.splitlines()[0]) for line in old[a_start:a_end])
+        out.extend("+" + render(line.splitlines()[0]) for line in new[b_start:b_end])
+    if limit is not None and len(regions) > limit:
+        out.append(f"... {len(regions) - limit} more hunks")
+    return "\n".join(out)
+
+
+def _load_version(path: str, before: str | Path | None) -> Tuple[str, List[str] | None, List[str] | None]:
+    """Read the version token and lines of *path*, plus the lines of *before* (text or a backup file) to diff against.
+
+    Files over VERSION_MAX_FILE_SIZE are only hashed, in blocks.
+    """
+    if os.path.getsize(path) > VERSION_MAX_FILE_SIZE:
+        return _file_version(path), None, None
+    with open(path, "rb") as f:
+        data = f.read()
+    if isinstance(before, Path):
+        before = before.read_bytes().decode("utf-8", errors="replace") if before.stat().st_size <= VERSION_MAX_FILE_SIZE else None
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return _content_version(data), lines, before.splitlines(keepends=True) if before is not None else None
+
+
+# Edit journal
+JOURNAL_MAX_EDITS = 50  # Undo steps kept per file
+JOURNAL_MAX_BYTES = 256 * 1024 * 1024  # Compressed patches and texts kept across all files, oldest dropped first
+JOURNAL_MAX_AGE = 7 * 24 * 3600.0  # Seconds an entry is kept
+JOURNAL_TRIM_INTERVAL = 100  # Edits recorded between checks of the size and age limits
+JOURNAL_SCHEMA_VERSION = 2  # Kept in PRAGMA user_version; older journals are migrated when opened
+Patch = List[Tuple[int, int, List[bytes]]]  # (start, end, replacement lines): line ranges to replace, in order
+
+
+def _encode_patch(patch: Patch) -> bytes:
+    # Latin-1 maps bytes to code points one to one, so any line survives JSON unchanged
+    return zlib.compress(json.dumps([[a0, a1, [line.decode("latin-1") for line in lines]] for a0, a1, lines in patch]).encode())
+
+
+def _decode_patch(data: bytes) -> Patch:
+    return [(a0, a1, [line.encode("latin-1") for line in lines]) for a0, a1, lines in json.loads(zlib.decompress(data))]
+
+
+def _journal_payload(current: bytes, target: bytes) -> Tuple[str, bytes]:
+    """Encode what turns *current* into *target*: a compressed line patch, or the whole compressed text if diffing fails."""
+    if len(current) <= VERSION_MAX_FILE_SIZE and len(target) <= VERSION_MAX_FILE_SIZE:
+        old, new = current.splitlines(keepends=True), target.splitlines(keepends=True)
+        regions = _myers_diff(old, new)
+        if regions is not None:
+            return "patch", _encode_patch([(a0, a1, new[b0:b1]) for a0, a1, b0, b1 in regions])
+    return "text", zlib.compress(target)
+
+
+def _apply_payload(current: bytes, kind: str, data: bytes) -> Tuple[bytes, str, bytes]:
+    """Apply a patch or text payload to *current*; returns the result and the payload that turns it back."""
+    if kind == "text":
+        target = zlib.decompress(data)
+        return (target, *_journal_payload(target, current))
+    lines = current.splitlines(keepends=True)
+    out: List[bytes] = []
+    inverse: Patch = []
+    pos = 0
+    for a0, a1, replacement in _decode_patch(data):
+        out += lines[pos:a0]
+        inverse.append((len(out), len(out) + len(replacement), lines[a0:a1]))
+        out += replacement
+        pos = a1
+    out += lines[pos:]
+    return b"".join(out), "patch", _encode_patch(inverse)
+
+
+def _discard_payloads(rows: List[Tuple[str, bytes]]) -> None:
+    for kind, data in rows:
+        if kind == "backup":
+            Path(data.decode()).unlink(missing_ok=True)
+
+
+class _EditJournal:
+    """Undo and redo history of file edits, in a WAL-mode SQLite journal shared by every worker.
+
+    An entry holds what turns one version of a file into its state before the edit (or, once
+    undone, after it): a compressed line patch, the compressed text, or the path of the byte-exact
+    backup a streaming edit left. It only applies to the version it was recorded against, so an
+    undo never silently discards a change made since. Undo and redo hold SQLite's write lock,
+    which serialises them across workers.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._ready = False
+        self._recorded = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.db_path), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        if not self._ready:
+            with db:
+                db.execute("BEGIN IMMEDIATE")  # One worker creates or migrates the table
+                if db.execute("PRAGMA user_version").fetchone()[0] < JOURNAL_SCHEMA_VERSION:
+                    self._migrate(db)
+            self._ready = True
+        return db
+
+    @staticmethod
+    def _migrate(db: sqlite3.Connection) -> None:
+        columns = {row[1] for row in db.execute("PRAGMA table_info(edits)")}
+        if columns and "size" not in columns:
+            # Version 1 had no sizes: payloads are measured here, backups on disk
+            db.execute("ALTER TABLE edits ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            db.execute("UPDATE edits SET size = length(data) WHERE kind != 'backup'")
+            for entry_id, data in db.execute("SELECT id, data FROM edits WHERE kind = 'backup'").fetchall():
+                try:
+                    db.execute("UPDATE edits SET size = ? WHERE id = ?", (os.stat(data.decode()).st_size, entry_id))
+                except OSError:
+                    continue
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS edits (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                undone INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS edits_path ON edits (path, undone, id)")
+        db.execute(f"PRAGMA user_version = {JOURNAL_SCHEMA_VERSION}")
+
+    def record(self, path: str, previous: str | Path) -> None:
+        """Add an undo entry for the edit just made to *path*, whose text before it was *previous* (or is in that backup file).
+
+        Entries previously undone can no longer be redone, and the oldest beyond JOURNAL_MAX_EDITS are dropped.
+        """
+        if isinstance(previous, Path):
+            kind, data, version = "backup", str(previous).encode(), _file_version(path)
+            size = os.stat(previous).st_size
+        else:
+            with open(path, "rb") as f:
+                current = f.read()
+            kind, data = _journal_payload(current, previous.encode("utf-8"))
+            version, size = _content_version(current), len(data)
+        self._recorded += 1
+        with self._connect() as db:
+            dropped = db.execute("DELETE FROM edits WHERE path = ? AND undone = 1 RETURNING kind, data", (path,)).fetchall()
+            db.execute(
+                "INSERT INTO edits (path, undone, version, kind, data, size, created) VALUES (?, 0, ?, ?, ?, ?, ?)",
+                (path, version, kind, data, size, time.time()),
+            )
+            dropped += db.execute(
+                "DELETE FROM edits WHERE id IN (SELECT id FROM edits WHERE path = ? ORDER BY id DESC LIMIT -1 OFFSET ?) "
+                "RETURNING kind, data",
+                (path, JOURNAL_MAX_EDITS),
+            ).fetchall()
+            if kind == "backup" or self._recorded % JOURNAL_TRIM_INTERVAL == 0:
+                dropped += self._trim(db)
+        _discard_payloads(dropped)
+
+    @staticmethod
+    def _trim(db: sqlite3.Connection) -> List[Tuple[str, bytes]]:
+        """Drop entries past JOURNAL_MAX_AGE, then the oldest until patches and texts fit in JOURNAL_MAX_BYTES
+        and backups in UNDO_MAX_BYTES."""
+        dropped = db.execute(
+            "DELETE FROM edits WHERE created < ? RETURNING kind, data", (time.time() - JOURNAL_MAX_AGE,)
+        ).fetchall()
+        for kinds, max_bytes in (("kind != 'backup'", JOURNAL_MAX_BYTES), ("kind = 'backup'", UNDO_MAX_BYTES)):
+            total = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM edits WHERE {kinds}").fetchone()[0]
+            if total <= max_bytes:
+                continue
+            for entry_id, size in db.execute(f"SELECT id, size FROM edits WHERE {kinds} ORDER BY id").fetchall():
+                total -= size
+                if total <= max_bytes:
+                    break
+            dropped += db.execute(
+                f"DELETE FROM edits WHERE {kinds} AND id <= ? RETURNING kind, data", (entry_id,)
+            ).fetchall()
+        # Backups never recorded (the worker died mid-edit) are dropped once they are as old as the oldest entry could be
+        referenced = {data.decode() for (data,) in db.execute("SELECT data FROM edits WHERE kind = 'backup'")}
+        try:
+            entries = list(os.scandir(UNDO_DIR))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            try:
+                stale = entry.stat().st_ctime < time.time() - JOURNAL_MAX_AGE
+            except FileNotFoundError:
+                continue
+            if stale and entry.path not in referenced:
+                dropped.append(("backup", entry.path.encode()))
+        return dropped
+
+    def step(self, path: str, redo: bool = False) -> bool:
+        """Undo the latest edit of *path*, or redo the one undone last; False if there is none."""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                f"SELECT id, version, kind, data FROM edits WHERE path = ? AND undone = ? ORDER BY id {'ASC' if redo else 'DESC'} LIMIT 1",
+                (path, int(redo)),
+            ).fetchone()
+            if row is None:
+                return False
+            entry_id, version, kind, data = row
+            changed = ToolError(f"File changed since this edit; {'redoing' if redo else 'undoing'} it would discard those changes")
+            if kind == "backup":
+                backup = Path(data.decode())
+                if _file_version(path) != version:
+                    raise changed
+                if not backup.exists():
+                    raise ToolError("The backup kept for this edit is gone")
+                st = os.stat(path)
+                inverse = _backup_for_undo(path, st)
+                _restore_backup(backup, Path(path))
+                version, data, size = _file_version(path), str(inverse).encode(), st.st_size
+            else:
+                with open(path, "rb") as f:
+                    current = f.read()
+                if _content_version(current) != version:
+                    raise changed
+                target, kind, data = _apply_payload(current, kind, data)
+                with open(path, "wb") as f:
+                    f.write(target)
+                version, size = _content_version(target), len(data)
+            db.execute(
+                "UPDATE edits SET undone = ?, version = ?, kind = ?, data = ?, size = ? WHERE id = ?",
+                (int(not redo), version, kind, data, size, entry_id),
+            )
+        return True
+
+    def forget(self, path: str) -> None:
+        with self._connect() as db:
+            dropped = db.execute("DELETE FROM edits WHERE path = ? RETURNING kind, data", (path,)).fetchall()
+        _discard_payloads(dropped)
+
+    def rename(self, src: str, dst: str) -> None:
+        with self._connect() as db:
+            dropped = db.execute("DELETE FROM edits WHERE path = ? RETURNING kind, data", (dst,)).fetchall()
+            db.execute("UPDATE edits SET path = ? WHERE path = ?", (dst, src))
+        _discard_payloads(dropped)
+
+
+# Append channels
+APPEND_FLUSH_INTERVAL = 0.05  # Seconds an append waits in the buffer for others to join it
+APPEND_FLUSH_BYTES = 256 * 1024  # A buffer this large is flushed at once
+APPEND_MAX_BUFFERED = 4  # Appends wait once this many times flush_bytes are buffered behind a flush
+APPEND_MAX_CHANNELS = 256
+APPEND_ACKS = ("buffered", "written", "synced")
+AppendListener = Callable[["_AppendChannel", str | None], None]  # (channel, error) after each flush
+
+
+class _AppendChannel:
+    """Coalesces appends to one file into a single write per flush, in the order they arrived.
+
+    A flush happens flush_interval after the first buffered append, or as soon as flush_bytes are
+    buffered. With fsync, or when an append asks to be acknowledged as synced, the flush ends with
+    one fsync covering everything it wrote (group commit). The file is opened once per flush, so
+    it can be moved or deleted in between. When writes fall behind, appends wait for flushes
+    rather than buffering without bound. A flush that fails drops its data.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        flush_interval: float = APPEND_FLUSH_INTERVAL,
+        flush_bytes: int = APPEND_FLUSH_BYTES,
+        fsync: bool = False,
+        on_flush: Callable[[], None] | None = None,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.accepted = 0  # Appends accepted so far; each one's sequence number is the count at the time
+        self.written = 0  # Sequence number of the last append written to the file
+        self.synced = 0  # ... and of the last one fsynced
+        self._on_flush = on_flush
+        self._buffer = bytearray()
+        self._waiters: List[Tuple[int, str, asyncio.Future]] = []  # (sequence number, ack, future)
+        self._listeners: List[AppendListener] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()  # One flush at a time keeps the writes in order
+
+    @property
+    def idle(self) -> bool:
+        return not self._buffer and not self._waiters and not self._listeners and not self._lock.locked()
+
+    def add_listener(self, callback: AppendListener) -> None:
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: AppendListener) -> None:
+        self._listeners.remove(callback)
+
+    async def append(self, data: bytes, ack: str = "buffered") -> int:
+        """Buffer *data*, returning its sequence number once it is buffered, written or synced as *ack* asks."""
+        if ack not in APPEND_ACKS:
+            raise ToolError(f"Invalid ack: choose one of {', '.join(APPEND_ACKS)}")
+        while len(self._buffer) >= self.flush_bytes * APPEND_MAX_BUFFERED:
+            await self.flush()
+        self._buffer += data
+        self.accepted += 1
+        seq = self.accepted
+        loop = asyncio.get_running_loop()
+        if len(self._buffer) >= self.flush_bytes:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+        if ack == "buffered":
+            return seq
+        future = loop.create_future()
+        self._waiters.append((seq, ack, future))
+        await future
+        return seq
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _write(self, data: bytes, sync: bool) -> None:
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            _write_all(fd, data)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def flush(self) -> None:
+        """Write out everything buffered so far and settle the appends waiting on it."""
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._buffer and not self._waiters:
+                return
+            data, self._buffer = bytes(self._buffer), bytearray()
+            waiters, self._waiters = self._waiters, []
+            last = self.accepted
+            sync = self.fsync or any(ack == "synced" for _, ack, _ in waiters)
+            error = None
+            try:
+                await asyncio.to_thread(self._write, data, sync)
+                self.written = last
+                if sync:
+                    self.synced = last
+            except OSError as e:
+                error = f"Failed to append to {self.path}: {str(e)}"
+            for _, _, future in waiters:
+                if future.done():
+                    continue  # The caller went away
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(ToolError(error))
+        if error is None and self._on_flush is not None:
+            self._on_flush()
+        for callback in list(self._listeners):
+            callback(self, error)
+
+
+# File tail
+TAIL_BLOCK_SIZE = 64 * 1024  # Bytes read per step when scanning back for the last lines
+TAIL_READ_SIZE = 1024 * 1024  # Most appended bytes sent in one event
+TAIL_POLL_INTERVAL = 1.0  # Seconds between checks when inotify is unavailable
+TAIL_KEEPALIVE = 15.0  # Seconds of quiet before a keep-alive comment
+
+
+def _tail_start(fd: int, size: int, lines: int) -> int:
+    """Return the offset where the last *lines* lines of a file *size* bytes long begin, scanning back in blocks."""
+    if lines <= 0:
+        return size
+    # A final newline ends the last line rather than starting an empty one
+    wanted = lines + 1 if size and os.pread(fd, 1, size - 1) == b"\n" else lines
+    pos = size
+    while pos > 0:
+        start = max(0, pos - TAIL_BLOCK_SIZE)
+        block = os.pread(fd, pos - start, start)
+        count = block.count(b"\n")
+        if count >= wanted:
+            index = len(block)
+            for _ in range(wanted):
+                index = block.rindex(b"\n", 0, index)
+            return start + index + 1
+        wanted -= count
+        pos = start
+    return 0
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _follow_file(path: Path, lines: int, watcher: _InotifyWatcher | None) -> AsyncIterator[str]:
+    """Yield server-sent events for the last *lines* lines of *path*, then for everything appended to it.
+
+    Only bytes past the offset already sent are read. A file that shrinks was truncated and is
+    followed again from its start. When another file appears at *path* it was rotated in: the rest
+    of the old file is sent first, then the new one is followed from its start.
+    """
+    changed = asyncio.Event()
+
+    def on_change(kind: str, changed_path: Path, dest: Path | None = None) -> None:
+        if kind == "rescan" or changed_path == path or dest == path:
+            changed.set()
+
+    watching = watcher is not None and await watcher.start()
+    if watching:
+        watcher.add_listener(on_change)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        offset = await asyncio.to_thread(_tail_start, fd, st.st_size, lines)
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        yield _sse_event("start", {"offset": offset})
+        quiet = 0.0
+        while True:
+            changed.clear()
+            size = os.fstat(fd).st_size
+            if size < offset:
+                offset = 0
+                decoder.reset()
+                yield _sse_event("truncate", {"offset": 0})
+            while offset < size:
+                chunk = await asyncio.to_thread(os.pread, fd, min(TAIL_READ_SIZE, size - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield _sse_event("append", {"offset": offset, "text": decoder.decode(chunk)})
+                quiet = 0.0
+
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None  # Moved away; keep following the old file until a new one appears
+            if current is not None and (current.st_dev, current.st_ino) != (st.st_dev, st.st_ino):
+                try:
+                    rotated = os.open(path, os.O_RDONLY)
+                except FileNotFoundError:
+                    continue
+                os.close(fd)
+                fd = rotated
+                st = os.fstat(fd)
+                offset = 0
+                decoder.reset()
+                yield _sse_event("rotate", {"offset": 0})
+                continue
+
+            timeout = TAIL_KEEPALIVE if watching else TAIL_POLL_INTERVAL
+            try:
+                await asyncio.wait_for(changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                quiet += timeout
+                if quiet >= TAIL_KEEPALIVE:
+                    quiet = 0.0
+                    yield ": keep-alive\n\n"
+    finally:
+        os.close(fd)
+        if watching:
+            watcher.remove_listener(on_change)
+
+
+# Find
+FIND_TYPES = {"f": False, "file": False, "d": True, "directory": True}  # Type name -> is_dir
+FIND_CONCURRENCY = 16  # Directories scanned at once when there is no cached tree
+FIND_STAT_BATCH = 256  # Entries stat()ed per thread hop
+FIND_DEFAULT_LIMIT = 1000
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+_AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def _parse_size(value: int | str | None) -> int | None:
+    """Accept a byte count, or a size such as "10k", "5M" or "1.5GiB"."""
+    if value is None or isinstance(value, int):
+        return value
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*", str(value).lower())
+    if m is None:
+        raise ToolError(f"Invalid size: {value}")
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2)])
+
+
+def _parse_time(value: float | str | None, now: float) -> float | None:
+    """Accept a Unix timestamp, an ISO 8601 date, or an age such as "15m", "2h" or "7d" before *now*."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*", value.lower())
+    if m is not None:
+        return now - float(m.group(1)) * _AGE_UNITS[m.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ToolError(f"Invalid time: {value}. Use a Unix timestamp, an ISO date or an age like 2h")
+
+
+@dataclass(frozen=True)
+class _FindCriteria:
+    """The predicates of one find request; paths are relative to the workspace."""
+    base: str  # The directory searched, relative to the workspace
+    pattern: str | None = None  # Glob on the name, or on the path below base when it contains "/"
+    is_dir: bool | None = None
+    min_size: int | None = None
+    max_size: int | None = None
+    newer_than: float | None = None
+    older_than: float | None = None
+    max_depth: int | None = None
+    with_stat: bool = False  # Report size and mtime even without a predicate on them
+
+    @property
+    def needs_stat(self) -> bool:
+        return self.with_stat or any(
+            value is not None for value in (self.min_size, self.max_size, self.newer_than, self.older_than)
+        )
+
+    def selects(self, rel: str, is_dir: bool) -> bool:
+        """Check the predicates that need no stat()."""
+        if self.is_dir is not None and is_dir != self.is_dir:
+            return False
+        if self.pattern is None:
+            return True
+        if "/" in self.pattern:
+            return fnmatch.fnmatchcase(rel[len(self.base) + 1:] if self.base else rel, self.pattern)
+        return fnmatch.fnmatchcase(rel.rpartition("/")[2], self.pattern)
+
+    def selects_stat(self, st: os.stat_result) -> bool:
+        return (
+            (self.min_size is None or st.st_size >= self.min_size)
+            and (self.max_size is None or st.st_size <= self.max_size)
+            and (self.newer_than is None or st.st_mtime > self.newer_than)
+            and (self.older_than is None or st.st_mtime < self.older_than)
+        )
+
+
+def _stat_found(root: Path, items: List[Tuple[str, bool]], criteria: _FindCriteria) -> List[_DirEntry]:
+    found = []
+    for rel, is_dir in items:
+        try:
+            st = os.stat(root / rel, follow_symlinks=False)
+        except OSError:
+            continue  # Gone since it was listed
+        if criteria.selects_stat(st):
+            found.append(_DirEntry(rel, is_dir, st.st_size, st.st_mtime))
+    return found
+
+
+def _scan_find_dir(
+    directory: str, rel_dir: str, chain: IgnoreChain, matcher: _PathMatcher, git_ignore: bool
+) -> Tuple[List[Tuple[str, bool]], List[Tuple[str, str, IgnoreChain]]]:
+    """Scan one directory for the find walk: return its (rel, is_dir) entries and the subdirectories to descend into."""
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError:
+        return [], []
+    if git_ignore:
+        chain = matcher.scope(chain, rel_dir, any(entry.name == GITIGNORE_FILE for entry in entries))
+    prefix = rel_dir + "/" if rel_dir else ""
+    found, subdirs = [], []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if not is_dir and not entry.is_file():
+                continue
+        except OSError:
+            continue
+        rel = prefix + entry.name
+        if matcher.excludes(chain, rel, is_dir, True, git_ignore):
+            continue
+        found.append((rel, is_dir))
+        if is_dir:
+            subdirs.append((entry.path, rel, chain))
+    return found, subdirs
+
+
+async def _aiter(items: List[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+async def _walk_parallel(
+    start: Path, rel_start: str, matcher: _PathMatcher, git_ignore: bool, max_depth: int | None
+) -> AsyncIterator[Tuple[str, bool]]:
+    """Walk a tree scanning up to FIND_CONCURRENCY directories at once, yielding (rel, is_dir) as found.
+
+    Excluded directories and those below *max_depth* are never scanned.
+    """
+    chain = matcher.chain(rel_start.rpartition("/")[0]) if git_ignore and rel_start else []
+    waiting: List[Tuple[str, str, IgnoreChain, int]] = [(str(start), rel_start, chain, 1)]
+    running: Dict[asyncio.Future, int] = {}
+    try:
+        while waiting or running:
+            while waiting and len(running) < FIND_CONCURRENCY:
+                directory, rel_dir, chain, depth = waiting.pop()
+                task = asyncio.ensure_future(
+                    asyncio.to_thread(_scan_find_dir, directory, rel_dir, chain, matcher, git_ignore)
+                )
+                running[task] = depth
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                depth = running.pop(task)
+                found, subdirs = task.result()
+                if max_depth is None or depth < max_depth:
+                    waiting.extend((directory, rel, chain, depth + 1) for directory, rel, chain in subdirs)
+                for item in found:
+                    yield item
+    finally:
+        for task in running:
+            task.cancel()
+
+
+# File Tool implementation
+class FileTool(BaseAnthropicTool):
+    """
+    A filesystem editor tool that allows the agent to view, create, and edit files.
+    """
+
+    name: ClassVar[Literal["file"]] = "file"
+    _journal: _EditJournal  # Undo and redo history, shared by all workers and kept across restarts
+    _listeners: List[FsListener]  # Notified after every successful mutation
+    _operations: List[_CopyProgress]  # Copies and moves in progress
+    _versions: _VersionStore  # Recently seen file versions, for delta views
+    _append_channels: Dict[Path, _AppendChannel]  # Buffered append channels by file
+
+    def __init__(
+        self,
+        base_path: Path | None = None,
+        search_index: _TrigramIndex | None = None,
+        path_matcher: _PathMatcher | None = None,
+        tree: _WorkspaceTree | None = None,
+        journal: _EditJournal | None = None,
+    ):
+        self._journal = journal or _EditJournal(CACHE_DIR / "journal.db")
+        self._listeners = []
+        self._operations = []
+        self._versions = _VersionStore()
+        self._append_channels = {}
+        self.base_path = base_path or Path.cwd()
+        self._search_index = search_index
+        self._path_matcher = path_matcher or _PathMatcher(self.base_path)
+        self._tree = tree if tree is not None and tree.root == self.base_path else None
+        if search_index is not None:
+            self.add_listener(search_index.on_change)
+        # Note: We'll check/create the base_path in the first async call
+        super().__init__()
+
+    def add_listener(self, callback: FsListener) -> None:
+        """Register a callback invoked as (kind, path, dest) after each file mutation."""
+        self._listeners.append(callback)
+
+    def _notify(self, kind: str, path: Path, dest: Path | None = None) -> None:
+        for callback in self._listeners:
+            try:
+                callback(kind, path, dest)
+            except Exception:
+                pass
+
+    async def _remember(self, full_path: Path, previous: str | Path) -> None:
+        """Journal an undo entry for the edit just made to *full_path*; *previous* is its text, or a backup file, from before."""
+        try:
+            await asyncio.to_thread(self._journal.record, str(full_path), previous)
+        except (OSError, sqlite3.Error):
+            # The edit itself went through; it just can't be undone
+            if isinstance(previous, Path):
+                previous.unlink(missing_ok=True)
+
+    async def _with_version(self, full_path: Path, result: ToolResult, before: str | Path | None = None) -> ToolResult:
+        """Attach the file's new version token to *result*, plus the hunks changed since *before* if it is given."""
+        try:
+            token, lines, old = await asyncio.to_thread(_load_version, str(full_path), before)
+        except OSError:
+            return result
+        if lines is None:
+            return result.replace(version=token)
+        self._versions.add(token, lines, sum(map(len, lines)))
+        if old is not None:
+            regions = await asyncio.to_thread(_myers_diff, old, lines)
+            if regions is None:
+                result = result.replace(output=f"{result.output}\n(Too many changes to show; view the file)")
+            elif regions:
+                result = result.replace(output=f"{result.output}\n{_format_delta(old, lines, regions, DELTA_EDIT_HUNKS)}")
+        return result.replace(version=token)
+
+    def operations(self) -> List[Dict[str, Any]]:
+        """Return the progress of the copies and moves currently running."""
+        return [progress.snapshot() for progress in self._operations]
+
+    async def _run_copy(self, operation: str, src_path: Path, dst_path: Path) -> _CopyProgress:
+        progress = _CopyProgress(operation, str(src_path), str(dst_path))
+        self._operations.append(progress)
+        try:
+            await _copy_path(src_path, dst_path, progress)
+        finally:
+            self._operations.remove(progress)
+        return progress
+    
+    async def _ensure_base_path_exists(self):
+        """Ensure base path exists - call this in async methods that need it"""
+        if not await aiofiles.os.path.exists(str(self.base_path)):
+            await asyncio.to_thread(self.base_path.mkdir, parents=True, exist_ok=True)
+    
+    async def _validate_path(self, path: str) -> Path:
+        try:
+            path_obj = Path(path)
+            full_path = path_obj if path_obj.is_absolute() else (self.base_path / path_obj).resolve()
+            # Allow access to the entire workspace area
+            if not str(full_path).startswith(str(self.base_path)):
+                raise ToolError("Path is outside the allowed base directory")
+            return full_path
+        except Exception as e:
+            raise ToolError(f"Invalid path: {str(e)}")
+        
+    async def __call__(self, command: Command, **kwargs) -> ToolResult:
+        try:
+            if command not in get_args(Command):
+                raise ToolError(f"Unsupported command: {command}. Supported commands: {', '.join(get_args(Command))}")
+            
+            method_map = {
+                "read": self.read, "write": self.write, "append": self.append, "delete": self.delete,
+                "exists": self.exists, "list": self.list_dir, "mkdir": self.mkdir, "rmdir": self.rmdir,
+                "move": self.move, "copy": self.copy, "view": self.view, "create": self.create,
+                "replace": self.replace, "insert": self.insert, "delete_lines": self.delete_lines,
+                "undo": self.undo, "redo": self.redo, "grep": self.grep, "search": self.search,
+                "read_many": self.read_many, "stat_many": self.stat_many,
+                "replace_across": self.replace_across, "find": self.find
+            }
+            
+            if command not in method_map:
+                raise ToolError(f"Command '{command}' is valid but not implemented")
+                
+            method = method_map[command]
+            
+            # Filter kwargs to only include parameters that the method accepts
+            sig = inspect.signature(method)
+            valid_params = set(sig.parameters.keys())
+            filtered_kwargs = {k: v for k, v in kwargs.items() if k in valid_params}
+            
+            return await method(**filtered_kwargs)
+        except ToolError as e:
+            return ToolResult(error=str(e))
+        except Exception as e:
+            return ToolResult(error=f"Unexpected error: {str(e)}")
+
+    async def read(
+        self,
+        path: str,
+        mode: str = "text",
+        encoding: str = "utf-8",
+        line_numbers: bool = True,
+        max_line_chars: int | None = None,
+        column_range: Optional[List[int]] = None,
+    ) -> ToolResult:
+        """Read the content of a file in text or binary mode.
+
+        In text mode, ``column_range`` and ``max_line_chars`` window long lines as in view.
+        """
+        full_path = await self._validate_path(path)
+        if not await aiofiles.os.path.isfile(str(full_path)):
+            raise ToolError("Path is not a file")
+        _check_window(column_range, max_line_chars)
+        try:
+            if mode == "text" and (column_range is not None or max_line_chars is not None):
+                async with aiofiles.open(str(full_path), 'rb') as f:
+                    data = await f.read()
+                if codecs.lookup(encoding).name == "utf-8":
+                    lines = [_window_utf8(line, column_range, max_line_chars) for line in _split_utf8_lines(data)]
+                else:
+                    lines = [_window_text(line, column_range, max_line_chars) for line in data.decode(encoding).splitlines()]
+                if line_numbers:
+                    return ToolResult(output="\n".join(f"{str(i + 1).rjust(6)}\t{line}" for i, line in enumerate(lines)))
+                return ToolResult(output="\n".join(lines))
+            if mode == "text":
+                async with aiofiles.open(str(full_path), 'r', encoding=encoding) as f:
+                    content = await f.read()
+                if line_numbers:
+                    numbered_content = "\n".join(
+                        f"{str(i + 1).rjust(6)}\t{line}" for i, line in enumerate(content.splitlines())
+                    )
+                    return ToolResult(output=numbered_content)
+                return ToolResult(output=content)
+            elif mode == "binary":
+                async with aiofiles.open(str(full_path), 'rb') as f:
+                    binary_content = await f.read()
+                content = base64.b64encode(binary_content).decode()
+                return ToolResult(output=content, system="binary")
+            else:
+                raise ToolError("Invalid mode: choose 'text' or 'binary'")
+        except Exception as e:
+            raise ToolError(f"Failed to read file: {str(e)}")
+
+    async def write(self, path: str, content: str, mode: str = "text", encoding: str = "utf-8") -> ToolResult:
+        """Write content to a file, overwriting if it exists."""
+        full_path = await self._validate_path(path)
+        try:
+            await self._ensure_base_path_exists()
+            await asyncio.to_thread(full_path.parent.mkdir, parents=True, exist_ok=True)
+            previous = None
+            if await aiofiles.os.path.isfile(str(full_path)) and (await aiofiles.os.stat(str(full_path))).st_size <= VERSION_MAX_FILE_SIZE:
+                async with aiofiles.open(str(full_path), 'r', encoding='utf-8', errors='replace', newline='') as f:
+                    previous = await f.read()
+            if mode == "text":
+                async with aiofiles.open(str(full_path), 'w', encoding=encoding) as f:
+                    await f.write(content)
+            elif mode == "binary":
+                decoded_content = base64.b64decode(content)
+                async with aiofiles.open(str(full_path), 'wb') as f:
+                    await f.write(decoded_content)
+            else:
+                raise ToolError("Invalid mode: choose 'text' or 'binary'")
+            self._notify("modify", full_path)
+            return await self._with_version(full_path, ToolResult(output=f"File written to {path}"), previous)
+        except Exception as e:
+            raise ToolError(f"Failed to write file: {str(e)}")
+
+    async def append(self, path: str, content: str, mode: str = "text", encoding: str = "utf-8") -> ToolResult:
+        """Append content to an existing file or create it if it doesn't exist."""
+        full_path = await self._validate_path(path)
+        try:
+            await self._ensure_base_path_exists()
+            if mode == "text":
+                async with aiofiles.open(str(full_path), 'a', encoding=encoding) as f:
+                    await f.write(content)
+            elif mode == "binary":
+                decoded_content = base64.b64decode(content)
+                async with aiofiles.open(str(full_path), 'ab') as f:
+                    await f.write(decoded_content)
+            else:
+                raise ToolError("Invalid mode: choose 'text' or 'binary'")
+            self._notify("modify", full_path)
+            return ToolResult(output=f"Appended to file {path}")
+        except Exception as e:
+            raise ToolError(f"Failed to append to file: {str(e)}")
+
+    async def append_channel(
+        self,
+        path: str,
+        flush_interval: float | None = None,
+        flush_bytes: int | None = None,
+        fsync: bool = False,
+    ) -> _AppendChannel:
+        """Return the append channel for a file, opening one with the given settings if there is none.
+
+        Everyone appending to the file through a channel shares it, so their appends are coalesced.
+        """
+        full_path = await self._validate_path(path)
+        if await aiofiles.os.path.isdir(str(full_path)):
+            raise ToolError("Path is a directory")
+        channel = self._append_channels.get(full_path)
+        if channel is not None:
+            return channel
+        if flush_interval is not None and not 0 <= flush_interval <= 10:
+            raise ToolError("flush_interval must be between 0 and 10 seconds")
+        if flush_bytes is not None and flush_bytes < 1:
+            raise ToolError("flush_bytes must be at least 1")
+        await self._ensure_base_path_exists()
+        if len(self._append_channels) >= APPEND_MAX_CHANNELS:
+            for idle_path in [p for p, c in self._append_channels.items() if c.idle]:
+                del self._append_channels[idle_path]
+        channel = _AppendChannel(
+            full_path,
+            APPEND_FLUSH_INTERVAL if flush_interval is None else flush_interval,
+            flush_bytes or APPEND_FLUSH_BYTES,
+            fsync,
+            on_flush=lambda: self._notify("modify", full_path),
+        )
+        self._append_channels[full_path] = channel
+        return channel
+
+    async def delete(self, path: str, recursive: bool = False) -> ToolResult:
+        """Delete a file or directory, optionally recursively."""
+        full_path = await self._validate_path(path)
+        try:
+            if await aiofiles.os.path.isfile(str(full_path)):
+                await aiofiles.os.remove(str(full_path))
+            elif await aiofiles.os.path.isdir(str(full_path)):
+                if recursive:
+                    await asyncio.to_thread(shutil.rmtree, str(full_path))
+                else:
+                    await aiofiles.os.rmdir(str(full_path))
+            else:
+                raise ToolError("Path does not exist")
+            try:
+                await asyncio.to_thread(self._journal.forget, str(full_path))  # Clear undo history
+            except sqlite3.Error:
+                pass
+            self._notify("delete", full_path)
+            return ToolResult(output=f"Deleted {path}")
+        except Exception as e:
+            raise ToolError(f"Failed to delete: {str(e)}")
+
+    async def exists(self, path: str) -> ToolResult:
+        """Check if a path exists."""
+        try:
+            full_path = await self._validate_path(path)
+            exists = await aiofiles.os.path.exists(str(full_path))
+            return ToolResult(output=str(exists))
+        except Exception as e:
+            return ToolResult(error=f"Failed to check existence: {str(e)}")
+
+    async def _batch(
+        self, items: List[Any], handle: Callable[[Any], Any]
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Run *handle* over *items* with bounded concurrency, collecting per-item errors; returns (results, failures)."""
+        if not items:
+            raise ToolError("paths must be a non-empty list")
+        if len(items) > BATCH_MAX_PATHS:
+            raise ToolError(f"Too many paths: at most {BATCH_MAX_PATHS} per request")
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def run(item: Any) -> Dict[str, Any]:
+            path = item if isinstance(item, str) else item.get("path")
+            async with semaphore:
+                try:
+                    return {"path": path, **await handle(item)}
+                except ToolError as e:
+                    return {"path": path, "error": str(e)}
+                except Exception as e:
+                    return {"path": path, "error": f"{type(e).__name__}: {str(e)}"}
+
+        results = await asyncio.gather(*(run(item) for item in items))
+        return results, sum(1 for result in results if "error" in result)
+
+    async def read_many(
+        self,
+        paths: List[str | Dict[str, Any]],
+        mode: str = "text",
+        encoding: str = "utf-8",
+        line_numbers: bool = True,
+    ) -> ToolResult:
+        """Read several files in parallel, returning a JSON list with one entry per path.
+
+        Each item is a path or ``{"path": ..., "view_range": [start, end]}``. Failures are
+        reported per path as ``{"path": ..., "error": ...}`` without failing the batch.
+        """
+        async def read(item: str | Dict[str, Any]) -> Dict[str, Any]:
+            path, view_range = (item, None) if isinstance(item, str) else (item.get("path"), item.get("view_range"))
+            if not isinstance(path, str):
+                raise ToolError("Each item needs a path")
+            full_path = await self._validate_path(path)
+            return await asyncio.to_thread(_read_entry, full_path, mode, encoding, line_numbers, view_range)
+
+        results, failures = await self._batch(paths, read)
+        system = f"{failures} of {len(results)} reads failed" if failures else None
+        return ToolResult(output=json.dumps(results, ensure_ascii=False), system=system)
+
+    async def stat_many(self, paths: List[str]) -> ToolResult:
+        """Stat several paths in parallel, returning a JSON list of existence, type, size, mtime and mode."""
+        async def stat_one(path: str) -> Dict[str, Any]:
+            if not isinstance(path, str):
+                raise ToolError("Each item must be a path")
+            return await asyncio.to_thread(_stat_entry, await self._validate_path(path))
+
+        results, failures = await self._batch(paths, stat_one)
+        system = f"{failures} of {len(results)} paths could not be checked" if failures else None
+        return ToolResult(output=json.dumps(results), system=system)
+
+    async def list_dir(
+        self,
+        path: str,
+        pattern: str | None = None,
+        details: bool = False,
+        sort: str = "name",
+        reverse: bool = False,
+        limit: int | None = None,
+        cursor: str | None = None,
+        git_ignore: bool = False,
+    ) -> ToolResult:
+        """List the contents of a directory.
+
+        ``pattern`` is a glob applied to entry names, ``details`` adds size and mtime, and
+        ``limit``/``cursor`` page through large directories in ``sort`` order. ``git_ignore``
+        hides entries excluded by .gitignore files.
+        """
+        full_path = await self._validate_path(path)
+        if sort not in LIST_SORT_KEYS:
+            raise ToolError(f"Invalid sort: choose one of {', '.join(LIST_SORT_KEYS)}")
+        if limit is not None and limit < 1:
+            raise ToolError("limit must be at least 1")
+        if not await aiofiles.os.path.isdir(str(full_path)):
+            raise ToolError("Path is not a directory")
+        try:
+            need_stat = details or sort in ("size", "mtime")
+            exclude = None
+            if git_ignore:
+                exclude = await asyncio.to_thread(self._path_matcher.entry_filter, full_path, git_ignore=True)
+            entries = await asyncio.to_thread(_scan_dir, full_path, pattern, need_stat, exclude)
+            page, next_cursor = await asyncio.to_thread(_page_entries, entries, sort, reverse, limit, cursor)
+            output = "\n".join(_format_entry(entry, details) for entry in page)
+            if next_cursor:
+                return ToolResult(
+                    output=output,
+                    system=f"Showing {len(page)} entries; more are available with cursor={next_cursor}",
+                )
+            return ToolResult(output=output)
+        except ToolError:
+            raise
+        except Exception as e:
+            raise ToolError(f"Failed to list directory: {str(e)}")
+
+    async def mkdir(self, path: str) -> ToolResult:
+        """Create a directory, including parent directories if needed."""
+        full_path = await self._validate_path(path)
+        try:
+            await self._ensure_base_path_exists()
+            await asyncio.to_thread(full_path.mkdir, parents=True, exist_ok=True)
+            self._notify("create", full_path)
+            return ToolResult(output=f"Directory created: {path}")
+        except Exception as e:
+            raise ToolError(f"Failed to create directory: {str(e)}")
+
+    async def rmdir(self, path: str) -> ToolResult:
+        """Remove an empty directory."""
+        full_path = await self._validate_path(path)
+        try:
+            await self._ensure_base_path_exists()
+            await aiofiles.os.rmdir(str(full_path))
+            self._notify("delete", full_path)
+            return ToolResult(output=f"Directory removed: {path}")
+        except Exception as e:
+            raise ToolError(f"Failed to remove directory: {str(e)}")
+
+    async def move(self, src: str, dst: str) -> ToolResult:
+        """Move or rename a file or directory, copying and removing it when crossing filesystems."""
+        src_path = await self._validate_path(src)
+        dst_path = await self._validate_path(dst)
+        try:
+            await self._ensure_base_path_exists()
+            await asyncio.to_thread(dst_path.parent.mkdir, parents=True, exist_ok=True)
+            system = None
+            try:
+                await asyncio.to_thread(src_path.rename, dst_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                progress = await self._run_copy("move", src_path, dst_path)
+                if await aiofiles.os.path.isdir(str(src_path)) and not await aiofiles.os.path.islink(str(src_path)):
+                    await asyncio.to_thread(shutil.rmtree, src_path)
+                else:
+                    await aiofiles.os.remove(str(src_path))
+                system = _format_copy_summary(progress)
+            try:
+                await asyncio.to_thread(self._journal.rename, str(src_path), str(dst_path))
+            except sqlite3.Error:
+                pass
+            self._notify("move", src_path, dst_path)
+            return ToolResult(output=f"Moved {src} to {dst}", system=system)
+        except Exception as e:
+            raise ToolError(f"Failed to move: {str(e)}")
+
+    async def copy(self, src: str, dst: str) -> ToolResult:
+        """Copy a file or directory, using reflinks or in-kernel copies where the filesystem allows.
+
+        Progress of long copies is visible through ``operations()``.
+        """
+        src_path = await self._validate_path(src)
+        dst_path = await self._validate_path(dst)
+        try:
+            await self._ensure_base_path_exists()
+            await asyncio.to_thread(dst_path.parent.mkdir, parents=True, exist_ok=True)
+            if await aiofiles.os.path.isfile(str(src_path)):
+                if await aiofiles.os.path.isdir(str(dst_path)):
+                    dst_path = dst_path / src_path.name
+            elif not await aiofiles.os.path.isdir(str(src_path)):
+                raise ToolError("Source path does not exist")
+            progress = await self._run_copy("copy", src_path, dst_path)
+            self._notify("create", dst_path)
+            return ToolResult(output=f"Copied {src} to {dst}", system=_format_copy_summary(progress))
+        except Exception as e:
+            raise ToolError(f"Failed to copy: {str(e)}")
+
+    async def archive(
+        self, path: str, fmt: str | None = None, git_ignore: bool = False
+    ) -> Tuple[AsyncIterator[bytes], str, str]:
+        """Stream a file or directory as an archive built on the fly, skipping excluded paths.
+
+        Returns the byte stream, a download file name and the media type. Directory members are
+        named relative to the directory itself.
+        """
+        full_path = await self._validate_path(path)
+        fmt = _archive_format(fmt)
+        if self._path_matcher.is_excluded(full_path):
+            raise ToolError("Path is excluded from archiving")
+        if await aiofiles.os.path.isdir(str(full_path)):
+            root = full_path
+            files = self._path_matcher.walk(full_path, served=True, git_ignore=git_ignore)
+        elif await aiofiles.os.path.isfile(str(full_path)):
+            root = full_path.parent
+            files = iter([str(full_path)])
+        else:
+            raise ToolError("Path does not exist")
+
+        writer = _QueueWriter()
+
+        def produce():
+            try:
+                _write_archive(writer, fmt, root, files)
+                writer.finish()
+            except _ArchiveCancelled:
+                pass
+            except Exception as e:
+                try:
+                    writer.put(e)
+                except _ArchiveCancelled:
+                    pass
+
+        async def stream() -> AsyncIterator[bytes]:
+            producer = asyncio.get_running_loop().run_in_executor(None, produce)
+            try:
+                while True:
+                    item = await asyncio.to_thread(writer.get)
+                    if item is _ARCHIVE_END:
+                        break
+                    if isinstance(item, Exception):
+                        # Headers are already sent; dropping the connection tells the client it's truncated
+                        raise item
+                    yield item
+            finally:
+                writer.cancelled.set()
+                await producer
+
+        name = full_path.name if full_path != self.base_path else "workspace"
+        return stream(), f"{name}.{fmt}", ARCHIVE_FORMATS[fmt]
+
+    async def extract(self, path: str, chunks: AsyncIterator[bytes], fmt: str | None = None) -> ToolResult:
+        """Extract an archive arriving as *chunks* into the directory *path* while it is received."""
+        full_path = await self._validate_path(path)
+        fmt = _archive_format(fmt)
+        if self._path_matcher.is_excluded(full_path):
+            raise ToolError("Path is excluded from extraction")
+        if await aiofiles.os.path.exists(str(full_path)) and not await aiofiles.os.path.isdir(str(full_path)):
+            raise ToolError("Path is not a directory")
+        await asyncio.to_thread(full_path.mkdir, parents=True, exist_ok=True)
+
+        loop = asyncio.get_running_loop()
+        reader = _QueueReader(loop)
+        extraction = loop.run_in_executor(
+            None, _extract_archive, reader, fmt, full_path, self._path_matcher.is_excluded
+        )
+        finished = False
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                put = asyncio.ensure_future(reader.queue.put(chunk))
+                await asyncio.wait({put, extraction}, return_when=asyncio.FIRST_COMPLETED)
+                if not put.done():
+                    put.cancel()  # Extraction stopped early, most likely on a corrupt archive
+                    break
+            else:
+                await reader.queue.put(_ARCHIVE_END)
+            finished = True
+        finally:
+            if not finished and not extraction.done():
+                while not reader.queue.empty():
+                    reader.queue.get_nowait()
+                reader.queue.put_nowait(_ARCHIVE_ABORT)
+        try:
+            extracted, skipped = await extraction
+        except ToolError:
+            raise
+        except _ARCHIVE_ERRORS as e:
+            raise ToolError(f"Failed to extract archive: {str(e)}")
+
+        for top_level in sorted({Path(name).parts[0] for name in extracted if Path(name).parts}):
+            self._notify("create", full_path / top_level)
+        system = f"Skipped {len(skipped)} excluded or unsafe members: {', '.join(skipped[:20])}" if skipped else None
+        return ToolResult(output=f"Extracted {len(extracted)} entries into {path}", system=system)
+
+    async def view(
+        self,
+        path: str,
+        view_range: Optional[List[int]] = None,
+        line_numbers: bool = True,
+        version: str | None = None,
+        max_line_chars: int | None = None,
+        column_range: Optional[List[int]] = None,
+    ) -> ToolResult:
+        """View a file or list a directory.
+
+        Every file view carries the file's version token. Given the ``version`` of an earlier view or
+        edit and no view_range, only the hunks changed since then are returned, or "unchanged"; the
+        whole file is shown when that version is no longer held to diff against.
+
+        ``column_range`` shows only columns [start, end] of each line and ``max_line_chars`` caps
+        how much of a line is shown; cut-off text is replaced by a marker counting its characters.
+        """
+        full_path = await self._validate_path(path)
+        if await aiofiles.os.path.isdir(str(full_path)):
+            if view_range:
+                raise ToolError("view_range not applicable for directories")
+            # List directory contents in a single scandir pass
+            try:
+                entries = await asyncio.to_thread(_scan_dir, full_path)
+                entries.sort(key=lambda e: e.name)
+                contents = [f"  {_format_entry(entry, False)}" for entry in entries]
+                output = f"Directory contents of {path}:\n" + "\n".join(contents)
+                return ToolResult(output=output)
+            except Exception as e:
+                raise ToolError(f"Failed to list directory: {str(e)}")
+        
+        _check_window(column_range, max_line_chars)
+        windowed = column_range is not None or max_line_chars is not None
+        try:
+            async with aiofiles.open(str(full_path), 'rb') as f:
+                data = await f.read()
+            token = _content_version(data)
+            # A windowed view cuts lines from the raw bytes, so with no version to diff against the
+            # whole file is never decoded (nor kept for later deltas)
+            content = None if windowed and version is None else data.decode('utf-8', errors='replace')
+            system = None
+            if content is not None and len(data) <= VERSION_MAX_FILE_SIZE:
+                versioned_lines = content.splitlines(keepends=True)
+                self._versions.add(token, versioned_lines, len(data))
+                if version is not None and not view_range:
+                    if version == token:
+                        return ToolResult(output="unchanged", version=token)
+                    old = self._versions.get(version)
+                    regions = await asyncio.to_thread(_myers_diff, old, versioned_lines) if old is not None else None
+                    if regions is not None:
+                        render = (lambda line: _window_text(line, column_range, max_line_chars)) if windowed else (lambda line: line)
+                        return ToolResult(output=_format_delta(old, versioned_lines, regions, render=render), version=token)
+                    system = f"No delta available since version {version}; showing the whole file"
+            elif version == token and not view_range:
+                return ToolResult(output="unchanged", version=token)
+
+            if not (view_range or line_numbers or windowed):
+                return ToolResult(output=content.replace("\r\n", "\n").replace("\r", "\n"), system=system, version=token)
+
+            # Long lines are cut down from the raw bytes, so only the shown part of each is decoded
+            lines = _split_utf8_lines(data) if windowed else content.splitlines()
+            start_num = 1
+            if view_range:
+                start_num, end = _resolve_view_range(view_range, len(lines))
+                lines = lines[start_num - 1 : end]
+            if windowed:
+                lines = [_window_utf8(line, column_range, max_line_chars) for line in lines]
+
+            if line_numbers:
+                numbered_content = "\n".join(f"{str(start_num + i).rjust(6)}\t{line}" for i, line in enumerate(lines))
+                return ToolResult(output=numbered_content, system=system, version=token)
+
+            return ToolResult(output="\n".join(lines), system=system, version=token)
+        except Exception as e:
+            raise ToolError(f"Failed to view file: {str(e)}")
+
+    async def create(self, path: str, content: str, mode: str = "text", encoding: str = "utf-8") -> ToolResult:
+        """Create a new file with the given content, failing if it already exists."""
+        full_path = await self._validate_path(path)
+        if await aiofiles.os.path.exists(str(full_path)):
+            raise ToolError("File already exists")
         try:
             await self._ensure_base_path_exists()
             await asyncio.to_thread(full_path.parent.mkdir, parents=True, exist_ok=True)
@@ -1026,7 +5824,8 @@ class FileTool(BaseAnthropicTool):
                     await f.write(decoded_content)
             else:
                 raise ToolError("Invalid mode: choose 'text' or 'binary'")
-            return ToolResult(output=f"File created: {path}")
+            self._notify("create", full_path)
+            return await self._with_version(full_path, ToolResult(output=f"File created: {path}"))
         except Exception as e:
             raise ToolError(f"Failed to create file: {str(e)}")
 
@@ -1047,94 +5846,242 @@ class FileTool(BaseAnthropicTool):
                     if content.count(old_str) > 1:
                         raise ToolError("Multiple occurrences found; set all_occurrences=True to replace all")
                     new_content = content.replace(old_str, new_str, 1)
-            # CASE 2 – literal differs only by line-ending or trailing-space -> replace on normalised text then restore original line endings
+            # CASE 2 – literal differs only by line endings -> match any EOL in one pass, writing new text with the file's EOL
             else:
-                # Compare using normalised versions so CRLF/LF or trailing spaces do not cause false negatives.
-                cmp_content = content.replace("\r\n", "\n")
-                cmp_old = old_str.replace("\r\n", "\n")
-                if cmp_old not in cmp_content:
+                eol_pattern = re.compile(r"\r?\n".join(re.escape(part) for part in re.split(r"\r?\n", old_str)))
+                first_two = list(itertools.islice(eol_pattern.finditer(content), 2))
+                if not first_two:
                     raise ToolError(f"'{old_str}' not found")
+                if len(first_two) > 1 and not all_occurrences:
+                    raise ToolError("Multiple occurrences found; set all_occurrences=True to replace all")
 
-                norm_new = new_str.replace("\r\n", "\n")
-                if all_occurrences:
-                    norm_new_content = cmp_content.replace(cmp_old, norm_new)
-                else:
-                    if cmp_content.count(cmp_old) > 1:
-                        raise ToolError("Multiple occurrences found; set all_occurrences=True to replace all")
-                    norm_new_content = cmp_content.replace(cmp_old, norm_new, 1)
-
-                # Convert the normalised content back to the original EOL style
-                if "\r\n" in content:
-                    new_content = norm_new_content.replace("\n", "\r\n")
-                else:
-                    new_content = norm_new_content
+                eol = "\r\n" if "\r\n" in content else "\n"
+                replacement = new_str.replace("\r\n", "\n").replace("\n", eol)
+                new_content = eol_pattern.sub(lambda m: replacement, content, count=0 if all_occurrences else 1)
 
-            self._file_history[full_path].append(content)
-            if len(self._file_history[full_path]) > 2:
-                self._file_history[full_path].pop(0)
             async with aiofiles.open(str(full_path), 'w', encoding='utf-8', errors='replace') as f:
                 await f.write(new_content)
-            return ToolResult(output=f"Replaced \"{_shorten(old_str)}\" with \"{_shorten(new_str)}\"")
+            await self._remember(full_path, content)
+            self._notify("modify", full_path)
+            result = ToolResult(output=f"Replaced \"{_shorten(old_str)}\" with \"{_shorten(new_str)}\"")
+            return await self._with_version(full_path, result, content)
         except Exception as e:
             raise ToolError(f"Failed to replace string: {str(e)}")
 
+    async def replace_across(
+        self,
+        pattern: str,
+        replacement: str,
+        path: str = ".",
+        glob: str | None = None,
+        literal: bool = False,
+        case_sensitive: bool = True,
+        dry_run: bool = False,
+        git_ignore: bool = True,
+    ) -> ToolResult:
+        """Replace a regex (or literal) in every matching file under *path*.
+
+        ``replacement`` is a re.sub template (\\1, \\g<name>) unless ``literal`` is set. ``glob``
+        limits the files by name, or by path relative to *path* when it contains a "/".
+        ``dry_run`` previews the changed lines instead of writing. Each file is rewritten
+        atomically and gets an undo entry.
+        """
+        full_path = await self._validate_path(path)
+        flags = 0 if case_sensitive else re.IGNORECASE
+        regex_pattern = re.escape(pattern) if literal else pattern
+        try:
+            re.compile(regex_pattern, flags | re.MULTILINE)
+        except re.error as e:
+            raise ToolError(f"Invalid pattern: {str(e)}")
+
+        try:
+            if await aiofiles.os.path.isfile(str(full_path)):
+                paths = [str(full_path)]
+                root = full_path.parent
+            elif await aiofiles.os.path.isdir(str(full_path)):
+                root = full_path
+                if self._search_index is not None:
+                    paths = await self._search_index.candidates(pattern, flags, literal, full_path)
+                    if git_ignore:
+                        paths = await asyncio.to_thread(self._path_matcher.filter_files, paths)
+                elif git_ignore:
+                    paths = await asyncio.to_thread(list, self._path_matcher.walk(full_path))
+                else:
+                    paths = await asyncio.to_thread(list, _iter_files(full_path))
+            else:
+                raise ToolError("Path does not exist")
+        except (OSError, sqlite3.Error) as e:
+            raise ToolError(f"Failed to find files: {str(e)}")
+        if glob:
+            def selected(p: str) -> bool:
+                return fnmatch.fnmatchcase(os.path.relpath(p, root) if "/" in glob else os.path.basename(p), glob)
+
+            paths = [p for p in paths if selected(p)]
+
+        loop = asyncio.get_running_loop()
+        batches = [paths[i:i + GREP_BATCH_SIZE] for i in range(0, len(paths), GREP_BATCH_SIZE)]
+        try:
+            if len(batches) <= 1:
+                batch_results = [await asyncio.to_thread(
+                    _replace_batch, paths, regex_pattern, flags | re.MULTILINE, replacement, literal, not dry_run
+                )]
+            else:
+                pool = _get_grep_pool()
+                batch_results = await asyncio.gather(*(
+                    loop.run_in_executor(
+                        pool, _replace_batch, batch, regex_pattern, flags | re.MULTILINE, replacement, literal, not dry_run
+                    )
+                    for batch in batches
+                ))
+        except re.error as e:
+            raise ToolError(f"Invalid replacement: {str(e)}")
+
+        results = sorted((r for batch in batch_results for r in batch), key=lambda r: r["path"])
+        lines = []
+        files = replacements = failures = 0
+        for result in results:
+            rel = str(Path(result["path"]).relative_to(self.base_path))
+            if "error" in result:
+                failures += 1
+                lines.append(f"{rel}: error: {result['error']}")
+                continue
+            files += 1
+            replacements += result["count"]
+            if dry_run:
+                lines.extend(_format_hunk(rel, hunk) for hunk in result["hunks"])
+                if result["truncated"]:
+                    lines.append(f"{rel}: ... {result['count']} replacements in total")
+            else:
+                full = Path(result["path"])
+                await self._remember(full, result["original"])
+                self._notify("modify", full)
+                lines.append(f"{rel}: {result['count']} replacements")
+
+        verb = "Would replace" if dry_run else "Replaced"
+        system = f"{verb} {replacements} matches in {files} files"
+        if failures:
+            system += f"; {failures} files failed"
+        return ToolResult(output="\n".join(lines) if lines else "No matches found", system=system)
+
     async def insert(self, path: str, line: int, text: str) -> ToolResult:
-        """Insert text at a specific line in a file."""
+        """Insert text at a specific line in a file.
+
+        The file is streamed through a temporary file, so memory use doesn't grow with its size and
+        its line endings are kept byte for byte.
+        """
         full_path = await self._validate_path(path)
         if not await aiofiles.os.path.isfile(str(full_path)):
             raise ToolError("Path is not a file")
         try:
-            async with aiofiles.open(str(full_path), 'r', encoding='utf-8', errors='replace') as f:
-                content = await f.read()
-            lines = content.splitlines()
-            if line < 1 or line > len(lines) + 1:
-                raise ToolError(f"Line number {line} is out of range")
-            lines.insert(line - 1, text)
-            new_content = "\n".join(lines)
-            self._file_history[full_path].append(content)
-            if len(self._file_history[full_path]) > 2:
-                self._file_history[full_path].pop(0)
-            async with aiofiles.open(str(full_path), 'w', encoding='utf-8', errors='replace') as f:
-                await f.write(new_content)
-            return ToolResult(output=f"Inserted \"{_shorten(text)}\" at line {line}")
+            backup = await asyncio.to_thread(_stream_insert, str(full_path), line, text)
+            await self._remember(full_path, backup)
+            self._notify("modify", full_path)
+            return await self._with_version(full_path, ToolResult(output=f"Inserted \"{_shorten(text)}\" at line {line}"), backup)
         except Exception as e:
             raise ToolError(f"Failed to insert text: {str(e)}")
 
     async def delete_lines(self, path: str, lines: List[int]) -> ToolResult:
-        """Delete specified lines from a file."""
+        """Delete specified lines from a file, streaming it like insert."""
         full_path = await self._validate_path(path)
         if not await aiofiles.os.path.isfile(str(full_path)):
             raise ToolError("Path is not a file")
         try:
-            async with aiofiles.open(str(full_path), 'r', encoding='utf-8', errors='replace') as f:
-                content = await f.read()
-            file_lines = content.splitlines()
-            lines_to_delete = set(lines)
-            new_lines = [line for i, line in enumerate(file_lines, 1) if i not in lines_to_delete]
-            new_content = "\n".join(new_lines)
-            self._file_history[full_path].append(content)
-            if len(self._file_history[full_path]) > 2:
-                self._file_history[full_path].pop(0)
-            async with aiofiles.open(str(full_path), 'w', encoding='utf-8', errors='replace') as f:
-                await f.write(new_content)
-            return ToolResult(output=f"Deleted lines {lines}")
+            backup = await asyncio.to_thread(_stream_delete_lines, str(full_path), lines)
+            if backup is not None:
+                await self._remember(full_path, backup)
+                self._notify("modify", full_path)
+            return await self._with_version(full_path, ToolResult(output=f"Deleted lines {lines}"), backup)
         except Exception as e:
             raise ToolError(f"Failed to delete lines: {str(e)}")
 
     async def undo(self, path: str) -> ToolResult:
-        """Undo the last text editing operation on a file."""
+        """Undo the last text editing operation on a file, whichever worker made it."""
+        return await self._step(path, redo=False)
+
+    async def redo(self, path: str) -> ToolResult:
+        """Redo the last undone edit on a file, unless it has been edited since."""
+        return await self._step(path, redo=True)
+
+    async def _step(self, path: str, redo: bool) -> ToolResult:
+        action = "redo" if redo else "undo"
         full_path = await self._validate_path(path)
         if not await aiofiles.os.path.isfile(str(full_path)):
             raise ToolError("File does not exist")
-        if not self._file_history.get(full_path):
-            raise ToolError("No undo history available")
         try:
-            previous_content = self._file_history[full_path].pop()
-            async with aiofiles.open(str(full_path), 'w', encoding='utf-8', errors='replace') as f:
-                await f.write(previous_content)
-            return ToolResult(output=f"Undid last edit on {path}")
+            current = None
+            if (await aiofiles.os.stat(str(full_path))).st_size <= VERSION_MAX_FILE_SIZE:
+                async with aiofiles.open(str(full_path), 'r', encoding='utf-8', errors='replace', newline='') as f:
+                    current = await f.read()
+            stepped = await asyncio.to_thread(self._journal.step, str(full_path), redo)
         except Exception as e:
-            raise ToolError(f"Failed to undo edit: {str(e)}")
+            raise ToolError(f"Failed to {action} edit: {str(e)}")
+        if not stepped:
+            raise ToolError(f"No {action} history available")
+        self._notify("modify", full_path)
+        output = f"Redid last undone edit on {path}" if redo else f"Undid last edit on {path}"
+        return await self._with_version(full_path, ToolResult(output=output), current)
+
+    def _format_matches(self, results: List[GrepLine], line_numbers: bool) -> str:
+        lines = []
+        for file_path, line_no, line, is_match in results:
+            # grep convention: ':' separates match lines, '-' separates context lines
+            sep = ":" if is_match else "-"
+            rel = Path(file_path).relative_to(self.base_path)
+            lines.append(f"{rel}{sep}{line_no}{sep}{line}" if line_numbers else f"{rel}{sep}{line}")
+        return "\n".join(lines)
+
+    async def _collect_matches(
+        self,
+        stream: AsyncIterator[GrepLine],
+        line_numbers: bool,
+        max_results: int | None,
+        offset: int,
+        cursor: str | None,
+        before_context: int,
+        after_context: int,
+    ) -> ToolResult:
+        pager = _GrepPager(self.base_path, max_results, offset, cursor, before_context, after_context)
+        results = [item async for item in pager(stream)]
+        if not results:
+            return ToolResult(output="No matches found")
+        output = self._format_matches(results, line_numbers)
+        if pager.next_cursor:
+            return ToolResult(
+                output=output,
+                system=f"Showing {pager.matches} matches; more results are available with cursor={pager.next_cursor}",
+            )
+        return ToolResult(output=output)
+
+    async def grep_lines(
+        self,
+        pattern: str,
+        path: str,
+        case_sensitive: bool = True,
+        recursive: bool = False,
+        before_context: int = 0,
+        after_context: int = 0,
+        max_count: int | None = None,
+        git_ignore: bool = True,
+    ) -> AsyncIterator[GrepLine]:
+        """Validate a grep request and return an ordered stream of matching and context lines.
+
+        Directory searches skip .gitignore'd files unless ``git_ignore`` is False.
+        """
+        full_path = await self._validate_path(path)
+        try:
+            re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+        except re.error as e:
+            raise ToolError(f"Invalid pattern: {str(e)}")
+        if before_context < 0 or after_context < 0:
+            raise ToolError("Context line counts must not be negative")
+
+        if await aiofiles.os.path.isdir(str(full_path)):
+            if not recursive:
+                raise ToolError("Recursive search must be enabled for directories")
+        elif not await aiofiles.os.path.isfile(str(full_path)):
+            raise ToolError("Path does not exist")
+        matcher = self._path_matcher if git_ignore else None
+        return _grep_stream(pattern, full_path, case_sensitive, max_count or 0, before_context, after_context, matcher)
 
     async def grep(
         self,
@@ -1142,59 +6089,188 @@ class FileTool(BaseAnthropicTool):
         path: str,
         case_sensitive: bool = True,
         recursive: bool = False,
-        line_numbers: bool = True
+        line_numbers: bool = True,
+        before_context: int = 0,
+        after_context: int = 0,
+        max_count: int | None = None,
+        max_results: int | None = None,
+        offset: int = 0,
+        cursor: str | None = None,
+        git_ignore: bool = True,
+    ) -> ToolResult:
+        """Search for a pattern in a file or directory.
+
+        ``max_count`` caps matches per file; ``max_results``, ``offset`` and ``cursor`` page through
+        the overall matches. Scanning stops as soon as the page is full.
+        """
+        stream = await self.grep_lines(
+            pattern, path, case_sensitive, recursive, before_context, after_context, max_count, git_ignore
+        )
+        return await self._collect_matches(
+            stream, line_numbers, max_results, offset, cursor, before_context, after_context
+        )
+
+    async def search(
+        self,
+        pattern: str,
+        path: str = ".",
+        case_sensitive: bool = True,
+        literal: bool = False,
+        line_numbers: bool = True,
+        before_context: int = 0,
+        after_context: int = 0,
+        max_count: int | None = None,
+        max_results: int | None = None,
+        offset: int = 0,
+        cursor: str | None = None,
+        git_ignore: bool = True,
     ) -> ToolResult:
-        """Search for a pattern in a file or directory."""
+        """Search workspace text files, using the trigram index to narrow the files that are scanned."""
         full_path = await self._validate_path(path)
+        if not await aiofiles.os.path.isdir(str(full_path)):
+            raise ToolError("Path is not a directory")
         flags = 0 if case_sensitive else re.IGNORECASE
-        results = []
+        regex_pattern = re.escape(pattern) if literal else pattern
+        try:
+            re.compile(regex_pattern, flags)
+        except re.error as e:
+            raise ToolError(f"Invalid pattern: {str(e)}")
 
-        async def search_file(file_path):
-            try:
-                # Skip if not a regular file (sockets, pipes, etc.)
-                is_file = await aiofiles.os.path.isfile(str(file_path))
-                is_symlink = await asyncio.to_thread(file_path.is_symlink)
-                if is_symlink:
-                    resolved = await asyncio.to_thread(file_path.resolve)
-                    is_resolved_file = await aiofiles.os.path.isfile(str(resolved))
-                    if not is_resolved_file:
-                        return
-                elif not is_file:
-                    return
-                
-                async with aiofiles.open(str(file_path), 'r', encoding='utf-8') as f:
-                    i = 0
-                    async for line in f:
-                        i += 1
-                        if re.search(pattern, line, flags):
-                            results.append({
-                                'file': str(file_path.relative_to(self.base_path)),
-                                'line_number': i if line_numbers else None,
-                                'content': line.strip()
-                            })
-            except (UnicodeDecodeError, IOError, OSError):
-                # Skip binary files and files that can't be read
-                pass
+        try:
+            matcher = self._path_matcher if git_ignore else None
+            if self._search_index is None:
+                stream = _grep_stream(
+                    regex_pattern, full_path, case_sensitive, max_count or 0, before_context, after_context, matcher
+                )
+            else:
+                paths = await self._search_index.candidates(pattern, flags, literal, full_path)
+                if matcher is not None:
+                    paths = await asyncio.to_thread(matcher.filter_files, paths)
+                stream = _grep_paths(paths, regex_pattern, flags, max_count or 0, before_context, after_context)
+        except (OSError, sqlite3.Error) as e:
+            raise ToolError(f"Failed to search: {str(e)}")
+
+        return await self._collect_matches(
+            stream, line_numbers, max_results, offset, cursor, before_context, after_context
+        )
 
-        if await aiofiles.os.path.isfile(str(full_path)):
-            await search_file(full_path)
-        elif await aiofiles.os.path.isdir(str(full_path)):
-            if not recursive:
-                raise ToolError("Recursive search must be enabled for directories")
-            # Use asyncio.to_thread for os.walk since there's no native async version
-            for root, _, files in await asyncio.to_thread(os.walk, str(full_path)):
-                for file in files:
-                    await search_file(Path(root) / file)
+    async def find_entries(
+        self,
+        path: str = ".",
+        pattern: str | None = None,
+        type: str | None = None,
+        min_size: int | str | None = None,
+        max_size: int | str | None = None,
+        newer_than: float | str | None = None,
+        older_than: float | str | None = None,
+        max_depth: int | None = None,
+        git_ignore: bool = False,
+        details: bool = False,
+    ) -> AsyncIterator[_DirEntry]:
+        """Validate a find request and return a stream of matching entries, named relative to the workspace.
+
+        Answers from the cached workspace tree when there is one, otherwise walks the directory
+        with parallel scandir calls. Items the server doesn't serve are never reported.
+        """
+        full_path = await self._validate_path(path)
+        if not await aiofiles.os.path.isdir(str(full_path)):
+            raise ToolError("Path is not a directory")
+        if type is not None and type not in FIND_TYPES:
+            raise ToolError(f"Invalid type: choose one of {', '.join(FIND_TYPES)}")
+        if max_depth is not None and max_depth < 0:
+            raise ToolError("max_depth must not be negative")
+        rel_start = self._path_matcher.relative(full_path)
+        if rel_start is None:
+            raise ToolError("Path is outside the workspace")
+        now = time.time()
+        criteria = _FindCriteria(
+            rel_start,
+            pattern,
+            FIND_TYPES.get(type),
+            _parse_size(min_size),
+            _parse_size(max_size),
+            _parse_time(newer_than, now),
+            _parse_time(older_than, now),
+            max_depth,
+            details,
+        )
+        return self._find_stream(full_path, criteria, git_ignore)
+
+    async def _find_stream(self, full_path: Path, criteria: _FindCriteria, git_ignore: bool) -> AsyncIterator[_DirEntry]:
+        if criteria.max_depth == 0:
+            return
+        candidates = None
+        if self._tree is not None:
+            await self._tree.ensure_built(git_ignore)
+            candidates = await asyncio.to_thread(self._tree.entries, criteria.base, criteria.max_depth, git_ignore)
+        if candidates is None:
+            source = _walk_parallel(full_path, criteria.base, self._path_matcher, git_ignore, criteria.max_depth)
         else:
-            raise ToolError("Path does not exist")
+            source = _aiter(candidates)
 
-        if not results:
-            return ToolResult(output="No matches found")
+        batch: List[Tuple[str, bool]] = []
+        try:
+            async for rel, is_dir in source:
+                if not criteria.selects(rel, is_dir):
+                    continue
+                if not criteria.needs_stat:
+                    yield _DirEntry(rel, is_dir)
+                    continue
+                batch.append((rel, is_dir))
+                if len(batch) >= FIND_STAT_BATCH:
+                    for entry in await asyncio.to_thread(_stat_found, self._path_matcher.root, batch, criteria):
+                        yield entry
+                    batch = []
+        finally:
+            await source.aclose()
+        if batch:
+            for entry in await asyncio.to_thread(_stat_found, self._path_matcher.root, batch, criteria):
+                yield entry
 
-        output = "\n".join([
-            f"{r['file']}:{r['line_number']}:{r['content']}" if r['line_number'] else f"{r['file']}:{r['content']}"
-            for r in results
-        ])
+    async def find(
+        self,
+        path: str = ".",
+        pattern: str | None = None,
+        type: str | None = None,
+        min_size: int | str | None = None,
+        max_size: int | str | None = None,
+        newer_than: float | str | None = None,
+        older_than: float | str | None = None,
+        max_depth: int | None = None,
+        limit: int | None = None,
+        details: bool = False,
+        git_ignore: bool = False,
+    ) -> ToolResult:
+        """Find files and directories under *path*.
+
+        ``pattern`` is a glob on names, or on paths below *path* when it contains "/"; ``type`` is
+        "f" or "d". Sizes take suffixes such as "10k" or "5M"; ``newer_than``/``older_than`` take
+        a timestamp, an ISO date or an age such as "2h". The search stops after ``limit`` entries.
+        """
+        if limit is not None and limit < 1:
+            raise ToolError("limit must be at least 1")
+        limit = FIND_DEFAULT_LIMIT if limit is None else limit
+        stream = await self.find_entries(
+            path, pattern, type, min_size, max_size, newer_than, older_than, max_depth, git_ignore, details
+        )
+        found: List[_DirEntry] = []
+        truncated = False
+        try:
+            async for entry in stream:
+                if len(found) >= limit:
+                    truncated = True
+                    break
+                found.append(entry)
+        except OSError as e:
+            raise ToolError(f"Failed to find files: {str(e)}")
+        finally:
+            await stream.aclose()
+        if not found:
+            return ToolResult(output="No matches found")
+        found.sort(key=lambda entry: entry.name)
+        output = "\n".join(_format_entry(entry, details) for entry in found)
+        if truncated:
+            return ToolResult(output=output, system=f"Showing the first {limit} entries found; more match")
         return ToolResult(output=output)
 
 
@@ -1221,11 +6297,26 @@ if not WORKSPACE_DIR.exists():
     WORKSPACE_DIR = Path.cwd()
 
 # Initialize tools
+workspace_watcher = _InotifyWatcher(WORKSPACE_DIR, skip_dirs={".git", ".gitscout"})
+search_index = _TrigramIndex(WORKSPACE_DIR, CACHE_DIR / "trigram.db", watcher=workspace_watcher)
+workspace_paths = _PathMatcher(WORKSPACE_DIR)
+workspace_tree = _WorkspaceTree(WORKSPACE_DIR, watcher=workspace_watcher, matcher=workspace_paths)
+fs_events = _FsEventHub(WORKSPACE_DIR, watcher=workspace_watcher)
+fuzzy_index = _FuzzyIndex(workspace_tree)
+edit_journal = _EditJournal(CACHE_DIR / "journal.db")
+snapshot_store = _SnapshotStore(WORKSPACE_DIR, SNAPSHOT_DIR, skip=[CACHE_DIR])
+disk_usage = _DiskUsage(WORKSPACE_DIR, watcher=workspace_watcher, unwatched={".git", ".gitscout"})
+workspace_git = _GitStatus(WORKSPACE_DIR, WORKSPACE_DIR / GIT_DIR_NAME, watcher=workspace_watcher)
 bash_tool = BashTool()
-file_tool = FileTool(base_path=WORKSPACE_DIR)
+file_tool = FileTool(base_path=WORKSPACE_DIR, search_index=search_index, path_matcher=workspace_paths, tree=workspace_tree, journal=edit_journal)
+file_tool.add_listener(workspace_tree.on_change)
+file_tool.add_listener(fs_events.on_change)
+file_tool.add_listener(disk_usage.on_change)
+file_tool.add_listener(workspace_git.on_change)
+content_hashes = _ContentHashCache()
 
 # Mount static file server
-app.mount("/static", StaticFiles(directory=str(WORKSPACE_DIR), html=True), name="static")
+app.mount("/static", _CachingStaticFiles(directory=str(WORKSPACE_DIR), html=True, matcher=workspace_paths), name="static")
 
 
 # Request/Response models
@@ -1257,6 +6348,63 @@ class FileRequest(BaseModel):
     lines: Optional[List[int]] = None
     pattern: Optional[str] = None
     case_sensitive: Optional[bool] = True
+    literal: Optional[bool] = False
+    before_context: Optional[int] = None
+    after_context: Optional[int] = None
+    max_count: Optional[int] = None
+    max_results: Optional[int] = None
+    offset: Optional[int] = None
+    cursor: Optional[str] = None
+    details: Optional[bool] = None
+    sort: Optional[str] = None
+    reverse: Optional[bool] = None
+    limit: Optional[int] = None
+    git_ignore: Optional[bool] = None
+    paths: Optional[List[str | Dict[str, Any]]] = None
+    replacement: Optional[str] = None
+    glob: Optional[str] = None
+    dry_run: Optional[bool] = None
+    version: Optional[str] = None
+    max_line_chars: Optional[int] = None
+    column_range: Optional[List[int]] = None
+    type: Optional[str] = None
+    min_size: Optional[int | str] = None
+    max_size: Optional[int | str] = None
+    newer_than: Optional[float | str] = None
+    older_than: Optional[float | str] = None
+    max_depth: Optional[int] = None
+
+
+class GrepRequest(BaseModel):
+    pattern: str
+    path: str = "."
+    case_sensitive: bool = True
+    recursive: bool = True
+    before_context: int = 0
+    after_context: int = 0
+    max_count: Optional[int] = None
+    max_results: Optional[int] = None
+    offset: int = 0
+    cursor: Optional[str] = None
+    git_ignore: bool = True
+
+
+class FindRequest(BaseModel):
+    path: str = "."
+    pattern: Optional[str] = None
+    type: Optional[str] = None
+    min_size: Optional[int | str] = None
+    max_size: Optional[int | str] = None
+    newer_than: Optional[float | str] = None
+    older_than: Optional[float | str] = None
+    max_depth: Optional[int] = None
+    limit: Optional[int] = None
+    details: bool = False
+    git_ignore: bool = False
+
+
+class SnapshotRequest(BaseModel):
+    label: Optional[str] = None
 
 
 class ToolResponse(BaseModel):
@@ -1264,6 +6412,7 @@ class ToolResponse(BaseModel):
     error: Optional[str] = None
     base64_image: Optional[str] = None
     system: Optional[str] = None
+    version: Optional[str] = None
 
 
 # Helper function
@@ -1272,7 +6421,8 @@ def _tool_result_to_response(result: ToolResult) -> Dict[str, Any]:
         "output": result.output,
         "error": result.error,
         "base64_image": result.base64_image,
-        "system": result.system
+        "system": result.system,
+        "version": result.version
     }
 
 
@@ -1300,6 +6450,85 @@ async def file_action(request: FileRequest):
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
+@app.post("/grep/stream")
+async def grep_stream(request: GrepRequest):
+    """Stream grep results as NDJSON: one object per match or context line, then a summary"""
+    try:
+        stream = await file_tool.grep_lines(
+            request.pattern,
+            request.path,
+            request.case_sensitive,
+            request.recursive,
+            request.before_context,
+            request.after_context,
+            request.max_count,
+            request.git_ignore,
+        )
+        pager = _GrepPager(
+            file_tool.base_path,
+            request.max_results,
+            request.offset,
+            request.cursor,
+            request.before_context,
+            request.after_context,
+        )
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def generate():
+        async for file_path, line_no, line, is_match in pager(stream):
+            yield json.dumps({
+                "type": "match" if is_match else "context",
+                "file": str(Path(file_path).relative_to(file_tool.base_path)),
+                "line_number": line_no,
+                "content": line,
+            }) + "\n"
+        yield json.dumps({"type": "summary", "matches": pager.matches, "next_cursor": pager.next_cursor}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/find/stream")
+async def find_stream(request: FindRequest):
+    """Stream find results as NDJSON: one object per entry as it is found, then a summary"""
+    if request.limit is not None and request.limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    try:
+        stream = await file_tool.find_entries(
+            request.path,
+            request.pattern,
+            request.type,
+            request.min_size,
+            request.max_size,
+            request.newer_than,
+            request.older_than,
+            request.max_depth,
+            request.git_ignore,
+            request.details,
+        )
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def generate():
+        count = 0
+        truncated = False
+        try:
+            async for entry in stream:
+                if request.limit is not None and count >= request.limit:
+                    truncated = True
+                    break
+                count += 1
+                item = {"type": "directory" if entry.is_dir else "file", "path": entry.name}
+                if entry.size is not None:
+                    item.update(size=entry.size, mtime=entry.mtime)
+                yield json.dumps(item) + "\n"
+        finally:
+            await stream.aclose()
+        yield json.dumps({"type": "summary", "count": count, "truncated": truncated}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @app.websocket("/bash/ws")
 async def bash_websocket(websocket: WebSocket):
     """WebSocket endpoint providing live bash output suitable for xterm.js clients."""
@@ -1336,102 +6565,398 @@ async def bash_websocket(websocket: WebSocket):
             bash_tool._sessions.pop(session_id, None)
 
 
+@app.websocket("/fs/watch")
+async def fs_watch_websocket(websocket: WebSocket):
+    """WebSocket endpoint pushing coalesced create/modify/delete/move events for subscribed path prefixes.
+
+    Clients send {"subscribe": [prefixes], "since": generation, "server_id": id}; "since" and
+    "server_id" (from the hello message) are optional and resume a previous connection.
+    """
+    await websocket.accept()
+    await fs_events.start()
+    subscription = _FsSubscription()
+    fs_events.subscribe(subscription)
+
+    async def receive():
+        while True:
+            message = await websocket.receive_json()
+            prefixes = message.get("subscribe") if isinstance(message, dict) else None
+            if not isinstance(prefixes, list):
+                await websocket.send_json({"type": "error", "message": "Expected {\"subscribe\": [path prefixes]}"})
+                continue
+            since = message.get("since")
+            if since is not None:
+                try:
+                    since = int(since)
+                except (TypeError, ValueError):
+                    await websocket.send_json({"type": "error", "message": "Expected \"since\" to be a generation number"})
+                    continue
+            subscription.set_prefixes([str(p) for p in prefixes])
+            if since is None:
+                continue
+            missed = fs_events.replay(subscription, since, message.get("server_id"))
+            # Queued events are covered by the replay (or superseded by the resync)
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            if missed is None:
+                await websocket.send_json({"type": "resync", "generation": fs_events.generation})
+                continue
+            for event in missed:
+                try:
+                    subscription.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+
+    async def send():
+        while True:
+            event = await subscription.queue.get()
+            if subscription.overflowed:
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.overflowed = False
+                await websocket.send_json({"type": "resync", "generation": fs_events.generation})
+                continue
+            await websocket.send_json(event)
+
+    await websocket.send_json({"type": "hello", "server_id": fs_events.server_id, "generation": fs_events.generation})
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        fs_events.unsubscribe(subscription)
+
+
+@app.post("/append/{file_path:path}", response_model=ToolResponse)
+async def append_to_file(
+    file_path: str,
+    request: Request,
+    ack: str = "written",
+    flush_interval: Optional[float] = None,
+    flush_bytes: Optional[int] = None,
+    fsync: bool = False,
+):
+    """Append the raw request body to a file through its buffered append channel.
+
+    Appends arriving together are coalesced into one write. With the default ack=written the
+    response is sent once the data is in the file, so a client waiting for each response sees its
+    appends land in order; ack=buffered answers at once, ack=synced after the flush's fsync.
+    flush_interval, flush_bytes and fsync configure a channel when it is opened.
+    """
+    try:
+        channel = await file_tool.append_channel(file_path, flush_interval, flush_bytes, fsync)
+        seq = await channel.append(await request.body(), ack)
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _tool_result_to_response(ToolResult(output=f"Appended to file {file_path}", system=f"Append {seq} {ack}"))
+
+
+@app.websocket("/append/ws")
+async def append_websocket(websocket: WebSocket):
+    """WebSocket endpoint streaming appends to one file through its buffered append channel.
+
+    Clients first send {"path": path} with optional "flush_interval", "flush_bytes" and "fsync";
+    every later message, text or binary, is appended in order. After each flush the server sends
+    {"type": "ack", "written": n, "synced": n}, counting this connection's messages. Messages are
+    read no faster than the channel can write them.
+
+    If a flush fails the server sends {"type": "error", "message": ..., "written": n, "synced": n}
+    and closes the connection. The data in that flush is dropped, not retried; everything after
+    the last acknowledged message should be treated as lost.
+    """
+    await websocket.accept()
+    try:
+        options = await websocket.receive_json()
+        channel = await file_tool.append_channel(
+            str(options["path"]), options.get("flush_interval"), options.get("flush_bytes"), bool(options.get("fsync"))
+        )
+    except (ToolError, KeyError, TypeError, ValueError) as e:
+        await websocket.send_json({"type": "error", "message": f"Expected {{\"path\": path}}: {str(e)}"})
+        await websocket.close()
+        return
+
+    unwritten: deque = deque()  # Channel sequence numbers of this connection's appends, not yet written
+    unsynced: deque = deque()
+    flushes: asyncio.Queue = asyncio.Queue()
+
+    def on_flush(_channel: _AppendChannel, error: str | None) -> None:
+        flushes.put_nowait(error)
+
+    async def receive():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                data = (message.get("text") or "").encode("utf-8")
+            seq = await channel.append(data)
+            unwritten.append(seq)
+            unsynced.append(seq)
+
+    async def send():
+        written = synced = 0
+        while True:
+            error = await flushes.get()
+            if error is not None:
+                await websocket.send_json({"type": "error", "message": error, "written": written, "synced": synced})
+                return
+            acked = (written, synced)
+            while unwritten and unwritten[0] <= channel.written:
+                unwritten.popleft()
+                written += 1
+            while unsynced and unsynced[0] <= channel.synced:
+                unsynced.popleft()
+                synced += 1
+            if (written, synced) != acked:
+                await websocket.send_json({"type": "ack", "written": written, "synced": synced})
+
+    channel.add_listener(on_flush)
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        channel.remove_listener(on_flush)
+
+
 @app.get("/status")
 async def get_status():
     return {"status": "ok", "service": "bash-and-file-tool-api"}
 
 
-@app.get("/list-files")
-async def list_files(git_ignore: bool = False):
+@app.get("/archive/{archive_path:path}")
+async def get_archive(archive_path: str, format: Optional[str] = None, git_ignore: bool = False):
+    """Stream a workspace file or directory as a tar, tar.gz, tar.zst or zip archive"""
     try:
-        items: List[Dict[str, Any]] = []
-        try:
-            # Fast path: ripgrep respects nested .gitignore files
-            rg_cmd = [
-                "rg",
-                "--files",
-                "--hidden",
-                "--color",
-                "never",
-            ]
-            if not git_ignore:
-                rg_cmd.append("--no-ignore")
+        chunks, filename, media_type = await file_tool.archive(archive_path or ".", format, git_ignore)
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        chunks, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
-            proc = await asyncio.create_subprocess_exec(
-                *rg_cmd,
-                cwd=str(WORKSPACE_DIR),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            stdout, stderr = await proc.communicate()
 
-            if proc.returncode != 0:
-                raise RuntimeError(
-                    f"ripgrep failed with code {proc.returncode}: {stderr.decode().strip()}"
-                )
+@app.post("/archive/{archive_path:path}", response_model=ToolResponse)
+async def post_archive(archive_path: str, request: Request, format: Optional[str] = None):
+    """Extract an archive streamed in the request body into a workspace directory"""
+    try:
+        result = await file_tool.extract(archive_path or ".", request.stream(), format)
+        return _tool_result_to_response(result)
+    except ToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-            all_paths = [WORKSPACE_DIR / Path(p.strip()) for p in stdout.decode().splitlines() if p.strip()]
-        except Exception:
-            # Fallback to Python walk if ripgrep is unavailable or errors
-            all_paths = await asyncio.to_thread(list, WORKSPACE_DIR.rglob('*'))
-         
-        for item_path in all_paths:
-            # Check if path should be excluded
-            if _is_excluded_path(item_path):
-                continue
-            
-            is_dir = await aiofiles.os.path.isdir(str(item_path))
-            relative_path = item_path.relative_to(WORKSPACE_DIR)
-            
-            item_info = {
-                "name": item_path.name,
-                "path": str(item_path),
-                "relative_path": str(relative_path),
-                "type": "directory" if is_dir else "file"
-            }
-            items.append(item_info)
-         
-        # Sort items by relative path
-        items.sort(key=lambda x: x["relative_path"])
-         
-        return {
-            "workspace_path": str(WORKSPACE_DIR),
-            "total_items": len(items),
-            "items": items
-        }
+
+@app.get("/git/status")
+async def get_git_status():
+    """Report git status of the workspace against .gitscout, from memory where nothing changed"""
+    try:
+        result = await workspace_git.status()
+    except ToolError as e:
+        raise HTTPException(status_code=500, detail=f"Error reading git status: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No {GIT_DIR_NAME} repository")
+    return result
+
+
+@app.get("/git/diff")
+async def get_git_diff(path: str = "", staged: bool = False):
+    """Diff the workspace against the .gitscout index (or the index against HEAD when staged), cached until it changes"""
+    full_path = await asyncio.to_thread((WORKSPACE_DIR / path).resolve)
+    rel = workspace_paths.relative(full_path)
+    if rel is None:
+        raise HTTPException(status_code=403, detail="Access denied: Path outside workspace")
+    try:
+        result = await workspace_git.diff(rel, staged)
+    except ToolError as e:
+        raise HTTPException(status_code=500, detail=f"Error reading git diff: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"No {GIT_DIR_NAME} repository")
+    diff, truncated = result
+    return {"path": rel, "staged": staged, "diff": diff, "truncated": truncated}
+
+
+@app.get("/snapshots")
+async def list_snapshots():
+    """List workspace snapshots, oldest first"""
+    try:
+        return {"snapshots": await snapshot_store.list()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing snapshots: {str(e)}")
+
+
+@app.post("/snapshots")
+async def create_snapshot(request: SnapshotRequest):
+    """Take a content-addressed snapshot of the workspace"""
+    try:
+        return await snapshot_store.create(request.label)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating snapshot: {str(e)}")
+
+
+@app.post("/snapshots/{snapshot_id}/restore")
+async def restore_snapshot(snapshot_id: int):
+    """Restore the workspace to a snapshot, rewriting only the files that differ"""
+    try:
+        result = await snapshot_store.restore(snapshot_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error restoring snapshot: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return result
+
+
+@app.delete("/snapshots/{snapshot_id}")
+async def delete_snapshot(snapshot_id: int):
+    """Delete a snapshot and the stored contents no other snapshot uses"""
+    try:
+        deleted = await snapshot_store.delete(snapshot_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting snapshot: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return {"deleted": snapshot_id}
+
+
+@app.get("/operations")
+async def get_operations():
+    """List copy and move operations in progress"""
+    return {"operations": file_tool.operations()}
+
+
+@app.get("/list-files")
+async def list_files(request: Request, git_ignore: bool = False):
+    """List workspace files from the in-memory tree; unchanged listings return 304 Not Modified"""
+    try:
+        body, etag = await workspace_tree.listing(git_ignore)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
 
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Workspace-Generation": str(workspace_tree.generation),
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/fuzzy-files")
+async def fuzzy_files(q: str = "", limit: int = FUZZY_DEFAULT_LIMIT, git_ignore: bool = False):
+    """Rank workspace file paths against a quick-open query, fzf style"""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    try:
+        items, scored, complete = await fuzzy_index.search(q, min(limit, FUZZY_MAX_LIMIT), git_ignore)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching files: {str(e)}")
+    return {
+        "query": q,
+        "items": items,
+        "scored": scored,
+        "complete": complete,
+        "generation": workspace_tree.generation,
+    }
+
+
+@app.get("/du")
+@app.get("/du/{dir_path:path}")
+async def get_disk_usage(dir_path: str = "", depth: int = 1, top: int = DU_DEFAULT_TOP, apparent: bool = False):
+    """Report a directory's size and file count, with its largest subdirectories and files, like du"""
+    if depth < 0 or top < 0:
+        raise HTTPException(status_code=400, detail="depth and top must not be negative")
+    full_path = await asyncio.to_thread((WORKSPACE_DIR / dir_path).resolve)
+    rel = workspace_paths.relative(full_path)
+    if rel is None:
+        raise HTTPException(status_code=403, detail="Access denied: Path outside workspace")
+    try:
+        usage = await disk_usage.usage(rel, depth, min(top, DU_MAX_TOP), apparent)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing disk usage: {str(e)}")
+    if usage is None:
+        if await aiofiles.os.path.exists(str(full_path)):
+            raise HTTPException(status_code=400, detail="Path is not a directory")
+        raise HTTPException(status_code=404, detail="Directory not found")
+    return usage
+
 
 @app.get("/file/{file_path:path}")
-async def get_file(file_path: str):
-    """Get a specific file from the workspace"""
+async def get_file(
+    file_path: str,
+    request: Request,
+    w: Optional[int] = None,
+    h: Optional[int] = None,
+    fmt: Optional[str] = None,
+):
+    """Get a specific file from the workspace, honouring If-None-Match/If-Modified-Since.
+
+    Images can be requested resized to fit w x h and re-encoded as fmt (jpeg, webp or png).
+    """
     try:
         full_path = WORKSPACE_DIR / file_path
         
         # Security check: ensure the path is within workspace
         full_path = await asyncio.to_thread(full_path.resolve)
-        workspace_resolved = await asyncio.to_thread(WORKSPACE_DIR.resolve)
-        if not str(full_path).startswith(str(workspace_resolved)):
+        if workspace_paths.relative(full_path) is None:
             raise HTTPException(status_code=403, detail="Access denied: Path outside workspace")
         
         # Check if file is excluded
-        if _is_excluded_path(full_path):
+        if workspace_paths.is_excluded(full_path):
             raise HTTPException(status_code=403, detail="Access denied: File is excluded from serving")
         
-        if not await aiofiles.os.path.exists(str(full_path)):
+        try:
+            st = await aiofiles.os.stat(str(full_path))
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail="File not found")
         
-        if not await aiofiles.os.path.isfile(str(full_path)):
+        if not stat.S_ISREG(st.st_mode):
             raise HTTPException(status_code=400, detail="Path is not a file")
         
-        return FileResponse(path=str(full_path), filename=full_path.name)
+        if w is not None or h is not None or fmt is not None:
+            width, height, fmt = _parse_image_options(w, h, fmt, full_path)
+            return await _image_variant_response(request.headers, str(full_path), st, width, height, fmt)
+
+        return await _conditional_file_response(request.headers, str(full_path), st, filename=full_path.name)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
 
 
+@app.get("/file-tail/{file_path:path}")
+async def tail_file(file_path: str, lines: int = 10):
+    """Follow a file like tail -F, as server-sent events.
+
+    A "start" event is followed by "append" events carrying {"offset", "text"}: first the last
+    *lines* lines, then whatever is appended, as inotify reports it. "truncate" and "rotate" events
+    mark the file being truncated or replaced, after which it is followed from its start again.
+    """
+    full_path = await asyncio.to_thread((WORKSPACE_DIR / file_path).resolve)
+    rel = workspace_paths.relative(full_path)
+    if rel is None:
+        raise HTTPException(status_code=403, detail="Access denied: Path outside workspace")
+    if workspace_paths.is_excluded(full_path):
+        raise HTTPException(status_code=403, detail="Access denied: File is excluded from serving")
+    try:
+        st = await aiofiles.os.stat(str(full_path))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=400, detail="Path is not a file")
+
+    # Watcher events name paths under WORKSPACE_DIR as given, not resolved
+    watched_path = WORKSPACE_DIR / rel
+    return StreamingResponse(
+        _follow_file(watched_path, lines, workspace_watcher),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/")
 async def root():
     return {
@@ -1440,9 +6965,26 @@ async def root():
         "endpoints": [
             {"path": "/bash", "method": "POST", "description": "Execute bash commands"},
             {"path": "/file", "method": "POST", "description": "File operations (read, write, create, delete, etc.)"},
+            {"path": "/grep/stream", "method": "POST", "description": "Stream grep results as NDJSON with pagination"},
+            {"path": "/find/stream", "method": "POST", "description": "Stream find results as NDJSON as they are found"},
+            {"path": "/append/{path}", "method": "POST", "description": "Append to a file through a coalescing append channel"},
+            {"path": "/append/ws", "method": "WEBSOCKET", "description": "Stream appends to one file with per-append acknowledgements"},
+            {"path": "/fs/watch", "method": "WEBSOCKET", "description": "Push filesystem change events for subscribed paths"},
             {"path": "/status", "method": "GET", "description": "Check service status"},
+            {"path": "/archive/{path}", "method": "GET", "description": "Download a file or directory as a streamed archive"},
+            {"path": "/archive/{path}", "method": "POST", "description": "Extract an uploaded archive into a directory"},
+            {"path": "/operations", "method": "GET", "description": "Show progress of running copy and move operations"},
+            {"path": "/snapshots", "method": "GET", "description": "List workspace snapshots"},
+            {"path": "/snapshots", "method": "POST", "description": "Take a content-addressed snapshot of the workspace"},
+            {"path": "/snapshots/{id}/restore", "method": "POST", "description": "Restore the workspace to a snapshot"},
+            {"path": "/snapshots/{id}", "method": "DELETE", "description": "Delete a snapshot"},
+            {"path": "/git/status", "method": "GET", "description": "Git status of the workspace against its .gitscout repository"},
+            {"path": "/git/diff", "method": "GET", "description": "Diff the workspace against the .gitscout index, or the index against HEAD"},
             {"path": "/list-files", "method": "GET", "description": "List all files and directories recursively in /project/workspace"},
+            {"path": "/fuzzy-files", "method": "GET", "description": "Rank workspace file paths against a quick-open query"},
+            {"path": "/du/{path}", "method": "GET", "description": "Report a directory's size, file count and largest entries"},
             {"path": "/file/{file_path}", "method": "GET", "description": "Get a specific file"},
+            {"path": "/file-tail/{file_path}", "method": "GET", "description": "Follow a file like tail -F as server-sent events"},
             {"path": "/static", "description": "Static file server (browse to /static)"},
             {"path": "/docs", "method": "GET", "description": "API documentation"}
         ]
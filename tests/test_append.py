@@ -0,0 +1,65 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+def test_appends_wait_once_writes_fall_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(bash_server, "APPEND_MAX_BUFFERED", 2)
+    path = tmp_path / "log"
+    channel = bash_server._AppendChannel(path, flush_interval=10, flush_bytes=4)
+    gate = threading.Event()
+    write = channel._write
+
+    def slow_write(data, sync):
+        gate.wait(5)
+        write(data, sync)
+
+    channel._write = slow_write
+
+    async def main():
+        await channel.append(b"aaaa")
+        await asyncio.sleep(0.05)  # The first flush is now stuck writing
+        for _ in range(2):
+            await channel.append(b"bbbb")
+        blocked = asyncio.create_task(channel.append(b"cccc"))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        assert len(channel._buffer) == 8
+        gate.set()
+        await blocked
+        await channel.flush()
+
+    try:
+        asyncio.run(main())
+    finally:
+        gate.set()
+    assert path.read_bytes() == b"aaaabbbbbbbbcccc"
+
+
+def test_failed_flush_drops_its_data_and_reports_the_error(tmp_path):
+    channel = bash_server._AppendChannel(tmp_path / "missing" / "log", flush_interval=10)
+    errors = []
+    channel.add_listener(lambda _channel, error: errors.append(error))
+
+    async def append(data):
+        pending = asyncio.create_task(channel.append(data, ack="written"))
+        await asyncio.sleep(0)
+        await channel.flush()
+        return await pending
+
+    async def main():
+        with pytest.raises(bash_server.ToolError, match="Failed to append"):
+            await append(b"lost")
+        (tmp_path / "missing").mkdir()
+        await append(b"kept")
+
+    asyncio.run(main())
+    assert errors[0] is not None and errors[1] is None
+    assert (tmp_path / "missing" / "log").read_bytes() == b"kept"
@@ -0,0 +1,73 @@
+import io
+import os
+import tarfile
+import tempfile
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+def _tar(*members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for info, data in members:
+            tar.addfile(info, io.BytesIO(data) if data is not None else None)
+    buffer.seek(0)
+    return buffer
+
+
+def _file(name, data=b"data"):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    return info, data
+
+
+def _link(name, target, kind=tarfile.SYMTYPE):
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.linkname = target
+    return info, None
+
+
+def _extract(tmp_path, archive):
+    (tmp_path / "bash_server.py").write_text("original")
+    matcher = bash_server._PathMatcher(tmp_path)
+    return bash_server._extract_archive(archive, "tar", tmp_path, matcher.is_excluded)
+
+
+def test_absolute_member_cannot_overwrite_excluded_file(tmp_path):
+    extracted, skipped = _extract(tmp_path, _tar(_file("/bash_server.py", b"evil"), _file("/ok.txt")))
+    assert (tmp_path / "bash_server.py").read_text() == "original"
+    assert skipped == ["/bash_server.py"]
+    assert extracted == ["/ok.txt"]
+    assert (tmp_path / "ok.txt").read_bytes() == b"data"
+
+
+def test_member_outside_destination_is_skipped_not_fatal(tmp_path):
+    extracted, skipped = _extract(tmp_path, _tar(_file("../evil.txt"), _file("kept.txt")))
+    assert skipped == ["../evil.txt"]
+    assert extracted == ["kept.txt"]
+    assert not (tmp_path.parent / "evil.txt").exists()
+
+
+def test_links_out_of_destination_or_to_excluded_files_are_skipped(tmp_path):
+    archive = _tar(
+        _link("abs_symlink", "/etc/passwd"),
+        _link("up_symlink", "../outside"),
+        _link("abs_hardlink", "/bash_server.py", tarfile.LNKTYPE),
+        _link("hardlink", "bash_server.py", tarfile.LNKTYPE),
+        _file("kept.txt"),
+    )
+    extracted, skipped = _extract(tmp_path, archive)
+    assert skipped == ["abs_symlink", "up_symlink", "abs_hardlink", "hardlink"]
+    assert extracted == ["kept.txt"]
+    assert sorted(os.listdir(tmp_path)) == ["bash_server.py", "kept.txt"]
+
+
+def test_member_written_through_earlier_symlink_is_checked_where_it_lands(tmp_path):
+    archive = _tar(_link("a", "."), _file("a/bash_server.py", b"evil"), _link("b", "a/bash_server.py"))
+    extracted, skipped = _extract(tmp_path, archive)
+    assert (tmp_path / "bash_server.py").read_text() == "original"
+    assert extracted == ["a"]
+    assert skipped == ["a/bash_server.py", "b"]
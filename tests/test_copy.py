@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+def test_kernel_copy_returning_nothing_falls_back(tmp_path, monkeypatch):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(b"x" * 100_000)
+    monkeypatch.setattr(bash_server, "_copy_unsupported", {("reflink", *(src.stat().st_dev,) * 2)})
+    monkeypatch.setattr(os, "copy_file_range", lambda *args: 0)
+    method = bash_server._copy_file(str(src), str(dst), src.stat())
+    assert method != "copy_file_range"
+    assert dst.read_bytes() == src.read_bytes()
+    assert ("copy_file_range", *(src.stat().st_dev,) * 2) in bash_server._copy_unsupported
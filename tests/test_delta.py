@@ -0,0 +1,56 @@
+import asyncio
+import os
+import random
+import re
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+def _apply(old, delta):
+    """Rebuild the new lines from the old ones and a delta rendered by _format_delta."""
+    new, i = [], 0
+    for hunk in re.split(r"^(?=@@ )", delta, flags=re.M):
+        if not hunk:
+            continue
+        header, *body = hunk.rstrip("\n").split("\n")
+        a_start, a_len = map(int, re.match(r"@@ -(\d+),(\d+)", header).groups())
+        start = a_start - 1 if a_len else a_start  # An empty side names the line before it
+        new.extend(old[i:start])
+        assert [line[1:] for line in body if line.startswith("-")] == old[start:start + a_len]
+        new.extend(line[1:] for line in body if line.startswith("+"))
+        i = start + a_len
+    return new + old[i:]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_delta_round_trips(seed):
+    rng = random.Random(seed)
+    old = [rng.choice("abcde") for _ in range(rng.randrange(0, 30))]
+    new = list(old)
+    for _ in range(rng.randrange(0, 8)):
+        at = rng.randrange(0, len(new) + 1)
+        if new and rng.random() < 0.5:
+            del new[at:at + rng.randrange(1, 4)]
+        else:
+            new[at:at] = [rng.choice("abcxyz") for _ in range(rng.randrange(1, 4))]
+    regions = bash_server._myers_diff(old, new)
+    assert _apply(old, bash_server._format_delta(old, new, regions)) == new
+    assert all(a0 < a1 or b0 < b1 for a0, a1, b0, b1 in regions)
+
+
+def test_diff_gives_up_past_max_edits():
+    assert bash_server._myers_diff(list("abcdef"), list("uvwxyz"), max_edits=3) is None
+    assert bash_server._myers_diff(list("abc"), list("abc")) == []
+
+
+def test_write_over_a_file_returns_the_changed_hunks(tmp_path):
+    tool = bash_server.FileTool(base_path=tmp_path, journal=bash_server._EditJournal(tmp_path / "journal.db"))
+    (tmp_path / "a.txt").write_text("one\ntwo\nthree\n")
+    result = asyncio.run(tool.write("a.txt", "one\n2\nthree\n"))
+    assert result.output == "File written to a.txt\n@@ -2,1 +2,1 @@\n-two\n+2"
+    assert asyncio.run(tool.write("new.txt", "x\n")).output == "File written to new.txt"
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def tool(tmp_path):
+    (tmp_path / "a.txt").write_text("")
+    (tmp_path / "b.txt").write_text("")
+    return bash_server.FileTool(base_path=tmp_path, journal=bash_server._EditJournal(tmp_path / "journal.db"))
+
+
+def test_find_stops_at_limit(tool):
+    result = asyncio.run(tool.find(".", pattern="*.txt", limit=1))
+    assert result.output in ("a.txt", "b.txt")
+    assert result.system == "Showing the first 1 entries found; more match"
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_find_rejects_limits_below_one(tool, limit):
+    with pytest.raises(bash_server.ToolError, match="limit must be at least 1"):
+        asyncio.run(tool.find(".", limit=limit))
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_find_stream_rejects_limits_below_one(limit):
+    response = TestClient(bash_server.app).post("/find/stream", json={"limit": limit})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "limit must be at least 1"
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.mark.parametrize("since", ["soon", [1], {"n": 1}])
+def test_invalid_since_is_reported_and_the_connection_stays_open(since):
+    with TestClient(bash_server.app).websocket_connect("/fs/watch") as websocket:
+        generation = websocket.receive_json()["generation"]
+        websocket.send_json({"subscribe": ["."], "since": since})
+        assert websocket.receive_json() == {"type": "error", "message": "Expected \"since\" to be a generation number"}
+        websocket.send_json({"subscribe": ["."], "since": generation, "server_id": "another server"})
+        assert websocket.receive_json()["type"] == "resync"
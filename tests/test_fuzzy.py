@@ -0,0 +1,27 @@
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+def _search(tmp_path, paths, query):
+    for path in paths:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    index = bash_server._FuzzyIndex(bash_server._WorkspaceTree(tmp_path))
+    return asyncio.run(index.search(query))[0]
+
+
+def test_case_folding_that_changes_length_keeps_paths_aligned(tmp_path):
+    items = _search(tmp_path, ["İx/aa.py", "src/main.py"], "main")
+    assert [item["path"] for item in items] == ["src/main.py"]
+    assert items[0]["positions"] == [4, 5, 6, 7]
+
+
+def test_paths_after_a_length_changing_character_still_match_case_insensitively(tmp_path):
+    items = _search(tmp_path, ["İSTANBUL/Main.py"], "main")
+    assert [item["path"] for item in items] == ["İSTANBUL/Main.py"]
+    assert items[0]["positions"] == [9, 10, 11, 12]
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    path = tmp_path / "ws"
+    path.mkdir()
+    (path / "a.txt").write_text("one\ntwo\n")
+    return path
+
+
+def _tool(workspace, db_path):
+    return bash_server.FileTool(base_path=workspace, journal=bash_server._EditJournal(db_path))
+
+
+def test_undo_and_redo_are_shared_between_workers(workspace, tmp_path):
+    first, second = _tool(workspace, tmp_path / "journal.db"), _tool(workspace, tmp_path / "journal.db")
+    path = workspace / "a.txt"
+    asyncio.run(first.replace("a.txt", "two", "2"))
+    asyncio.run(first.insert("a.txt", 1, "zero"))
+    assert path.read_text() == "zero\none\n2\n"
+
+    asyncio.run(second.undo("a.txt"))
+    assert path.read_text() == "one\n2\n"
+    asyncio.run(first.undo("a.txt"))
+    assert path.read_text() == "one\ntwo\n"
+    with pytest.raises(bash_server.ToolError, match="No undo history"):
+        asyncio.run(second.undo("a.txt"))
+
+    asyncio.run(second.redo("a.txt"))
+    assert path.read_text() == "one\n2\n"
+    asyncio.run(first.redo("a.txt"))
+    assert path.read_text() == "zero\none\n2\n"
+
+
+def test_edit_since_an_entry_blocks_undoing_it(workspace, tmp_path):
+    tool = _tool(workspace, tmp_path / "journal.db")
+    asyncio.run(tool.replace("a.txt", "two", "2"))
+    (workspace / "a.txt").write_text("changed elsewhere\n")
+    with pytest.raises(bash_server.ToolError, match="File changed since this edit"):
+        asyncio.run(tool.undo("a.txt"))
+    assert (workspace / "a.txt").read_text() == "changed elsewhere\n"
+
+
+def test_journal_from_before_sizes_is_migrated(workspace, tmp_path):
+    db_path = tmp_path / "journal.db"
+    path = str(workspace / "a.txt")
+    with sqlite3.connect(db_path) as db:
+        db.executescript("""
+            CREATE TABLE edits (
+                id INTEGER PRIMARY KEY, path TEXT NOT NULL, undone INTEGER NOT NULL, version TEXT NOT NULL,
+                kind TEXT NOT NULL, data BLOB NOT NULL, created REAL NOT NULL
+            );
+            CREATE INDEX edits_path ON edits (path, undone, id);
+        """)
+        version = bash_server._content_version(b"one\ntwo\n")
+        db.execute(
+            "INSERT INTO edits (path, undone, version, kind, data, created) VALUES (?, 0, ?, 'text', ?, ?)",
+            (path, version, zlib.compress(b"before\n"), time.time()),
+        )
+
+    tool = _tool(workspace, db_path)
+    asyncio.run(tool.undo("a.txt"))
+    assert (workspace / "a.txt").read_text() == "before\n"
+    asyncio.run(tool.replace("a.txt", "before", "after"))  # Recording needs the new column
+    assert (workspace / "a.txt").read_text() == "after\n"
+    asyncio.run(tool.undo("a.txt"))
+    assert (workspace / "a.txt").read_text() == "before\n"
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("PRAGMA user_version").fetchone()[0] == bash_server.JOURNAL_SCHEMA_VERSION
+        assert db.execute("SELECT count(*) FROM edits WHERE size = 0").fetchone()[0] == 0
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+ENTRIES = [bash_server._DirEntry(f"f{i:02}", i % 3 == 0, size=(i * 7) % 10, mtime=float(i)) for i in range(25)]
+
+
+def _pages(sort, reverse, limit):
+    names, cursor = [], None
+    while True:
+        page, cursor = bash_server._page_entries(list(ENTRIES), sort, reverse, limit, cursor)
+        names.append([entry.name for entry in page])
+        if cursor is None:
+            return names
+
+
+@pytest.mark.parametrize("sort", ["name", "size", "mtime", "type"])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_pages_follow_on_from_each_other_in_sort_order(sort, reverse):
+    pages = _pages(sort, reverse, 10)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    key = bash_server._entry_sort_key(sort)
+    expected = [entry.name for entry in sorted(ENTRIES, key=key, reverse=reverse)]
+    assert [name for page in pages for name in page] == expected
+
+
+def test_no_cursor_when_everything_fits():
+    page, cursor = bash_server._page_entries(list(ENTRIES), "name", False, 25, None)
+    assert len(page) == 25 and cursor is None
+
+
+def test_cursor_for_another_sort_or_garbage_is_rejected():
+    _, cursor = bash_server._page_entries(list(ENTRIES), "name", False, 10, None)
+    with pytest.raises(bash_server.ToolError, match="Invalid cursor"):
+        bash_server._page_entries(list(ENTRIES), "size", False, 10, cursor)
+    with pytest.raises(bash_server.ToolError, match="Invalid cursor"):
+        bash_server._page_entries(list(ENTRIES), "name", False, 10, "not-a-cursor")
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_list_dir_rejects_limits_below_one(tmp_path, limit):
+    (tmp_path / "a").write_text("")
+    tool = bash_server.FileTool(base_path=tmp_path, journal=bash_server._EditJournal(tmp_path / "journal.db"))
+    with pytest.raises(bash_server.ToolError, match="limit must be at least 1"):
+        asyncio.run(tool.list_dir(".", limit=limit))
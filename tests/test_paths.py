@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A client for a workspace at tmp_path/ws, beside a sibling tmp_path/ws2 that shares its prefix."""
+    workspace = tmp_path / "ws"
+    (workspace / "sub").mkdir(parents=True)
+    (workspace / "sub" / "a.txt").write_text("inside\n")
+    (tmp_path / "ws2").mkdir()
+    (tmp_path / "ws2" / "secret.txt").write_text("secret\n")
+    monkeypatch.setattr(bash_server, "WORKSPACE_DIR", workspace)
+    monkeypatch.setattr(bash_server, "workspace_paths", bash_server._PathMatcher(workspace))
+    return TestClient(bash_server.app)
+
+
+def test_file_rejects_sibling_directory(client):
+    assert client.get("/file/sub/a.txt").text == "inside\n"
+    response = client.get("/file/..%2Fws2%2Fsecret.txt")
+    assert response.status_code == 403
+
+
+def test_file_tail_rejects_sibling_directory(client):
+    assert client.get("/file-tail/sub/missing.txt").status_code == 404
+    response = client.get("/file-tail/..%2Fws2%2Fsecret.txt")
+    assert response.status_code == 403
+
+
+def test_du_rejects_sibling_directory(client):
+    response = client.get("/du/..%2Fws2")
+    assert response.status_code == 403
+
+
+def test_git_diff_rejects_sibling_directory(client):
+    response = client.get("/git/diff", params={"path": "../ws2"})
+    assert response.status_code == 403
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import stat
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+@pytest.fixture
+def tool(tmp_path):
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+    (workspace / "a.py").write_text("foo = 1\nbar = foo\n")
+    (workspace / "b.txt").write_text("nothing here\n")
+    return bash_server.FileTool(base_path=workspace, journal=bash_server._EditJournal(tmp_path / "journal.db"))
+
+
+def test_dry_run_previews_without_writing(tool):
+    result = asyncio.run(tool.replace_across("foo", "baz", dry_run=True))
+    assert result.output == "a.py:1\n- foo = 1\n+ baz = 1\na.py:2\n- bar = foo\n+ bar = baz"
+    assert result.system == "Would replace 2 matches in 1 files"
+    assert (tool.base_path / "a.py").read_text() == "foo = 1\nbar = foo\n"
+
+
+def test_apply_rewrites_keeps_mode_and_can_be_undone(tool):
+    path = tool.base_path / "a.py"
+    path.chmod(0o640)
+    result = asyncio.run(tool.replace_across(r"(\w+) = (\w+)", r"\2 = \1"))
+    assert result.system == "Replaced 2 matches in 1 files"
+    assert path.read_text() == "1 = foo\nfoo = bar\n"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+    assert sorted(os.listdir(tool.base_path)) == ["a.py", "b.txt"]  # No temporary files left behind
+    asyncio.run(tool.undo("a.py"))
+    assert path.read_text() == "foo = 1\nbar = foo\n"
+
+
+def test_symlinks_are_left_alone(tool):
+    link = tool.base_path / "link.py"
+    link.symlink_to("a.py")
+    result = asyncio.run(tool.replace_across("foo", "baz", glob="link.py"))
+    assert result.system == "Replaced 0 matches in 0 files"
+    assert link.is_symlink()
+    assert (tool.base_path / "a.py").read_text() == "foo = 1\nbar = foo\n"
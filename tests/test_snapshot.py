@@ -0,0 +1,143 @@
+import asyncio
+import os
+import stat
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    root = tmp_path / "ws"
+    (root / "src" / "pkg").mkdir(parents=True)
+    (root / "src" / "pkg" / "mod.py").write_text("x = 1\n")
+    (root / "notes.txt").write_text("readme\n")
+    (root / "script.sh").write_text("#!/bin/sh\n")
+    (root / "script.sh").chmod(0o755)
+    (root / "link").symlink_to("notes.txt")
+    return root
+
+
+@pytest.fixture
+def store(workspace, tmp_path):
+    return bash_server._SnapshotStore(workspace, tmp_path / "snapshots")
+
+
+def _state(root):
+    """Everything a restore is responsible for: file contents and modes, symlinks and directories."""
+    state = {}
+    for directory, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(directory, name)
+            rel = os.path.relpath(path, root)
+            if bash_server._is_excluded_root_item(rel.split(os.sep)[0]):
+                continue
+            if os.path.islink(path):
+                state[rel] = ("link", os.readlink(path))
+            elif os.path.isdir(path):
+                state[rel] = ("dir",)
+            else:
+                with open(path, "rb") as f:
+                    state[rel] = ("file", f.read(), stat.S_IMODE(os.lstat(path).st_mode))
+    return state
+
+
+def _objects(store):
+    return sorted(str(path.relative_to(store.objects)) for path in store.objects.rglob("*") if path.is_file())
+
+
+def test_restore_undoes_edits_additions_and_deletions(workspace, store):
+    before = _state(workspace)
+    snapshot = asyncio.run(store.create("before"))
+    (workspace / "src" / "pkg" / "mod.py").write_text("x = 2\n")
+    (workspace / "notes.txt").unlink()
+    (workspace / "script.sh").chmod(0o644)
+    (workspace / "new").mkdir()
+    (workspace / "new" / "file.txt").write_text("new\n")
+
+    result = asyncio.run(store.restore(snapshot["id"]))
+    assert result["failed"] == []
+    assert _state(workspace) == before
+
+
+def test_second_snapshot_reads_only_changed_files(workspace, store):
+    asyncio.run(store.create())
+    (workspace / "notes.txt").write_text("changed\n")
+    assert asyncio.run(store.create())["hashed"] == 1
+
+
+def test_restore_swaps_files_directories_and_symlinks_back(workspace, store):
+    (workspace / "dir_to_link").mkdir()
+    (workspace / "dir_to_link" / "inner").write_text("inner\n")
+    before = _state(workspace)
+    snapshot = asyncio.run(store.create())
+
+    (workspace / "notes.txt").unlink()
+    (workspace / "notes.txt").mkdir()  # File -> directory
+    (workspace / "notes.txt" / "nested").write_text("nested\n")
+    os.remove(workspace / "script.sh")
+    (workspace / "script.sh").symlink_to("src")  # File -> symlink
+    (workspace / "link").unlink()
+    (workspace / "link").mkdir()  # Symlink -> directory
+    for name in ("mod.py",):
+        os.remove(workspace / "src" / "pkg" / name)
+    os.rmdir(workspace / "src" / "pkg")
+    (workspace / "src" / "pkg").write_text("now a file\n")  # Directory -> file
+    (workspace / "dir_to_link" / "inner").unlink()
+    (workspace / "dir_to_link").rmdir()
+    (workspace / "dir_to_link").symlink_to("src")  # Directory -> symlink
+
+    result = asyncio.run(store.restore(snapshot["id"]))
+    assert result["failed"] == []
+    assert _state(workspace) == before
+
+
+def test_version_control_and_excluded_paths_are_left_alone(workspace, store):
+    (workspace / ".git").mkdir()
+    (workspace / ".git" / "HEAD").write_text("ref: main\n")
+    (workspace / "bash_server.py").write_text("server\n")
+    snapshot = asyncio.run(store.create())
+    assert snapshot["files"] == 3  # mod.py, notes.txt, script.sh
+
+    (workspace / ".git" / "HEAD").write_text("ref: other\n")
+    (workspace / "bash_server.py").write_text("server v2\n")
+    asyncio.run(store.restore(snapshot["id"]))
+    assert (workspace / ".git" / "HEAD").read_text() == "ref: other\n"
+    assert (workspace / "bash_server.py").read_text() == "server v2\n"
+
+
+def test_deleting_snapshots_collects_objects_no_other_snapshot_uses(workspace, store):
+    first = asyncio.run(store.create())
+    shared = set(_objects(store))
+    (workspace / "notes.txt").write_text("changed\n")
+    second = asyncio.run(store.create())
+    assert len(_objects(store)) == len(shared) + 1
+
+    assert asyncio.run(store.delete(first["id"]))
+    assert len(_objects(store)) == len(shared)  # The old notes.txt is gone, the rest is still used
+    assert asyncio.run(store.delete(second["id"]))
+    assert _objects(store) == []
+    assert not asyncio.run(store.delete(second["id"]))
+
+
+def test_unreadable_file_is_reported_and_kept_by_restore(workspace, store, monkeypatch):
+    copy_file = bash_server._copy_file
+
+    def unreadable(src, dst, st, *args):
+        if src.endswith("notes.txt"):
+            raise PermissionError(13, "Permission denied", src)
+        return copy_file(src, dst, st, *args)
+
+    monkeypatch.setattr(bash_server, "_copy_file", unreadable)
+    snapshot = asyncio.run(store.create())
+    assert [entry["path"] for entry in snapshot["failed"]] == ["notes.txt"]
+    assert snapshot["files"] == 2
+
+    monkeypatch.setattr(bash_server, "_copy_file", copy_file)
+    (workspace / "notes.txt").write_text("edited since\n")
+    asyncio.run(store.restore(snapshot["id"]))
+    assert (workspace / "notes.txt").read_text() == "edited since\n"
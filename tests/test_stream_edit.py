@@ -0,0 +1,111 @@
+import errno
+import os
+import stat
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+@pytest.fixture(params=[3, 1024 * 1024], ids=["tiny-blocks", "one-block"])
+def block_size(request, monkeypatch):
+    """Run each test with blocks that split lines (and CRLF pairs) as well as with one block per file."""
+    monkeypatch.setattr(bash_server, "EDIT_BLOCK_SIZE", request.param)
+    return request.param
+
+
+def _file(tmp_path, data):
+    path = tmp_path / "f.txt"
+    path.write_bytes(data)
+    return str(path)
+
+
+def _scan(tmp_path, data, wanted):
+    fd = os.open(_file(tmp_path, data), os.O_RDONLY)
+    try:
+        return bash_server._scan_lines(fd, wanted)
+    finally:
+        os.close(fd)
+
+
+def test_scan_lines_finds_spans_ending_and_count(tmp_path, block_size):
+    data = b"ab\r\ncde\r\n\r\nf"
+    assert _scan(tmp_path, data, [1, 3, 4]) == ({1: (0, 4), 3: (9, 11), 4: (11, 12)}, b"\r\n", 4)
+    assert _scan(tmp_path, data, [2]) == ({2: (4, 9)}, b"\r\n", None)  # Stops before the end
+    assert _scan(tmp_path, data, [9]) == ({}, b"\r\n", 4)
+    assert _scan(tmp_path, b"a\nb\n", [3]) == ({}, b"\n", 2)
+    assert _scan(tmp_path, b"", [1]) == ({}, b"\n", 0)
+
+
+@pytest.mark.parametrize("data, line, expected", [
+    (b"a\r\nb\r\n", 2, b"a\r\nnew\r\nb\r\n"),
+    (b"a\r\nb\r\n", 3, b"a\r\nb\r\nnew\r\n"),
+    (b"a\r\nb", 3, b"a\r\nb\r\nnew"),
+    (b"a\nb", 1, b"new\na\nb"),
+    (b"", 1, b"new"),
+])
+def test_insert_keeps_line_endings_byte_exact(tmp_path, block_size, data, line, expected):
+    path = _file(tmp_path, data)
+    backup = bash_server._stream_insert(path, line, "new")
+    with open(path, "rb") as f:
+        assert f.read() == expected
+    assert backup.read_bytes() == data
+
+
+def test_insert_translates_the_text_to_the_file_ending(tmp_path, block_size):
+    path = _file(tmp_path, b"a\r\n")
+    bash_server._stream_insert(path, 1, "x\ny")
+    with open(path, "rb") as f:
+        assert f.read() == b"x\r\ny\r\na\r\n"
+
+
+@pytest.mark.parametrize("line", [0, 4])
+def test_insert_out_of_range_changes_nothing(tmp_path, block_size, line):
+    path = _file(tmp_path, b"a\nb\n")
+    with pytest.raises(bash_server.ToolError, match="out of range"):
+        bash_server._stream_insert(path, line, "new")
+    assert sorted(os.listdir(tmp_path)) == ["f.txt"]
+
+
+@pytest.mark.parametrize("data, lines, expected", [
+    (b"a\r\nb\r\nc\r\n", [2], b"a\r\nc\r\n"),
+    (b"a\r\nb\r\nc\r\n", [1, 2, 3], b""),
+    (b"a\r\nb\r\nc", [3], b"a\r\nb"),
+    (b"a\nb\nc", [2, 3], b"a"),
+    (b"a\nb\nc\n", [3, 7], b"a\nb\n"),
+])
+def test_delete_lines_keeps_line_endings_byte_exact(tmp_path, block_size, data, lines, expected):
+    path = _file(tmp_path, data)
+    backup = bash_server._stream_delete_lines(path, lines)
+    with open(path, "rb") as f:
+        assert f.read() == expected
+    assert backup.read_bytes() == data
+
+
+def test_delete_lines_out_of_range_or_on_empty_file_does_nothing(tmp_path, block_size):
+    assert bash_server._stream_delete_lines(_file(tmp_path, b"a\n"), [5]) is None
+    assert bash_server._stream_delete_lines(_file(tmp_path, b""), [1]) is None
+
+
+def test_restore_across_filesystems_keeps_mode_and_leaves_no_temp_files(tmp_path, monkeypatch):
+    path = tmp_path / "f.txt"
+    path.write_bytes(b"after\n")
+    path.chmod(0o640)
+    backup = tmp_path / "backup"
+    backup.write_bytes(b"before\n")
+    backup.chmod(0o640)
+    replace = os.replace
+
+    def cross_device(src, dst):
+        if str(src) == str(backup):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", cross_device)
+    bash_server._restore_backup(backup, path)
+    assert path.read_bytes() == b"before\n"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+    assert sorted(os.listdir(tmp_path)) == ["f.txt"]
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+def _workspace(tmp_path):
+    (tmp_path / ".gitignore").write_text("node_modules/\n")
+    (tmp_path / "node_modules" / "pkg").mkdir(parents=True)
+    (tmp_path / "node_modules" / "pkg" / "index.js").write_text("")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "main.py").write_text("")
+    return bash_server._WorkspaceTree(tmp_path)
+
+
+def test_gitignored_directories_are_not_walked_until_needed(tmp_path):
+    tree = _workspace(tmp_path)
+    asyncio.run(tree.ensure_built(git_ignore=True))
+    assert isinstance(tree._tree["node_modules"], bash_server._Unwalked)
+    assert sorted(tree.files(git_ignore=True)) == ["src/main.py"]
+    assert tree.entries("node_modules", git_ignore=True) is None  # Falls back to walking the disk
+
+    asyncio.run(tree.ensure_built())
+    assert sorted(tree.files()) == ["node_modules/pkg/index.js", "src/main.py"]
+    assert sorted(tree.files(git_ignore=True)) == ["src/main.py"]
+
+
+def test_changes_inside_unwalked_directories_are_skipped(tmp_path):
+    tree = _workspace(tmp_path)
+    asyncio.run(tree.ensure_built(git_ignore=True))
+    generation = tree.generation
+    (tmp_path / "node_modules" / "other").mkdir()
+    tree._apply([("create", tmp_path / "node_modules" / "other", None)])
+    assert tree.generation == generation
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out.js").write_text("")
+    tree._apply([("create", tmp_path / "build", None)])
+    assert "build/out.js" in tree.files(git_ignore=True)
+
+
+def test_gitignore_change_rebuilds_the_pruned_tree(tmp_path):
+    tree = _workspace(tmp_path)
+    asyncio.run(tree.ensure_built(git_ignore=True))
+    (tmp_path / ".gitignore").write_text("")
+    tree._apply([("modify", tmp_path / ".gitignore", None)])
+    asyncio.run(tree.ensure_built(git_ignore=True))
+    assert sorted(tree.files(git_ignore=True)) == ["node_modules/pkg/index.js", "src/main.py"]
@@ -0,0 +1,33 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+@pytest.fixture
+def tool(tmp_path):
+    return bash_server.FileTool(base_path=tmp_path, journal=bash_server._EditJournal(tmp_path / "journal.db"))
+
+
+def test_windowed_view_without_version_skips_whole_file_work(tool):
+    data = ("é" + "x" * 3_000_000 + "\nshort\n").encode()
+    (tool.base_path / "min.js").write_bytes(data)
+    result = asyncio.run(tool.view("min.js", max_line_chars=5))
+    assert result.output.split("\n")[1] == "     2\tshort"
+    assert result.output.startswith("     1\téxxxx")
+    assert result.version == bash_server._content_version(data)
+    assert tool._versions.get(result.version) is None  # Never decoded into lines to keep
+
+
+def test_windowed_view_with_version_still_returns_a_delta(tool):
+    path = tool.base_path / "a.txt"
+    path.write_text("one\ntwo\n")
+    version = asyncio.run(tool.view("a.txt")).version
+    path.write_text("one\n" + "y" * 100 + "\n")
+    result = asyncio.run(tool.view("a.txt", version=version, max_line_chars=5))
+    assert "two" in result.output and "yyyyy" in result.output and "y" * 6 not in result.output
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("BASH_SERVER_CACHE_DIR", tempfile.mkdtemp())
+
+import bash_server  # noqa: E402
+
+
+async def _until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.02)
+
+
+def test_new_directory_trees_are_watched(tmp_path):
+    async def main():
+        watcher = bash_server._InotifyWatcher(tmp_path)
+        if not await watcher.start():
+            pytest.skip("inotify is unavailable")
+        events = []
+        watcher.add_listener(lambda kind, path, dest=None: events.append((kind, path)))
+        (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+        await _until(lambda: tmp_path / "a" / "b" / "c" in watcher._wds.values())
+        (tmp_path / "a" / "b" / "c" / "f.txt").write_text("x")
+        await _until(lambda: ("create", tmp_path / "a" / "b" / "c" / "f.txt") in events)
+
+    asyncio.run(main())
+
+
+def test_exhausted_watcher_falls_back_to_polling(tmp_path, monkeypatch):
+    async def main():
+        watcher = bash_server._InotifyWatcher(tmp_path)
+        if not await watcher.start():
+            pytest.skip("inotify is unavailable")
+        tree = bash_server._WorkspaceTree(tmp_path, watcher=watcher)
+        await tree.ensure_built()
+        watcher._exhausted = True
+        monkeypatch.setattr(bash_server, "TREE_POLL_TTL", 0.0)
+        watcher.remove_listener(tree.on_change)  # As if the change happened in an unwatched directory
+        (tmp_path / "new.txt").write_text("")
+        await tree.ensure_built()
+        assert tree.files() == ["new.txt"]
+
+    asyncio.run(main())